@@ -0,0 +1,578 @@
+from typing import List, Optional, Tuple
+
+from collections import deque
+from logging import Logger
+import threading
+import math
+
+import numpy as np
+
+from .sensor import Lidar
+from .clock import Clock
+from .dtypes import resolveDType
+from .dataclasses import OverloadPolicy
+
+
+class ScanBuffer(object):
+    """
+    Bounded buffer of timestamped scans produced by a single sensor.
+
+    The buffer is written by the acquisition worker of the sensor and read by
+    the frame assembler of the room, so all access is guarded by a lock which
+    is only held to append to or copy the buffer.
+
+    When the room falls behind the sensor, the overload policy of the buffer
+    decides which scans are dropped. Frames are always assembled from the
+    newest scans, so the scans dropped bound the age of the data processed
+    rather than delaying it.
+    """
+
+    def __init__(self, maxlen: int, capacity: Optional[int] = None,
+                 dtype: Optional[np.dtype] = None,
+                 policy: OverloadPolicy = OverloadPolicy.DROP_OLDEST,
+                 decimation: int = 2, decimate_backlog: int = 2,
+                 clock: Optional[Clock] = None):
+        """
+        :param maxlen: Maximum number of scans held by the buffer.
+        :type maxlen: int
+        :param capacity: Maximum number of samples of a scan. If given, scans
+            are held in preallocated slots which are reused as scans are
+            evicted, instead of being allocated per scan.
+        :type capacity: Optional[int]
+        :param dtype: Data type of the slots, defaults to the dtype policy.
+            Scans pushed of another type are converted as they are copied.
+        :type dtype: Optional[np.dtype]
+        :param policy: The scans kept when the room falls behind.
+        :type policy: OverloadPolicy
+        :param decimation: With the DECIMATE policy, one in how many scans
+            are kept while behind.
+        :type decimation: int
+        :param decimate_backlog: With the DECIMATE policy, the number of
+            scans waiting to be used by a frame from which the room is
+            considered behind.
+        :type decimate_backlog: int
+        :param clock: The clock scans are waited for in, defaults to real
+            time.
+        :type clock: Optional[Clock]
+        """
+
+        self.__policy = policy
+        self.__decimation = max(1, decimation)
+        self.__decimate_backlog = max(1, decimate_backlog)
+        self.__decimate_count = 0
+
+        self.__scans = deque(iterable=[], maxlen=maxlen)
+        self.__lock = threading.Lock()
+        self.__pushed_event = (Clock() if clock is None else clock).event()
+        # Timestamp of the newest scan used by a frame
+        self.__consumed_ts = -math.inf
+
+        # One slot more than scans held, so the producer always has a slot
+        #  which is not referenced by any buffered scan
+        self.__slots = None
+        self.__free: List[int] = []
+        if capacity is not None:
+            self.__slots = np.empty((maxlen + 1, capacity, 2),
+                                    dtype=resolveDType(dtype))
+            self.__free = list(range(0, maxlen + 1))
+
+        self._pushed = 0
+        # Scans never used by any frame, evicted or not kept at all
+        self._dropped = 0
+        self._decimated = 0
+        # Scans the sensor failed to read
+        self._failed = 0
+        return
+
+    @property
+    def policy(self) -> OverloadPolicy:
+        return self.__policy
+
+    def __backlog(self) -> int:
+        """
+        Count the scans not yet used by any frame, with the lock held.
+        """
+
+        n = 0
+        consumed_ts = self.__consumed_ts
+        for scan in reversed(self.__scans):
+            if scan[0] <= consumed_ts:
+                break
+            n += 1
+        return n
+
+    def __evictOldest(self):
+        """
+        Evict the oldest scan, with the lock held.
+        """
+
+        evicted = self.__scans.popleft()
+        # The evicted scan was never used by any frame
+        if evicted[0] > self.__consumed_ts:
+            self._dropped += 1
+        if evicted[2] is not None:
+            self.__free.append(evicted[2])
+        return
+
+    def spare(self) -> Optional[np.ndarray]:
+        """
+        Get the slot the next scan should be written to by the producer.
+
+        :return: An array of shape (capacity, 2), or `None` if the buffer has
+            no preallocated slots.
+        :rtype: Optional[np.ndarray]
+        """
+
+        if self.__slots is None:
+            return None
+        with self.__lock:
+            return self.__slots[self.__free[-1]]
+
+    def push(self, timestamp: float, scan: np.ndarray):
+        """
+        Push a new scan into the buffer, evicting the oldest scan if the
+        buffer is full.
+
+        :param timestamp: Time the scan was completed, in seconds.
+        :type timestamp: float
+        :param scan: The raw scan samples, ideally written to the slot from
+            `spare`, otherwise copied into a slot if the buffer has them.
+        :type scan: np.ndarray
+        """
+
+        with self.__lock:
+            policy = self.__policy
+            # While behind, only one in `decimation` scans is kept, the
+            #  scan left in the spare slot is overwritten by the next
+            if policy is OverloadPolicy.DECIMATE:
+                if self.__backlog() < self.__decimate_backlog:
+                    self.__decimate_count = 0
+                else:
+                    self.__decimate_count += 1
+                    if self.__decimate_count % self.__decimation != 0:
+                        self._dropped += 1
+                        self._decimated += 1
+                        self._pushed += 1
+                        return
+
+            # Take the spare slot before an evicted slot becomes the spare
+            slot = None
+            slots = self.__slots
+            if slots is not None and len(scan) <= slots.shape[1]:
+                slot = self.__free.pop()
+                if not np.may_share_memory(scan, slots[slot]):
+                    np.copyto(slots[slot][0:len(scan)], scan)
+                scan = slots[slot][0:len(scan)]
+
+            scans = self.__scans
+            if policy is OverloadPolicy.LATEST_ONLY:
+                while len(scans) != 0:
+                    self.__evictOldest()
+            elif len(scans) == scans.maxlen:
+                self.__evictOldest()
+            scans.append((timestamp, scan, slot))
+            self._pushed += 1
+        self.__pushed_event.set()
+        return
+
+    def markFailed(self):
+        """
+        Count a scan the sensor failed to read, which is dropped as it never
+        reaches the buffer.
+        """
+
+        with self.__lock:
+            self._failed += 1
+            self._dropped += 1
+        return
+
+    def clear(self):
+        """
+        Discard all buffered scans, such as when they become outdated.
+        """
+
+        with self.__lock:
+            for (_, _, slot) in self.__scans:
+                if slot is not None:
+                    self.__free.insert(0, slot)
+            self.__scans.clear()
+            self.__pushed_event.clear()
+        return
+
+    def waitScan(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the buffer holds a scan not yet used by any frame.
+
+        :return: True if the buffer holds such a scan, false on timeout.
+        :rtype: bool
+        """
+
+        return self.__pushed_event.wait(timeout)
+
+    def timestamps(self) -> List[float]:
+        """
+        Get the timestamps of the buffered scans, ordered from oldest to
+        newest.
+
+        :rtype: List[float]
+        """
+
+        with self.__lock:
+            return [s[0] for s in self.__scans]
+
+    def snapshot(self) -> List[Tuple[float, np.ndarray]]:
+        """
+        Get a copy of the buffered scans.
+
+        Scans held in slots are reused once evicted, so they are copied,
+        unlike with `read`.
+
+        :return: Timestamped scans ordered from oldest to newest.
+        :rtype: List[Tuple[float, np.ndarray]]
+        """
+
+        with self.__lock:
+            return [(s[0], s[1] if s[2] is None else s[1].copy())
+                    for s in self.__scans]
+
+    def read(self, timestamp: float, out: Optional[np.ndarray] = None
+             ) -> Optional[np.ndarray]:
+        """
+        Copy out the buffered scan with the given timestamp.
+
+        :param timestamp: Timestamp of the scan.
+        :type timestamp: float
+        :param out: An array of at least as many rows as the scan to copy to,
+            instead of allocating one.
+        :type out: Optional[np.ndarray]
+        :return: The scan, as a view of `out` if given and large enough, or
+            `None` if the scan was evicted.
+        :rtype: Optional[np.ndarray]
+        """
+
+        with self.__lock:
+            for (ts, scan, _) in self.__scans:
+                if ts == timestamp:
+                    if out is None or len(scan) > len(out):
+                        return scan.copy()
+                    samples = out[0:len(scan)]
+                    np.copyto(samples, scan)
+                    return samples
+        return None
+
+    def markConsumed(self, timestamp: float):
+        """
+        Mark all scans up to and including `timestamp` as used by a frame.
+        Scans older than `timestamp` not yet used are skipped for good, and
+        counted as dropped.
+        """
+
+        with self.__lock:
+            consumed_ts = self.__consumed_ts
+            if timestamp > consumed_ts:
+                self._dropped += sum(1 for scan in self.__scans
+                                     if consumed_ts < scan[0] < timestamp)
+                self.__consumed_ts = timestamp
+                if self.__backlog() == 0:
+                    self.__pushed_event.clear()
+        return
+
+    @property
+    def depth(self) -> int:
+        return len(self.__scans)
+
+    @property
+    def backlog(self) -> int:
+        """
+        Number of buffered scans not yet used by any frame.
+        """
+
+        with self.__lock:
+            return self.__backlog()
+
+
+class SensorAcquisition(object):
+    """
+    Acquisition worker owning a single physical sensor, continuously reading
+    scans from the sensor into its own `ScanBuffer` so that a slow or stalled
+    sensor never delays the others.
+
+    A sensor failing to scan is restarted after a backoff doubling with each
+    consecutive failure, and given up on once it failed too many scans in a
+    row.
+    """
+
+    DEFAULT_RETRY_SEC: float = 0.1
+    DEFAULT_RETRY_MAX_SEC: float = 5.
+    DEFAULT_MAX_FAILURES: int = 10
+
+    def __init__(self, sensor: Lidar, buffer: ScanBuffer,
+                 pause_event: threading.Event,
+                 logger: Logger,
+                 clock: Optional[Clock] = None,
+                 retry_sec: float = DEFAULT_RETRY_SEC,
+                 retry_max_sec: float = DEFAULT_RETRY_MAX_SEC,
+                 max_failures: int = DEFAULT_MAX_FAILURES):
+        """
+        :param sensor: The sensor to read scans from.
+        :type sensor: Lidar
+        :param buffer: The buffer to push timestamped scans to.
+        :type buffer: ScanBuffer
+        :param pause_event: Event which is cleared while the owning room is
+            paused.
+        :type pause_event: threading.Event
+        :param logger: The logger to use for logging.
+        :type logger: logging.Logger
+        :param clock: The clock scans are timestamped in, defaults to real
+            time. Events waited on by the worker must be of the clock.
+        :type clock: Optional[Clock]
+        :param retry_sec: Time to wait before restarting a sensor after its
+            first failed scan, doubled with each consecutive failure.
+        :type retry_sec: float
+        :param retry_max_sec: Maximum time to wait before restarting a
+            sensor.
+        :type retry_max_sec: float
+        :param max_failures: Number of consecutive failed scans after which
+            the sensor is given up on.
+        :type max_failures: int
+        """
+
+        clock = Clock() if clock is None else clock
+        self.__clock = clock
+        self.__sensor = sensor
+        self.__buffer = buffer
+        self.__pause_event = pause_event
+        self.__logger = logger
+        self.__retry_sec = retry_sec
+        self.__retry_max_sec = retry_max_sec
+        self.__max_failures = max_failures
+
+        self.__sentinel = False
+        # Set once stopped, to cut a backoff short
+        self.__stop_event = clock.event()
+        # Set while the sensor is not idled
+        self.__wake_event = clock.event()
+        self.__wake_event.set()
+        self.__idle_pwm = 0
+        self.__slowed = False
+        self.__thread = clock.thread(
+            target=self.__thread_acquire,
+            name="FDS Sensor Acquisition {0}".format(sensor.info.uid),
+            daemon=True)
+
+        self._failed = False
+        return
+
+    @property
+    def failed(self) -> bool:
+        """
+        Whether the sensor was given up on after failing too many scans in a
+        row.
+        """
+
+        return self._failed
+
+    def start(self):
+        self.__sentinel = True
+        self.__thread.start()
+        return
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop the worker.
+
+        :param timeout: Time to wait for the worker to exit, in seconds.
+        :type timeout: Optional[float]
+        :return: True if the worker exited promptly, false otherwise.
+        :rtype: bool
+        """
+
+        self.__sentinel = False
+        # Release the worker if it is waiting on a paused room, idled or
+        #  backing off
+        self.__pause_event.set()
+        self.__wake_event.set()
+        self.__stop_event.set()
+        self.__thread.join(timeout)
+        return not self.__thread.is_alive()
+
+    def idle(self, pwm: int = 0):
+        """
+        Idle the sensor, slowing its motor to `pwm` or stopping scanning if
+        `pwm` is zero. Takes effect after the scan in progress.
+        """
+
+        self.__idle_pwm = pwm
+        self.__wake_event.clear()
+        return
+
+    def wake(self):
+        """
+        Resume full speed scanning of an idled sensor.
+        """
+
+        self.__wake_event.set()
+        return
+
+    def __thread_acquire(self):
+        """
+        Thread function.
+        Read scans from the sensor until stopped.
+        """
+
+        sensor = self.__sensor
+        buffer = self.__buffer
+
+        scanning = False
+        failures = 0
+        while self.__sentinel:
+            if not self.__pause_event.is_set():
+                self.__pause_event.wait(timeout=None)
+                continue
+
+            try:
+                if not scanning:
+                    sensor.startScanning()
+                    scanning = True
+                # The worker owns the device, so idling is done from here
+                if not self.__wake_event.is_set():
+                    if self.__idle_pwm == 0:
+                        scanning = False
+                        sensor.stopScanning()
+                        self.__wake_event.wait(timeout=None)
+                        continue
+                    elif not self.__slowed:
+                        # A motor failing to change speed scans on as is
+                        self.__slowed = True
+                        sensor.setMotorPWM(self.__idle_pwm)
+                elif self.__slowed:
+                    self.__slowed = False
+                    sensor.setMotorPWM(sensor.DEFAULT_MOTOR_PWM)
+
+                scan = sensor.getRawSamples(out=buffer.spare())
+            except Exception as err:
+                failures += 1
+                buffer.markFailed()
+                if failures >= self.__max_failures:
+                    self._failed = True
+                    self.__logger.error("Sensor {0} failed {1} scans in a "
+                                        "row, giving up: {2}"
+                                        .format(sensor.info.uid, failures,
+                                                err))
+                    break
+                # A failed scan ends the scans of the driver, so scanning is
+                #  restarted once backed off
+                backoff = min(self.__retry_sec * 2 ** (failures - 1),
+                              self.__retry_max_sec)
+                self.__logger.warning("Sensor {0} failed to scan, restarting "
+                                      "in {1:.1f} seconds: {2}"
+                                      .format(sensor.info.uid, backoff, err))
+                scanning = False
+                self.__stopSensor()
+                self.__stop_event.wait(backoff)
+                continue
+            failures = 0
+            buffer.push(self.__clock.monotonic(), scan)
+
+        self.__stopSensor()
+        return 0
+
+    def __stopSensor(self):
+        """
+        Stop the sensor scanning, which may itself fail once it failed.
+        """
+
+        try:
+            self.__sensor.stopScanning()
+        except Exception as err:
+            self.__logger.debug("Sensor {0} failed to stop: {1}"
+                                .format(self.__sensor.info.uid, err))
+        return
+
+
+class FrameAssembler(object):
+    """
+    Class for assembling synchronized multi-sensor frames from the buffers of
+    the acquisition workers of a room.
+
+    The newest scan across all sensors is the reference of a frame; every
+    other sensor contributes the scan nearest in time to the reference, if it
+    lies within the skew tolerance.
+    """
+
+    def __init__(self, buffers: List[ScanBuffer], skew_tolerance_sec: float):
+        """
+        :param buffers: The buffers of each sensor of the room.
+        :type buffers: List[ScanBuffer]
+        :param skew_tolerance_sec: Maximum time difference between scans of
+            a single frame.
+        :type skew_tolerance_sec: float
+        """
+
+        self.__buffers = buffers
+        self.__skew_tolerance_sec = skew_tolerance_sec
+
+        self._frames = 0
+        self._late = 0
+        return
+
+    def assemble(self, out: Optional[List[np.ndarray]] = None
+                 ) -> List[Optional[Tuple[float, np.ndarray]]]:
+        """
+        Assemble a frame from the buffered scans.
+
+        :param out: For each sensor, an array to copy the scan of the frame
+            to, instead of allocating one.
+        :type out: Optional[List[np.ndarray]]
+        :return: For each sensor, the timestamped scan of the frame, or `None`
+            if the sensor has no scan within the skew tolerance.
+        :rtype: List[Optional[Tuple[float, np.ndarray]]]
+        """
+
+        snapshots = [buffer.timestamps() for buffer in self.__buffers]
+        latest = [s[-1] for s in snapshots if len(s) != 0]
+        frame = [None] * len(snapshots)
+        if len(latest) == 0:
+            return frame
+        ref = max(latest)
+
+        for i in range(0, len(snapshots)):
+            timestamps = snapshots[i]
+            if len(timestamps) == 0:
+                continue
+            # Scans are ordered by time, find the one nearest the reference
+            nearest = min(timestamps, key=lambda t: abs(t - ref))
+            if abs(nearest - ref) > self.__skew_tolerance_sec:
+                self._late += 1
+                continue
+            buffer = self.__buffers[i]
+            scan = buffer.read(nearest, None if out is None else out[i])
+            if scan is None:
+                # Evicted since the snapshot
+                self._late += 1
+                continue
+            frame[i] = (nearest, scan)
+            buffer.markConsumed(nearest)
+
+        self._frames += 1
+        return frame
+
+    def stats(self) -> dict:
+        """
+        Get counters of the assembler and its buffers.
+
+        :return: A dictionary of counters for assembled frames, late scans,
+            dropped, decimated and failed scans, and per-sensor buffer depth
+            and backlog.
+        :rtype: dict
+        """
+
+        return {
+            "frames": self._frames,
+            "late": self._late,
+            "dropped": sum(b._dropped for b in self.__buffers),
+            "decimated": sum(b._decimated for b in self.__buffers),
+            "failed": sum(b._failed for b in self.__buffers),
+            "depth": [b.depth for b in self.__buffers],
+            "backlog": [b.backlog for b in self.__buffers],
+        }
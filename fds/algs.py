@@ -1,203 +1,442 @@
-from typing import List, Tuple
+from typing import Optional
 from enum import Enum, auto
 from dataclasses import dataclass
 
-import math
-
-from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import DBSCAN
 from sklearn.neighbors import KNeighborsClassifier
 import numpy as np
-import scipy.ndimage as sp_nd
 
 from .util import convertPolarCartesian
+from .rangeimage import RangeImage
+from .clusters import PackedClusters
+from .cache import ClassificationCache
+from .arena import ScratchArena
+from .dtypes import resolveDType
+from .inference import InferenceService
 from .dataclasses import GlobalTrainingSets
 
 
+@dataclass(frozen=True, slots=True)
+class _FittedClassifier:
+    """
+    A classifier fitted to a training set. Never modified once created.
+    """
+
+    knn_clsf: KNeighborsClassifier
+    key_points_n: int
+    generation: int
+
+
 class LidarAlgSet(object):
+    """
+    Shareable set of Lidar algorithm parameters and the fitted classifier.
+
+    The set holds no per-call state. Clusterers, scratch buffers and caches
+    belong to a `LidarAlgContext`, created once per worker
+    with `createContext`, so that rooms sharing a set run in parallel without
+    locking.
+    """
 
     DEFAULT_DBS_EPS: int = 0.5
     DEFAULT_DBS_MIN_SAMPLES: int = 6
     DEFAULT_KNN_NEIGHBORS: int = 6
+    DEFAULT_RUN_MAX_JUMP: float = 100.
+    DEFAULT_RUN_MIN_BINS: int = 6
 
     def __init__(self, trainingset: GlobalTrainingSets,
                  dbs_eps: float = DEFAULT_DBS_EPS,
                  dbs_min_samples: int = DEFAULT_DBS_MIN_SAMPLES,
-                 clsf_knn_neighbors: int = DEFAULT_KNN_NEIGHBORS):
+                 clsf_knn_neighbors: int = DEFAULT_KNN_NEIGHBORS,
+                 dtype: Optional[np.dtype] = None):
+        """
+        :param trainingset: The training set to fit the classifier to.
+        :param dtype: Data type points are clustered and classified in,
+            defaults to the dtype policy.
+        """
 
-        self.__dbs = DBSCAN(eps=dbs_eps, min_samples=dbs_min_samples)
-        self.__ss = StandardScaler()
+        self.__dtype = resolveDType(dtype)
+        self.__dbs_eps = dbs_eps
+        self.__dbs_min_samples = dbs_min_samples
+        self.__clsf_knn_neighbors = clsf_knn_neighbors
 
-        self.__knn_clsf = KNeighborsClassifier(n_neighbors=clsf_knn_neighbors,
-                                               algorithm='ball_tree',
-                                               p=1)
-        knn_data = trainingset.clsf_lidar_knn_set_kpdata
-        knn_labels = trainingset.clsf_lidar_knn_set_labels
-        self.__knn_clsf.fit(knn_data, knn_labels)
+        self.__fitted: Optional[_FittedClassifier] = None
+        self.loadTrainingSet(trainingset)
+        return
+
+    @property
+    def dbs_eps(self) -> float:
+        return self.__dbs_eps
 
-        self._clsf_key_points_n = trainingset.clsf_lidar_knn_nkp
-        # preallocate array to hold key points
-        self.__keypoints = np.empty(self._clsf_key_points, dtype=float)
+    @property
+    def dbs_min_samples(self) -> int:
+        return self.__dbs_min_samples
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.__dtype
+
+    @property
+    def fitted(self) -> _FittedClassifier:
+        return self.__fitted
+
+    def loadTrainingSet(self, trainingset: GlobalTrainingSets):
+        """
+        (Re)fit the classifier to a training set.
+
+        A new classifier is fitted and swapped in with a single assignment, so
+        contexts classifying concurrently see either the old or the new one.
+        Contexts invalidate their caches when they first see the new one.
+
+        :param trainingset: The training set to fit the classifier to.
+        :type trainingset: GlobalTrainingSets
+        """
+
+        knn_clsf = KNeighborsClassifier(n_neighbors=self.__clsf_knn_neighbors,
+                                        algorithm='ball_tree',
+                                        p=1)
+        knn_data = np.asarray(trainingset.clsf_lidar_knn_set_kpdata,
+                              dtype=self.__dtype)
+        knn_labels = trainingset.clsf_lidar_knn_set_labels
+        knn_clsf.fit(knn_data, knn_labels)
+
+        generation = 0 if self.__fitted is None \
+            else self.__fitted.generation + 1
+        self.__fitted = _FittedClassifier(
+            knn_clsf=knn_clsf,
+            key_points_n=trainingset.clsf_lidar_knn_nkp,
+            generation=generation)
         return
 
+    def createContext(self, cache: Optional[ClassificationCache] = None,
+                      arena: Optional[ScratchArena] = None,
+                      inference: Optional[InferenceService] = None
+                      ) -> "LidarAlgContext":
+        """
+        Create a context to run the algorithms from a single worker.
+
+        :param cache: The cache of classification results of the context,
+            defaults to a cache with default parameters.
+        :type cache: Optional[ClassificationCache]
+        :param arena: The scratch arena of the worker, defaults to an arena
+            of the context's own. Should be of the data type of the set.
+        :type arena: Optional[ScratchArena]
+        :param inference: The service to classify clusters in batches with
+            the contexts of other workers, by default the context classifies
+            inline.
+        :type inference: Optional[InferenceService]
+        :rtype: LidarAlgContext
+        """
+
+        return LidarAlgContext(self, cache, arena, inference)
+
     class ActivityClass(Enum):
         OTHER = auto()
         FALL = auto()
 
-    def classifyLidarCluster(self, pts: np.ndarray, pts_ang_ctr: float
-                             ) -> ActivityClass:
+
+class LidarAlgContext(object):
+    """
+    Per-worker state of a `LidarAlgSet`. A context is not thread safe and
+    must only be used by one thread at a time; create one per worker.
+    """
+
+    def __init__(self, alg_set: LidarAlgSet,
+                 cache: Optional[ClassificationCache] = None,
+                 arena: Optional[ScratchArena] = None,
+                 inference: Optional[InferenceService] = None):
+        """
+        :param alg_set: The algorithm set to run.
+        :param cache: The cache of classification results to use, defaults to
+            a cache with default parameters.
+        :param arena: The scratch arena to take per-frame buffers from,
+            defaults to an arena of its own.
+        :param inference: The service to classify clusters in batches with,
+            clusters are classified inline if not given or if the service
+            does not answer in time.
+        """
+
+        self.__alg_set = alg_set
+
+        self.__dbs = DBSCAN(eps=alg_set.dbs_eps,
+                            min_samples=alg_set.dbs_min_samples)
+        self.__cache = ClassificationCache() if cache is None else cache
+        self.__arena = ScratchArena(dtype=alg_set.dtype) if arena is None \
+            else arena
+
+        self.__generation = None
+        self.__keypoints = np.empty(0, dtype=alg_set.dtype)
+        self.__checkFitted()
+
+        self.__inference = inference
+        self.__request = None if inference is None else inference.register()
+
+        self._predictions = 0
+        return
+
+    @property
+    def alg_set(self) -> LidarAlgSet:
+        return self.__alg_set
+
+    def __checkFitted(self) -> _FittedClassifier:
+        """
+        Get the fitted classifier of the algorithm set, resetting state tied
+        to a previous classifier if it was refit.
+        """
+
+        fitted = self.__alg_set.fitted
+        if fitted.generation != self.__generation:
+            self.__generation = fitted.generation
+            # preallocate array to hold key points
+            self.__keypoints = np.empty(fitted.key_points_n,
+                                        dtype=self.__alg_set.dtype)
+            self.__cache.invalidate()
+        return fitted
+
+    def getCacheStats(self) -> dict:
+        """
+        Get hit, miss and eviction counters of the classification cache.
+
+        :rtype: dict
+        """
+
+        return self.__cache.stats()
+
+    @property
+    def predictions(self) -> int:
+        """
+        Number of clusters classified by the KNN classifier, rather than
+        from the cache.
+        """
+
+        return self._predictions
+
+    def __computeKeypoints(self, pts: np.ndarray, pts_ang_ctr: float
+                           ) -> np.ndarray:
+        """
+        Compute the keypoints of a cluster: the mean distance of points within
+        each of `key_points_n` equal angular sections of the cluster.
+        """
+
+        pts = np.asarray(pts, dtype=self.__alg_set.dtype).reshape(-1, 2)
+        arena = self.__arena
+
+        # Transform the cluster such that it is centered at degree 0 and in
+        # range [-180, 180)
+        ang = arena.take("kp_ang", len(pts), cols=None)
+        np.subtract(pts[:, 0], pts_ang_ctr - 180., out=ang)
+        np.mod(ang, 360., out=ang)
+        np.subtract(ang, 180., out=ang)
+
+        # Get the span of the angle of the measurements in the cluster
+        ang_min = ang.min()
+        pts_deg_span = ang.max() - ang_min
+
+        # Get the section of each point to average from
+        n = len(self.__keypoints)
+        sec = arena.take("kp_sec", len(pts), cols=None, dtype=np.intp)
+        if pts_deg_span > 0:
+            np.subtract(ang, ang_min, out=ang)
+            np.multiply(ang, n / pts_deg_span, out=ang)
+            np.copyto(sec, ang, casting="unsafe")
+            np.minimum(sec, n - 1, out=sec)
+        else:
+            sec.fill(0)
+
+        # Get the mean distance for each keypoint
+        sums = np.bincount(sec, weights=pts[:, 1], minlength=n)
+        counts = np.bincount(sec, minlength=n)
+        keypoints = self.__keypoints
+        np.divide(sums, counts, out=keypoints, where=(counts != 0))
+        # Sections without points are interpolated from their neighbours
+        empty = (counts == 0)
+        if empty.any():
+            keypoints[empty] = np.interp(np.flatnonzero(empty),
+                                         np.flatnonzero(~empty),
+                                         keypoints[~empty])
+        return keypoints
+
+    def classifyLidarCluster(self, pts: np.ndarray, pts_ang_ctr: float,
+                             track_id: Optional[int] = None) -> int:
         """
         Classify activity with the given set of Lidar points.
 
         :param np.ndarray pts: An array of points of shape (n_points, 2)
             with the latter dimension of form (degree, distance). Points are
             assumed to be ordered by increasing angle.
-        :param float pts: The angular center of the cluster in degrees within
-            the range of [0-360).
+        :param float pts_ang_ctr: The angular center of the cluster in degrees
+            within the range of [0-360).
+        :param Optional[int] track_id: Track id of the cluster, included in the
+            cache key if the cache is configured to key by track.
         :return: A predicted label for the input cluster.
-        :rtype: ActivityClass
+        :rtype: int
         """
 
+        # Take a single reference to the fitted model, which may be swapped by
+        #  `LidarAlgSet.loadTrainingSet` concurrently
+        fitted = self.__checkFitted()
+
         # * Populate keypoints
-        # Transform the cluster such that it is centered at degree 0 and in
-        # range (-180, 180]
-        pts_tf = np.empty_like(pts)
-        if pts_ang_ctr > 180:
-            pts_ang_ctr = pts_ang_ctr - 360
-        for i in range(0, len(pts)):
-            cpt = pts[i][0] - pts_ang_ctr
-            if cpt > 180:
-                pts_tf[i][0] = cpt - 360
-            else:
-                pts_tf[i][0] = cpt
-            pts_tf[i][1] = pts[i][1]
+        keypoints = self.__computeKeypoints(pts, pts_ang_ctr)
+
+        # * Reuse the label of recently seen shapes
+        cache = self.__cache
+        key = cache.key(keypoints, track_id)
+        label = cache.get(key)
+        if label is not None:
+            return label
+
+        # * Pass keypoints as data point to KNeighborsClassifier, batched with
+        #  the keypoints of other contexts if possible
+        self._predictions += 1
+        label = None
+        if self.__inference is not None:
+            label = self.__inference.predict(self.__request, keypoints,
+                                             fitted.generation)
+        if label is None:
+            label = int(fitted.knn_clsf.predict(keypoints.reshape(1, -1))[0])
+        cache.put(key, label)
 
-        # Get the span of the angle of the measurements in the cluster
-        pts_deg_span = pts_tf[:, 0].max() - pts_tf[:, 0].min()
+        return label
 
-        # Get section lengths for each keypoint to average from
-        pts_sec_len = pts_deg_span / self._clsf_key_points_n
-        start_idx = 0
-        end_idx = 0
-        keypoints = self.__keypoints
-        for i in range(0, len(keypoints) - 1):
-            pts_sec_end = math.floor((i + 1) * pts_sec_len)
-            # Get an interval
-            for j in range(start_idx, len(pts_tf)):
-                if pts_tf[j] > pts_sec_end:
-                    end_idx = j
-            pts_sec = pts_tf[start_idx:end_idx]
-            # Get the mean distance for the keypoint
-            keypoints[i] = sp_nd.mean(pts_sec[:, 1])
-            start_idx = end_idx
-        # For final keypoint, just use all remaining points
-        pts_sec = pts_tf[start_idx:len(pts_tf)]
-        # Get the mean distance for the keypoint
-        keypoints[i] = sp_nd.mean(pts_sec[:, 1])
-
-        # * Pass keypoints as data point to KNeighborsClassifier
-        label = self.__knn_clsf.predict(keypoints)
+    def __standardize(self, cart: np.ndarray, scale_cart: np.ndarray,
+                      out: np.ndarray) -> np.ndarray:
+        """
+        Standardize points to zero mean and unit variance, as fit to
+        `scale_cart`, without temporaries. Equivalent to fitting a
+        `StandardScaler` to `scale_cart` and transforming `cart`.
+        """
 
-        return label
+        n = len(scale_cart)
+        mean = scale_cart.sum(axis=0) / n
+        centered = self.__arena.take("ss_centered", n)
+        np.subtract(scale_cart, mean, out=centered)
+        std = np.sqrt(np.einsum("ij,ij->j", centered, centered) / n)
+        # Constant features are left unscaled
+        std[std == 0.] = 1.
+
+        np.subtract(cart, mean, out=out)
+        np.divide(out, std, out=out)
+        return out
 
-    def clusterLidarScan(self, pts: np.ndarray
-                         ) -> Tuple[List[np.ndarray], np.ndarray]:
+    def clusterLidarScan(self, pts: np.ndarray) -> PackedClusters:
         """
         Get clusters from Lidar scans.
 
+        Points and noise of the clusters are views of the scratch arena of the
+        context, valid until the next call. Centers are not computed.
+
         :param pts: An array of points of shape (n_points, 2) with the latter
             dimension of form (degree, distance).
-        :return: A tuple of clustered points and unclustered points,
-            respectively. Clustered points have shape (n_clusters) which
-            contain arrays of variable lengths.
+        :return: The clusters and unclustered points of the scan.
         """
 
+        pts = np.asarray(pts, dtype=self.__alg_set.dtype).reshape(-1, 2)
+        n = len(pts)
+        if n == 0:
+            return PackedClusters.empty(pts)
+
         # Process points into cartesian coordinates
-        fil_cart_scan = convertPolarCartesian(pts)
+        arena = self.__arena
+        fil_cart_scan = convertPolarCartesian(pts, out=arena.take("cart", n),
+                                              scratch=arena)
 
         # Get labels
-        fil_cart_scan_norm = self.__ss.fit_transform(fil_cart_scan)
+        fil_cart_scan_norm = self.__standardize(
+            fil_cart_scan, fil_cart_scan, out=arena.take("norm", n))
         labels = self.__dbs.fit_predict(fil_cart_scan_norm)
 
-        # Group labels into lists representing clusters
-        # First, get number of labels to allocate
-        #  NOTE: Label `i` is associated with the data point at `i`.
-        max_label = 0
-        for i in range(0, len(labels)):
-            if labels[i] > max_label:
-                max_label = labels[i]
-
-        unclustered = []
-        # Create an array of lists; this method is odd but is needed to force
-        #  numpy to create the array of empty lists appropriately.
-        clusters = \
-            np.frompyfunc(list, 0, 1)(np.empty(max_label + 1, dtype=object))
-        for i in range(0, len(pts)):
-            if (labels[i] != -1):
-                clusters[labels[i]].append(pts[i])
-            else:
-                unclustered.append(pts[i])
-
-        clusters_list = []
-        for cluster in clusters:
-            clusters_list.append(cluster)
-
-        return (clusters_list, np.array(unclustered))
-
-    def clusterLidarScanAdv(self, pts: np.ndarray
-                            ) -> Tuple[List[Tuple[np.ndarray, float]],
-                                       np.ndarray]:
+        # Group points by label
+        return PackedClusters.fromLabels(pts, labels,
+                                         out=arena.take("grouped", n))
+
+    def clusterLidarScanAdv(self, pts: np.ndarray,
+                            scale_pts: Optional[np.ndarray] = None
+                            ) -> PackedClusters:
         """
         Get clusters from Lidar scans, getting additional cluster centers for
         high power processing.
 
+        Unlike with `clusterLidarScan`, clusters and unclustered points are
+        not views of the scratch arena, as they are carried across scans.
+
         :param pts: An array of points of shape (n_points, 2) with the latter
             dimension of form (degree, distance).
-        :return: A tuple of clustered data, cluster centers in angular degrees,
-            and unclustered data, respectively.
+        :param scale_pts: Points to fit the scaling of the clustering space
+            to, such as the full scan when `pts` is only part of it. Defaults
+            to `pts`.
+        :return: The clusters with their centers in angular degrees, and
+            unclustered points of the scan.
         """
 
+        pts = np.asarray(pts, dtype=self.__alg_set.dtype).reshape(-1, 2)
+        n = len(pts)
+        if n == 0:
+            return PackedClusters.empty(dtype=pts.dtype)
+
         # Process points into cartesian coordinates
-        fil_cart_scan = convertPolarCartesian(pts)
+        arena = self.__arena
+        fil_cart_scan = convertPolarCartesian(pts, out=arena.take("cart", n),
+                                              scratch=arena)
 
         # Get labels
-        fil_cart_scan_norm = self.__ss.fit_transform(fil_cart_scan)
+        if scale_pts is None:
+            scale_cart = fil_cart_scan
+        else:
+            scale_pts = np.asarray(scale_pts, dtype=pts.dtype).reshape(-1, 2)
+            scale_cart = convertPolarCartesian(
+                scale_pts, out=arena.take("scale_cart", len(scale_pts)),
+                scratch=arena)
+        fil_cart_scan_norm = self.__standardize(
+            fil_cart_scan, scale_cart, out=arena.take("norm", n))
         labels = self.__dbs.fit_predict(fil_cart_scan_norm)
 
-        # Group labels into lists representing clusters
-        # First, get number of labels to allocate
-        #  NOTE: Label `i` is associated with the data point at `i`.
-        max_label = 0
-        for i in range(0, len(labels)):
-            if labels[i] > max_label:
-                max_label = labels[i]
-
-        unclustered = []
-        # Create an array of lists; this method is odd but is needed to force
-        #  numpy to create the array of empty lists appropriately.
-        clusters = \
-            np.frompyfunc(list, 0, 1)(np.empty(max_label + 1, dtype=object))
-        clusters_cart = np.empty_like(clusters)
-        for i in range(0, len(pts)):
-            if (labels[i] != -1):
-                clusters[labels[i]].append(pts[i])
-                clusters_cart[labels[i]].append(fil_cart_scan[i])
-            else:
-                unclustered.append(pts[i])
-
-        clusters_cart_np = np.empty_like(clusters)
-        for i in range(0, len(clusters)):
-            clusters_cart_np[i] = np.array(clusters_cart[i])
-
-        clusters_tlist = []
-
-        # Get polar/degree centers of the clusters, also get centers of
-        #  clusters in polar space using corresponding cartesian points
-        for i in range(0, len(clusters)):
-            ctrx = sp_nd.mean(clusters_cart_np[i][:, 0])
-            ctry = sp_nd.mean(clusters_cart_np[i][:, 1])
-            c = np.degrees(np.arctan2(ctrx, ctry))
-            cluster_ctr = (c + 360) if (c < 0) else c
-            clusters_tlist.append((clusters[i], cluster_ctr))
-
-        return (clusters_tlist, np.array(unclustered))
+        clusters = PackedClusters.fromLabels(pts, labels)
+
+        # Get polar/degree centers of the clusters from the centroids of their
+        #  cartesian points
+        clusters.computeCenters(convertPolarCartesian(
+            clusters.points, out=arena.take("cart", len(clusters.points)),
+            scratch=arena))
+
+        return clusters
+
+    def clusterRangeImage(self, image: np.ndarray, grid: RangeImage,
+                          max_jump: float = LidarAlgSet.DEFAULT_RUN_MAX_JUMP,
+                          min_bins: int = LidarAlgSet.DEFAULT_RUN_MIN_BINS
+                          ) -> PackedClusters:
+        """
+        Get clusters from a range image as contiguous runs of occupied bins,
+        with output compatible with `clusterLidarScanAdv`.
+
+        :param image: An unculled range image of shape (bins, 2).
+        :param grid: The grid of the range image.
+        :param max_jump: Maximum distance difference between neighbouring
+            bins of a single cluster.
+        :param min_bins: Minimum number of bins of a cluster. Bins are not
+            samples, so this is independent of `dbs_min_samples`.
+        :return: The clusters with their centers in angular degrees, and
+            unclustered points of the image.
+        """
+
+        dist = image[:, RangeImage.DIST]
+        centers = grid.centers
+        (starts, ends) = grid.runs(image, max_jump, min_len=min_bins)
+
+        # Bins of all runs, packed one after another
+        counts = ends - starts
+        offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        # A run across 0 degrees ends past the last bin
+        bins = (np.repeat(starts - offsets[0:-1], counts) +
+                np.arange(0, offsets[-1])) % grid.bins
+        points = np.column_stack((centers[bins], dist[bins]))
+
+        clustered = np.zeros(grid.bins, dtype=bool)
+        clustered[bins] = True
+        unclustered = ~clustered & ~np.isnan(dist)
+        noise = np.column_stack((centers[unclustered], dist[unclustered]))
+
+        # Center at the angle of the cartesian centroid
+        clusters = PackedClusters(points, offsets, noise)
+        clusters.computeCenters()
+        return clusters
@@ -0,0 +1,156 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .dtypes import resolveDType
+
+
+class ScratchArena(object):
+    """
+    Set of named, preallocated scratch buffers reused across frames.
+
+    Buffers are allocated once for the expected maximum number of points of a
+    frame and handed out as views of their leading rows, so that processing a
+    frame in the steady state allocates no array data. A buffer only grows if
+    a frame exceeds its capacity, which is counted so regressions show up in
+    `stats`.
+
+    Views of a buffer are overwritten by the next request for the same name;
+    data which must outlive a frame has to be copied out.
+    """
+
+    DEFAULT_CAPACITY: int = 2048
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY,
+                 dtype: Optional[np.dtype] = None):
+        """
+        :param capacity: Initial number of rows of each buffer, typically the
+            maximum number of points of a frame.
+        :type capacity: int
+        :param dtype: Data type of buffers taken without one, defaults to the
+            dtype policy.
+        :type dtype: Optional[np.dtype]
+        """
+
+        self.__capacity = capacity
+        self.__dtype = resolveDType(dtype)
+        self.__buffers: Dict[str, np.ndarray] = {}
+
+        self._grows = 0
+        return
+
+    @property
+    def capacity(self) -> int:
+        return self.__capacity
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.__dtype
+
+    def take(self, name: str, n: int, cols: Optional[int] = 2,
+             dtype: Optional[type] = None) -> np.ndarray:
+        """
+        Get a view of the first `n` rows of a named buffer, allocating or
+        growing the buffer if needed.
+
+        :param name: Name of the buffer, unique per use within a frame.
+        :type name: str
+        :param n: Number of rows.
+        :type n: int
+        :param cols: Number of columns, or `None` for a one-dimensional
+            buffer.
+        :type cols: Optional[int]
+        :param dtype: Data type of the buffer, defaults to that of the arena.
+        :type dtype: Optional[type]
+        :return: A view of shape (n, cols), or (n) if `cols` is `None`.
+        :rtype: np.ndarray
+        """
+
+        dtype = self.__dtype if dtype is None else dtype
+        buf = self.__buffers.get(name)
+        if buf is None or len(buf) < n or buf.dtype != dtype:
+            rows = max(n, self.__capacity)
+            if buf is not None and len(buf) < n:
+                self._grows += 1
+                rows = max(n, 2 * len(buf))
+            shape = (rows,) if cols is None else (rows, cols)
+            buf = np.empty(shape, dtype=dtype)
+            self.__buffers[name] = buf
+        return buf[0:n]
+
+    def arange(self, n: int) -> np.ndarray:
+        """
+        Get a view of the integers [0, n), kept across frames.
+
+        :rtype: np.ndarray
+        """
+
+        buf = self.__buffers.get("arange")
+        if buf is None or len(buf) < n:
+            buf = np.arange(0, max(n, self.__capacity), dtype=np.intp)
+            self.__buffers["arange"] = buf
+        return buf[0:n]
+
+    def stats(self) -> dict:
+        """
+        Get the size of the arena.
+
+        :return: A dictionary of the number of buffers, their total size in
+            bytes and the number of times a buffer had to grow.
+        :rtype: dict
+        """
+
+        return {
+            "buffers": len(self.__buffers),
+            "bytes": sum(b.nbytes for b in self.__buffers.values()),
+            "grows": self._grows,
+        }
+
+
+def partitionRows(pts: np.ndarray, mask: np.ndarray,
+                  out: Tuple[np.ndarray, np.ndarray], scratch: ScratchArena
+                  ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split the rows of an array of shape (n, 2) by a mask, keeping their
+    order, without allocating. Unlike boolean indexing or `np.compress`,
+    rows are scattered to their destination with `np.put`.
+
+    :param pts: The rows to split.
+    :type pts: np.ndarray
+    :param mask: A boolean array of shape (n), true for rows of the second
+        output.
+    :type mask: np.ndarray
+    :param out: A pair of arrays with at least as many rows as rows of each
+        output.
+    :type out: Tuple[np.ndarray, np.ndarray]
+    :param scratch: The arena to take temporaries from.
+    :type scratch: ScratchArena
+    :return: A tuple of views of `out` holding rows where the mask is false
+        and true, respectively.
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+
+    n = len(pts)
+    rank = scratch.take("partition_rank", n, cols=None, dtype=np.intp)
+    dest = scratch.take("partition_dest", n, cols=None, dtype=np.intp)
+    np.copyto(rank, mask, casting="unsafe")
+    np.cumsum(rank, out=rank)
+    n_true = int(rank[n - 1]) if n != 0 else 0
+    n_false = n - n_true
+
+    # Rows where the mask is false go before all rows where it is true, each
+    #  at their rank within their own set
+    np.subtract(scratch.arange(n), rank, out=dest)
+    np.add(rank, n_false - 1, out=rank)
+    np.copyto(dest, rank, where=mask)
+
+    col = scratch.take("partition_col", n, cols=None, dtype=pts.dtype)
+    part = scratch.take("partition_part", n, cols=None, dtype=pts.dtype)
+    (first, second) = (out[0][0:n_false], out[1][0:n_true])
+    for k in range(0, 2):
+        # Sources of `np.put` must be contiguous not to be copied
+        np.copyto(col, pts[:, k])
+        np.put(part, dest, col)
+        np.copyto(first[:, k], part[0:n_false])
+        np.copyto(second[:, k], part[n_false:n])
+    return (first, second)
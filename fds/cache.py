@@ -0,0 +1,144 @@
+from typing import Optional, Callable
+from collections import OrderedDict
+
+import time
+
+import numpy as np
+
+from .dataclasses import CachePolicy
+
+
+class ClassificationCache(object):
+    """
+    Bounded cache of classification results, keyed by quantized keypoint
+    vectors, so that recurring cluster shapes skip the classifier.
+    """
+
+    DEFAULT_SIZE: int = 256
+    DEFAULT_QUANTUM: float = 25.
+    DEFAULT_TTL_SEC: Optional[float] = 30.
+
+    def __init__(self, size: int = DEFAULT_SIZE,
+                 quantum: float = DEFAULT_QUANTUM,
+                 policy: CachePolicy = CachePolicy.LRU,
+                 ttl_sec: Optional[float] = DEFAULT_TTL_SEC,
+                 key_by_track: bool = False,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param size: Maximum number of entries, zero disables the cache.
+        :type size: int
+        :param quantum: Quantization step of keypoints, in units of
+            distance. Keypoint vectors equal after quantization share an
+            entry.
+        :type quantum: float
+        :param policy: Eviction policy when the cache is full.
+        :type policy: CachePolicy
+        :param ttl_sec: Time an entry stays valid, `None` for no expiry.
+        :type ttl_sec: Optional[float]
+        :param key_by_track: Include the track id of a cluster in its key.
+        :type key_by_track: bool
+        :param clock: Monotonic time source, in seconds.
+        :type clock: Callable[[], float]
+        """
+
+        self.__size = size
+        self.__quantum = quantum
+        self.__policy = policy
+        self.__ttl_sec = ttl_sec
+        self.__key_by_track = key_by_track
+        self.__clock = clock
+
+        self.__entries: OrderedDict = OrderedDict()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        return
+
+    def key(self, keypoints: np.ndarray, track_id: Optional[int] = None
+            ) -> bytes:
+        """
+        Get the key of a keypoint vector.
+
+        :param keypoints: The keypoint vector.
+        :type keypoints: np.ndarray
+        :param track_id: Track id of the cluster, used only if the cache keys
+            by track.
+        :type track_id: Optional[int]
+        :rtype: bytes
+        """
+
+        key = np.rint(keypoints / self.__quantum).astype(np.int32).tobytes()
+        if self.__key_by_track and track_id is not None:
+            key += track_id.to_bytes(8, "little", signed=True)
+        return key
+
+    def get(self, key: bytes) -> Optional[int]:
+        """
+        Get a cached label.
+
+        :return: The cached label, or `None` on a miss.
+        :rtype: Optional[int]
+        """
+
+        entry = self.__entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+
+        (label, timestamp) = entry
+        if self.__ttl_sec is not None and \
+                self.__clock() - timestamp > self.__ttl_sec:
+            del self.__entries[key]
+            self._evictions += 1
+            self._misses += 1
+            return None
+
+        if self.__policy is CachePolicy.LRU:
+            self.__entries.move_to_end(key)
+        self._hits += 1
+        return label
+
+    def put(self, key: bytes, label: int):
+        """
+        Cache a label, evicting an entry if the cache is full.
+        """
+
+        if self.__size == 0:
+            return
+        entries = self.__entries
+        if key not in entries and len(entries) >= self.__size:
+            entries.popitem(last=False)
+            self._evictions += 1
+        entries[key] = (label, self.__clock())
+        entries.move_to_end(key)
+        return
+
+    def invalidate(self):
+        """
+        Remove all entries, such as when the classifier is refit.
+        """
+
+        self.__entries.clear()
+        self._invalidations += 1
+        return
+
+    def stats(self) -> dict:
+        """
+        Get counters of the cache.
+
+        :return: A dictionary of hits, misses, evictions, invalidations,
+            current size and the hit rate.
+        :rtype: dict
+        """
+
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+            "size": len(self.__entries),
+            "hit_rate": (self._hits / total) if total != 0 else 0.,
+        }
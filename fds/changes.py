@@ -0,0 +1,274 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .algs import LidarAlgContext
+from .clusters import PackedClusters
+
+
+class SectorChangeMap(object):
+    """
+    Class for detecting which angular sectors of a filtered scan changed since
+    they were last re-clustered.
+
+    Each sector is summarized by its point count and mean distance; a sector
+    changed if either differs from its reference beyond a threshold. The
+    reference of a sector is its summary when it was last rebased, rather
+    than in the previous scan, so that an object moving less than the
+    threshold per scan still changes its sector once it moved far enough.
+    """
+
+    DEFAULT_SECTORS: int = 72
+    DEFAULT_COUNT_THRESH: int = 2
+    DEFAULT_RANGE_THRESH: float = 50.
+
+    def __init__(self, sectors: int = DEFAULT_SECTORS,
+                 count_thresh: int = DEFAULT_COUNT_THRESH,
+                 range_thresh: float = DEFAULT_RANGE_THRESH):
+        """
+        :param sectors: Number of angular sectors over [0-360) degrees.
+        :type sectors: int
+        :param count_thresh: Maximum difference of point counts of an
+            unchanged sector.
+        :type count_thresh: int
+        :param range_thresh: Maximum difference of mean distance of an
+            unchanged sector, in units of distance.
+        :type range_thresh: float
+        """
+
+        self.__sectors = sectors
+        self.__count_thresh = count_thresh
+        self.__range_thresh = range_thresh
+
+        # Reference summaries of the sectors, and the summaries of the latest
+        #  scan
+        self.__ref_counts: Optional[np.ndarray] = None
+        self.__ref_means: Optional[np.ndarray] = None
+        self.__counts = np.zeros(sectors, dtype=int)
+        self.__means = np.zeros(sectors)
+        return
+
+    @property
+    def sectors(self) -> int:
+        return self.__sectors
+
+    def sectorsOf(self, pts: np.ndarray) -> np.ndarray:
+        """
+        Get the sector index of each point.
+
+        :param pts: Points of shape (n, 2) of form (degree, distance).
+        :type pts: np.ndarray
+        :rtype: np.ndarray
+        """
+
+        sectors = self.__sectors
+        return (pts[:, 0] * (sectors / 360.)).astype(int) % sectors
+
+    def reset(self):
+        """
+        Forget the references, such that the next scan is entirely changed.
+        """
+
+        self.__ref_counts = None
+        self.__ref_means = None
+        return
+
+    def update(self, pts: np.ndarray) -> np.ndarray:
+        """
+        Compare a scan with the references of its sectors. Sectors are
+        entirely changed until the first scan is rebased.
+
+        :param pts: Filtered points of shape (n, 2) of form (degree, distance).
+        :type pts: np.ndarray
+        :return: A boolean array of shape (sectors) marking changed sectors.
+        :rtype: np.ndarray
+        """
+
+        idx = self.sectorsOf(pts)
+        counts = np.bincount(idx, minlength=self.__sectors)
+        sums = np.bincount(idx, weights=pts[:, 1], minlength=self.__sectors)
+        # Sums of an empty scan are integers
+        means = np.divide(sums, counts, out=np.zeros(len(sums)),
+                          where=(counts != 0))
+
+        self.__counts = counts
+        self.__means = means
+        if self.__ref_counts is None:
+            return np.ones(self.__sectors, dtype=bool)
+        ref_counts = self.__ref_counts
+        both = (counts != 0) & (ref_counts != 0)
+        changed = \
+            (np.abs(counts - ref_counts) > self.__count_thresh) | \
+            (both & (np.abs(means - self.__ref_means) > self.__range_thresh))
+        return changed
+
+    def rebase(self, sectors: np.ndarray):
+        """
+        Make the summaries of the latest scan the references of sectors, such
+        as once they were re-clustered.
+
+        :param sectors: A boolean array of shape (sectors) marking the
+            sectors to rebase.
+        :type sectors: np.ndarray
+        """
+
+        if self.__ref_counts is None:
+            self.__ref_counts = self.__counts.copy()
+            self.__ref_means = self.__means.copy()
+            return
+        self.__ref_counts[sectors] = self.__counts[sectors]
+        self.__ref_means[sectors] = self.__means[sectors]
+        return
+
+
+class ChangeRestrictedClustering(object):
+    """
+    Class for clustering consecutive scans of the HIGH activity state, only
+    re-clustering points in changed sectors and their neighbours.
+
+    Clusters lying entirely within unchanged sectors are carried forward with
+    their labels and classified activities, for up to a number of scans,
+    after which they are re-clustered and re-classified regardless.
+    """
+
+    DEFAULT_MAX_CARRY: int = 20
+
+    def __init__(self, lidar_alg_ctx: LidarAlgContext,
+                 change_map: SectorChangeMap,
+                 max_carry: int = DEFAULT_MAX_CARRY):
+        """
+        :param lidar_alg_ctx: The context to cluster changed points with.
+        :type lidar_alg_ctx: LidarAlgContext
+        :param change_map: The map of changed sectors.
+        :type change_map: SectorChangeMap
+        :param max_carry: Maximum number of scans a cluster is carried
+            forward for before it is re-clustered.
+        :type max_carry: int
+        """
+
+        self.__lidar_alg_ctx = lidar_alg_ctx
+        self.__change_map = change_map
+        self.__max_carry = max_carry
+
+        self.__clusters = PackedClusters.empty()
+        self.__cluster_sectors: List[np.ndarray] = []
+        self.__labels: List[int] = []
+        self.__activities: List[Optional[int]] = []
+        # Scans each cluster was carried forward for
+        self.__ages: List[int] = []
+        self.__next_label = 0
+        return
+
+    def reset(self):
+        """
+        Forget all clusters, such that the next scan is fully clustered.
+        """
+
+        self.__change_map.reset()
+        self.__clusters = PackedClusters.empty()
+        self.__cluster_sectors = []
+        self.__labels = []
+        self.__activities = []
+        self.__ages = []
+        return
+
+    def update(self, pts: np.ndarray
+               ) -> Tuple[PackedClusters, List[Optional[int]]]:
+        """
+        Cluster a new scan.
+
+        :param pts: Unculled points of shape (n, 2) of form (degree, distance).
+        :type pts: np.ndarray
+        :return: A tuple of clusters with centers and unclustered points, as
+            from `LidarAlgContext.clusterLidarScanAdv`, and the activity of
+            each cluster carried from the previous scan or `None` for clusters
+            which need classifying, respectively.
+        :rtype: Tuple[PackedClusters, List[Optional[int]]]
+        """
+
+        change_map = self.__change_map
+        changed = change_map.update(pts)
+
+        # Re-cluster changed sectors and their neighbours
+        dirty = changed | np.roll(changed, 1) | np.roll(changed, -1)
+
+        # Clusters touching dirty sectors are dissolved, so their sectors are
+        #  re-clustered as a whole. Dissolving a cluster dirties the sectors
+        #  it shares with clusters already checked, so passes repeat until
+        #  no more clusters dissolve. Clusters carried for too long are
+        #  dissolved regardless
+        prev = self.__clusters
+        dissolved = np.array([age >= self.__max_carry for age in self.__ages],
+                             dtype=bool)
+        for i in np.flatnonzero(dissolved):
+            dirty[self.__cluster_sectors[i]] = True
+        grown = True
+        while grown:
+            grown = False
+            for i in np.flatnonzero(~dissolved):
+                sectors = self.__cluster_sectors[i]
+                if dirty[sectors].any():
+                    dirty[sectors] = True
+                    dissolved[i] = True
+                    grown = True
+        keep = np.flatnonzero(~dissolved).tolist()
+
+        parts = [prev.select(keep)]
+        cluster_sectors = [self.__cluster_sectors[i] for i in keep]
+        labels = [self.__labels[i] for i in keep]
+        activities = [self.__activities[i] for i in keep]
+        ages = [self.__ages[i] + 1 for i in keep]
+
+        # Noise is carried forward alongside clusters in clean sectors
+        prev_noise = prev.noise
+        noise_parts = \
+            [prev_noise[~dirty[change_map.sectorsOf(prev_noise)]]]
+
+        pts_dirty = pts[dirty[change_map.sectorsOf(pts)]]
+        if len(pts_dirty) != 0:
+            new_clusters = self.__lidar_alg_ctx \
+                .clusterLidarScanAdv(pts_dirty, scale_pts=pts)
+            for i in range(0, len(new_clusters)):
+                cluster_sectors.append(
+                    np.unique(change_map.sectorsOf(new_clusters[i])))
+                labels.append(self.__next_label)
+                activities.append(None)
+                ages.append(0)
+                self.__next_label += 1
+            parts.append(new_clusters)
+            noise_parts.append(new_clusters.noise)
+
+        clusters = PackedClusters.concatenate(
+            parts, noise=np.concatenate(noise_parts, axis=0))
+        # Re-clustered sectors are compared with this scan from now on
+        change_map.rebase(dirty)
+
+        self.__clusters = clusters
+        self.__cluster_sectors = cluster_sectors
+        self.__labels = labels
+        self.__activities = activities
+        self.__ages = ages
+        return (clusters, list(activities))
+
+    @property
+    def labels(self) -> List[int]:
+        """
+        Labels of the clusters of the latest scan, persistent for clusters
+        carried forward.
+        """
+
+        return self.__labels
+
+    def recordActivity(self, idx: int, activity: int):
+        """
+        Record the classified activity of a cluster of the latest scan, to be
+        carried forward with the cluster.
+
+        :param idx: Index of the cluster in the latest scan.
+        :type idx: int
+        :param activity: The classified activity.
+        :type activity: int
+        """
+
+        self.__activities[idx] = activity
+        return
@@ -0,0 +1,343 @@
+from typing import Any, Callable, List, Optional
+
+import heapq
+import math
+import threading
+import time
+
+
+class FDSClockException(Exception):
+    pass
+
+
+class Clock(object):
+    """
+    Source of time of the pipeline, with the sleeps, events and threads
+    which wait on it.
+
+    The pipeline reads and waits on time only through its clock, so that it
+    may be run on a `VirtualClock` instead of in real time. This clock is
+    real time, through `time` and `threading`.
+    """
+
+    def monotonic(self) -> float:
+        """
+        Get the current time, in seconds.
+
+        :rtype: float
+        """
+
+        return time.monotonic()
+
+    def threadTime(self) -> float:
+        """
+        Get the processing time of the calling thread, in seconds.
+
+        :rtype: float
+        """
+
+        return time.thread_time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+        return
+
+    def event(self) -> threading.Event:
+        """
+        Create an event waited on in the time of the clock.
+
+        :rtype: threading.Event
+        """
+
+        return threading.Event()
+
+    def thread(self, target: Callable[..., Any], name: Optional[str] = None,
+               daemon: bool = False, args: tuple = ()) -> threading.Thread:
+        """
+        Create a thread sleeping and waiting in the time of the clock, to be
+        started by the caller.
+
+        :rtype: threading.Thread
+        """
+
+        return threading.Thread(target=target, name=name, daemon=daemon,
+                                args=args)
+
+
+class _Waiter(object):
+    """
+    A thread of a virtual clock, and the ticket of its latest wait. Timers
+    of earlier tickets are stale.
+    """
+
+    __slots__ = ("go", "ticket")
+
+    def __init__(self):
+        self.go = threading.Event()
+        self.ticket = 0
+        return
+
+
+class _VirtualThread(threading.Thread):
+    """
+    Thread of a virtual clock, which only runs while given the turn by the
+    clock.
+    """
+
+    def __init__(self, clock: "VirtualClock", target: Callable[..., Any],
+                 name: Optional[str], daemon: bool, args: tuple):
+        super().__init__(name=name, daemon=daemon)
+        self.clock = clock
+        self.waiter = _Waiter()
+        self.__target = target
+        self.__args = args
+        return
+
+    def start(self):
+        self.clock._register(self.waiter)
+        super().start()
+        return
+
+    def run(self):
+        self.waiter.go.wait()
+        self.waiter.go.clear()
+        try:
+            self.__target(*self.__args)
+        finally:
+            self.clock._exit()
+        return
+
+    def join(self, timeout: Optional[float] = None):
+        # A thread of the clock joining another must give it turns to exit,
+        #  and times out in the time of the clock
+        clock = self.clock
+        current = threading.current_thread()
+        if not isinstance(current, _VirtualThread) or \
+                current.clock is not clock:
+            super().join(timeout)
+            return
+        deadline = math.inf if timeout is None \
+            else clock.monotonic() + timeout
+        while self.is_alive() and clock.monotonic() < deadline:
+            clock.sleep(min(clock.JOIN_POLL_SEC,
+                            deadline - clock.monotonic()))
+        return
+
+
+class _VirtualEvent(object):
+    """
+    Event of a virtual clock, with the interface of `threading.Event`.
+    """
+
+    def __init__(self, clock: "VirtualClock"):
+        self.__clock = clock
+        self.__flag = False
+        self.waiters: List[_Waiter] = []
+        return
+
+    def is_set(self) -> bool:
+        return self.__flag
+
+    def set(self):
+        self.__clock._set(self)
+        return
+
+    def clear(self):
+        self.__flag = False
+        return
+
+    def _setFlag(self):
+        self.__flag = True
+        return
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.__clock._wait(self, timeout)
+
+
+class VirtualClock(Clock):
+    """
+    Clock whose time only advances once every thread of the clock waits,
+    running the pipeline as fast as the CPU allows.
+
+    Threads of the clock take turns: exactly one runs at a time, until it
+    sleeps or waits on an event of the clock. The clock then gives the turn
+    to the thread whose wait ends first, advancing time to its end, with
+    ties going to the thread which waited first. Runs are thus
+    deterministic, and processing takes no time.
+
+    Threads of the clock must only block on its sleeps and events, or on
+    locks held briefly by other threads. Other threads may read the time and
+    set events of the clock.
+    """
+
+    # Period the time of a joined thread is polled in
+    JOIN_POLL_SEC: float = 0.01
+
+    def __init__(self, start: float = 0.):
+        """
+        :param start: The time of the clock, in seconds.
+        :type start: float
+        """
+
+        self.__now = start
+        self.__lock = threading.Lock()
+        # Timers as (time, sequence, ticket, waiter)
+        self.__timers = []
+        self.__seq = 0
+        self.__running: Optional[_Waiter] = None
+        self.__until = math.inf
+        # Threads only take turns within a run
+        self.__halted = threading.Event()
+        self.__halted.set()
+
+        self._switches = 0
+        return
+
+    def monotonic(self) -> float:
+        return self.__now
+
+    def threadTime(self) -> float:
+        return self.__now
+
+    def __current(self) -> _Waiter:
+        current = threading.current_thread()
+        if not isinstance(current, _VirtualThread) or \
+                current.clock is not self:
+            raise FDSClockException(
+                "Thread `{0}` is not a thread of the clock."
+                .format(current.name))
+        return current.waiter
+
+    def __schedule(self, at: float, waiter: _Waiter):
+        """
+        Schedule a waiter to run at a time, with the lock held.
+        """
+
+        heapq.heappush(self.__timers, (at, self.__seq, waiter.ticket, waiter))
+        self.__seq += 1
+        return
+
+    def __dispatch(self):
+        """
+        Give the turn to the thread whose wait ends first, with the lock
+        held, or halt if none does before the end of the run.
+        """
+
+        self.__running = None
+        timers = self.__timers
+        while len(timers) != 0:
+            (at, _, ticket, waiter) = timers[0]
+            if ticket != waiter.ticket:
+                heapq.heappop(timers)
+                continue
+            if at > self.__until:
+                break
+            heapq.heappop(timers)
+            waiter.ticket += 1
+            self.__now = max(self.__now, at)
+            self.__running = waiter
+            self._switches += 1
+            waiter.go.set()
+            return
+        self.__halted.set()
+        return
+
+    def __block(self, waiter: _Waiter):
+        """
+        Give up the turn and wait for it, with the lock held.
+        """
+
+        self.__dispatch()
+        self.__lock.release()
+        try:
+            waiter.go.wait()
+            waiter.go.clear()
+        finally:
+            self.__lock.acquire()
+        return
+
+    def _register(self, waiter: _Waiter):
+        with self.__lock:
+            self.__schedule(self.__now, waiter)
+            if self.__running is None and not self.__halted.is_set():
+                self.__dispatch()
+        return
+
+    def _exit(self):
+        with self.__lock:
+            self.__dispatch()
+        return
+
+    def _set(self, event: _VirtualEvent):
+        with self.__lock:
+            event._setFlag()
+            # Waiters resume at the current time, after the setter waits
+            for waiter in event.waiters:
+                waiter.ticket += 1
+                self.__schedule(self.__now, waiter)
+            event.waiters.clear()
+            if self.__running is None and not self.__halted.is_set():
+                self.__dispatch()
+        return
+
+    def _wait(self, event: _VirtualEvent, timeout: Optional[float]) -> bool:
+        waiter = self.__current()
+        with self.__lock:
+            if event.is_set():
+                return True
+            event.waiters.append(waiter)
+            if timeout is not None:
+                self.__schedule(self.__now + max(0., timeout), waiter)
+            self.__block(waiter)
+            if waiter in event.waiters:
+                event.waiters.remove(waiter)
+            return event.is_set()
+
+    def sleep(self, seconds: float):
+        waiter = self.__current()
+        with self.__lock:
+            self.__schedule(self.__now + max(0., seconds), waiter)
+            self.__block(waiter)
+        return
+
+    def event(self) -> _VirtualEvent:
+        return _VirtualEvent(self)
+
+    def thread(self, target: Callable[..., Any], name: Optional[str] = None,
+               daemon: bool = True, args: tuple = ()) -> _VirtualThread:
+        """
+        Create a thread of the clock, daemonic as it may never be given a
+        turn again once the run ends.
+        """
+
+        return _VirtualThread(self, target, name, daemon, args)
+
+    def run(self, until: float, timeout: Optional[float] = None) -> bool:
+        """
+        Let the threads of the clock run until the time of the clock reaches
+        `until`, or all of them wait without timeout. Threads are left
+        waiting for their turn, and the run may be continued.
+
+        Must not be called from a thread of the clock.
+
+        :param until: Time to end the run at, in seconds of the clock.
+        :type until: float
+        :param timeout: Real time to wait for the run, in seconds.
+        :type timeout: Optional[float]
+        :return: True if the run ended, false on timeout.
+        :rtype: bool
+        """
+
+        with self.__lock:
+            self.__until = until
+            self.__halted.clear()
+            if self.__running is None:
+                self.__dispatch()
+        if not self.__halted.wait(timeout):
+            return False
+        with self.__lock:
+            # Time passes to the end of the run even if no thread waits
+            #  until then
+            self.__now = max(self.__now, until) \
+                if math.isfinite(until) else self.__now
+        return True
@@ -0,0 +1,251 @@
+from typing import List, Optional
+
+import numpy as np
+
+from .util import convertPolarCartesian
+from .dtypes import resolveDType
+
+
+class PackedClusters(object):
+    """
+    Clusters of a scan packed into flat arrays, in the manner of a compressed
+    sparse row matrix: the points of all clusters in a single array ordered
+    by cluster, and the offsets of each cluster within it.
+
+    Cluster `i` is the view `points[offsets[i]:offsets[i + 1]]`, so clusters
+    are passed between the algorithms, the room, plotting and IPC without
+    building per-cluster arrays. Clusters are never empty.
+    """
+
+    __slots__ = ("__points", "__offsets", "__noise", "__centers")
+
+    def __init__(self, points: np.ndarray, offsets: np.ndarray,
+                 noise: np.ndarray, centers: Optional[np.ndarray] = None):
+        """
+        :param points: Points of all clusters of shape (n_points, 2) of form
+            (degree, distance), ordered by cluster.
+        :type points: np.ndarray
+        :param offsets: Offsets of each cluster within `points` of shape
+            (n_clusters + 1), starting at 0 and ending at `n_points`.
+        :type offsets: np.ndarray
+        :param noise: Unclustered points of shape (n_noise, 2).
+        :type noise: np.ndarray
+        :param centers: Angular centers of each cluster in degrees within the
+            range of [0-360), or `None` if not computed.
+        :type centers: Optional[np.ndarray]
+        """
+
+        self.__points = points
+        self.__offsets = offsets
+        self.__noise = noise
+        self.__centers = centers
+        return
+
+    @classmethod
+    def empty(cls, noise: Optional[np.ndarray] = None,
+              dtype: Optional[np.dtype] = None) -> "PackedClusters":
+        """
+        Get a set of no clusters.
+
+        :param noise: Unclustered points, defaults to none.
+        :type noise: Optional[np.ndarray]
+        :param dtype: Data type of the points, defaults to that of `noise` if
+            given, or the dtype policy.
+        :type dtype: Optional[np.dtype]
+        :rtype: PackedClusters
+        """
+
+        if dtype is None:
+            dtype = resolveDType(None if noise is None else noise.dtype)
+        return cls(np.empty((0, 2), dtype=dtype), np.zeros(1, dtype=np.intp),
+                   np.empty((0, 2), dtype=dtype) if noise is None else noise,
+                   np.empty(0, dtype=dtype))
+
+    @classmethod
+    def fromLabels(cls, pts: np.ndarray, labels: np.ndarray,
+                   out: Optional[np.ndarray] = None) -> "PackedClusters":
+        """
+        Pack points by their cluster labels in one vectorized pass.
+
+        Points are grouped with a stable argsort of the labels, so points of
+        a cluster keep their order, such as increasing angle.
+
+        :param pts: Points of shape (n, 2).
+        :type pts: np.ndarray
+        :param labels: Integer labels of shape (n), with -1 for noise.
+        :type labels: np.ndarray
+        :param out: An array of at least n rows to write the grouped points
+            to, instead of allocating one. Points and noise of the result are
+            views of it.
+        :type out: Optional[np.ndarray]
+        :rtype: PackedClusters
+        """
+
+        n = len(pts)
+        order = np.argsort(labels, kind="stable")
+        grouped = np.take(pts, order, axis=0,
+                          out=None if out is None else out[0:n], mode="clip")
+        sorted_labels = labels[order]
+
+        # Noise sorts first, clusters start wherever the label changes
+        n_noise = int(np.searchsorted(sorted_labels, 0))
+        starts = np.flatnonzero(sorted_labels[n_noise + 1:] !=
+                                sorted_labels[n_noise:n - 1]) + 1
+        offsets = np.empty(len(starts) + 2 if n != n_noise else 1,
+                           dtype=np.intp)
+        offsets[0] = 0
+        offsets[1:len(starts) + 1] = starts
+        offsets[-1] = n - n_noise
+        return cls(grouped[n_noise:n], offsets, grouped[0:n_noise])
+
+    @classmethod
+    def concatenate(cls, parts: List["PackedClusters"],
+                    noise: Optional[np.ndarray] = None) -> "PackedClusters":
+        """
+        Join sets of clusters into one, in order.
+
+        :param parts: The sets of clusters to join. Centers are kept only if
+            every set has them.
+        :type parts: List[PackedClusters]
+        :param noise: Unclustered points of the result, defaults to the noise
+            of all sets.
+        :type noise: Optional[np.ndarray]
+        :rtype: PackedClusters
+        """
+
+        if len(parts) == 0:
+            return cls.empty(noise)
+
+        points = np.concatenate([p.points for p in parts], axis=0)
+        bases = np.cumsum([0] + [len(p.points) for p in parts])
+        offsets = np.concatenate(
+            [p.offsets[0:-1] + base for (p, base) in zip(parts, bases)] +
+            [bases[-1:]]).astype(np.intp)
+        centers = None
+        if all(p.centers is not None for p in parts):
+            centers = np.concatenate([p.centers for p in parts])
+        if noise is None:
+            noise = np.concatenate([p.noise for p in parts], axis=0)
+        return cls(points, offsets, noise, centers)
+
+    @property
+    def points(self) -> np.ndarray:
+        return self.__points
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self.__offsets
+
+    @property
+    def noise(self) -> np.ndarray:
+        return self.__noise
+
+    @property
+    def centers(self) -> Optional[np.ndarray]:
+        return self.__centers
+
+    @centers.setter
+    def centers(self, centers: np.ndarray):
+        self.__centers = centers
+        return
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Number of points of each cluster.
+        """
+
+        return np.diff(self.__offsets)
+
+    def __len__(self) -> int:
+        return len(self.__offsets) - 1
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        """
+        Get a view of the points of a cluster.
+        """
+
+        offsets = self.__offsets
+        return self.__points[offsets[idx]:offsets[idx + 1]]
+
+    def centroids(self, cart: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Get the cartesian centroids of all clusters in a single pass.
+
+        :param cart: The points of the clusters already converted to
+            cartesian coordinates, if available.
+        :type cart: Optional[np.ndarray]
+        :return: An array of shape (n_clusters, 2) of (x, y) centroids.
+        :rtype: np.ndarray
+        """
+
+        if len(self) == 0:
+            return np.empty((0, 2))
+        if cart is None:
+            cart = convertPolarCartesian(self.__points)
+        ctrs = np.add.reduceat(cart, self.__offsets[0:-1], axis=0)
+        np.divide(ctrs, self.counts[:, None], out=ctrs)
+        return ctrs
+
+    def computeCenters(self, cart: Optional[np.ndarray] = None
+                       ) -> np.ndarray:
+        """
+        Set the centers of the clusters to the angles of their cartesian
+        centroids.
+
+        :param cart: The points of the clusters already converted to
+            cartesian coordinates, if available.
+        :type cart: Optional[np.ndarray]
+        :return: The centers in degrees within the range of [0-360).
+        :rtype: np.ndarray
+        """
+
+        ctrs = self.centroids(cart)
+        centers = np.degrees(np.arctan2(ctrs[:, 1], ctrs[:, 0]))
+        np.mod(centers, 360., out=centers)
+        self.__centers = centers
+        return centers
+
+    def indices(self) -> np.ndarray:
+        """
+        Get the index of the cluster of each point.
+
+        :return: An array of shape (n_points).
+        :rtype: np.ndarray
+        """
+
+        return np.repeat(np.arange(0, len(self)), self.counts)
+
+    def select(self, idx: np.ndarray) -> "PackedClusters":
+        """
+        Get a copy of a subset of the clusters, without noise.
+
+        :param idx: Indices of the clusters to keep, in order.
+        :type idx: np.ndarray
+        :rtype: PackedClusters
+        """
+
+        idx = np.asarray(idx, dtype=np.intp)
+        offsets = self.__offsets
+        counts = offsets[idx + 1] - offsets[idx]
+        new_offsets = np.zeros(len(idx) + 1, dtype=np.intp)
+        np.cumsum(counts, out=new_offsets[1:])
+        # Point indices of each kept cluster, as runs from their offsets
+        runs = np.repeat(offsets[idx] - new_offsets[0:-1], counts) + \
+            np.arange(0, new_offsets[-1])
+        centers = None if self.__centers is None else self.__centers[idx]
+        return PackedClusters(self.__points[runs], new_offsets,
+                              np.empty((0, 2), dtype=self.__points.dtype),
+                              centers)
+
+    def copy(self) -> "PackedClusters":
+        """
+        Get a copy which does not share memory, such as with a scratch
+        arena.
+
+        :rtype: PackedClusters
+        """
+
+        return PackedClusters(
+            self.__points.copy(), self.__offsets.copy(), self.__noise.copy(),
+            None if self.__centers is None else self.__centers.copy())
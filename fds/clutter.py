@@ -0,0 +1,231 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .clusters import PackedClusters
+from .tracking import clusterFeatures
+
+
+class _ClutterRegion(object):
+    """
+    A candidate or suppressed region of static clutter.
+    """
+
+    __slots__ = ("ctr", "extent", "bounds", "first_seen", "last_seen",
+                 "suppressed", "last_present")
+
+    def __init__(self, ctr: np.ndarray, extent: float, bounds: np.ndarray,
+                 now: float):
+        self.ctr = ctr
+        self.extent = extent
+        # Angular start, angular span, minimum and maximum distance
+        self.bounds = bounds
+        self.first_seen = now
+        self.last_seen = now
+        self.suppressed = False
+        # Last time the region still held the object while suppressed
+        self.last_present = now
+        return
+
+
+class StaticClutterMap(object):
+    """
+    Class for learning static, persistent non-human clusters of a room, such
+    as furniture, and suppressing their points from filtered scans.
+
+    Clusters whose centroid and extent stay stable for longer than the dwell
+    time are added to the suppression mask, which moves points within their
+    region to the culled set. Regions expire once the object has left.
+    """
+
+    DEFAULT_DWELL_SEC: float = 600.
+    DEFAULT_STABLE_DIST: float = 50.
+    DEFAULT_STABLE_EXTENT: float = 50.
+    DEFAULT_MARGIN_DEG: float = 1.
+    DEFAULT_MARGIN_DIST: float = 50.
+    DEFAULT_FORGET_SEC: float = 5.
+    DEFAULT_EXPIRE_SEC: float = 10.
+    DEFAULT_MIN_POINTS: int = 3
+
+    def __init__(self, dwell_sec: float = DEFAULT_DWELL_SEC,
+                 stable_dist: float = DEFAULT_STABLE_DIST,
+                 stable_extent: float = DEFAULT_STABLE_EXTENT,
+                 margin_deg: float = DEFAULT_MARGIN_DEG,
+                 margin_dist: float = DEFAULT_MARGIN_DIST,
+                 forget_sec: float = DEFAULT_FORGET_SEC,
+                 expire_sec: float = DEFAULT_EXPIRE_SEC,
+                 min_points: int = DEFAULT_MIN_POINTS):
+        """
+        :param dwell_sec: Time a cluster must stay stable to be suppressed.
+        :param stable_dist: Maximum centroid movement, in units of distance,
+            of a stable cluster.
+        :param stable_extent: Maximum extent change, in units of distance, of
+            a stable cluster.
+        :param margin_deg: Angular margin added around suppressed regions.
+        :param margin_dist: Distance margin added around suppressed regions.
+        :param forget_sec: Time a candidate may go unseen before it is
+            forgotten.
+        :param expire_sec: Time a suppressed region may hold fewer than
+            `min_points` points before it expires.
+        :param min_points: Minimum number of points within a suppressed
+            region for its object to be considered present.
+        """
+
+        self.__dwell_sec = dwell_sec
+        self.__stable_dist = stable_dist
+        self.__stable_extent = stable_extent
+        self.__margin_deg = margin_deg
+        self.__margin_dist = margin_dist
+        self.__forget_sec = forget_sec
+        self.__expire_sec = expire_sec
+        self.__min_points = min_points
+
+        self.__regions: List[_ClutterRegion] = []
+        self.__mask = np.empty((0, 4))
+
+        self._suppressed_pts = 0
+        self._added = 0
+        self._expired = 0
+        return
+
+    def __clusterBounds(self, pts: np.ndarray) -> np.ndarray:
+        """
+        Get the polar bounds of a cluster, with margins.
+        """
+
+        ang = pts[:, 0]
+        # Measure angles from the first point to handle clusters wrapping
+        #  around 0 degrees
+        rel = (ang - ang[0] + 180.) % 360. - 180.
+        start = (ang[0] + rel.min() - self.__margin_deg) % 360.
+        span = rel.max() - rel.min() + 2 * self.__margin_deg
+        return np.array((start, span,
+                         pts[:, 1].min() - self.__margin_dist,
+                         pts[:, 1].max() + self.__margin_dist))
+
+    def observe(self, clusters: PackedClusters, now: float,
+                learn: Optional[np.ndarray] = None):
+        """
+        Observe the clusters of a frame, promoting clusters stable beyond the
+        dwell time to suppressed regions.
+
+        :param clusters: Clusters of points of form (degree, distance).
+        :type clusters: PackedClusters
+        :param now: The time of the frame, in seconds.
+        :type now: float
+        :param learn: A boolean array marking the clusters which may be
+            clutter, such as those of tracks which never moved nor fell,
+            defaults to all clusters. Other clusters are neither candidates
+            nor keep candidates seen.
+        :type learn: Optional[np.ndarray]
+        """
+
+        (ctrs, extents, _) = clusterFeatures(clusters)
+        candidates = [r for r in self.__regions if not r.suppressed]
+
+        for i in range(0, len(clusters)):
+            if learn is not None and not learn[i]:
+                continue
+            pts = clusters[i]
+            match = None
+            for region in candidates:
+                if np.linalg.norm(region.ctr - ctrs[i]) <= \
+                        self.__stable_dist and \
+                        abs(region.extent - extents[i]) <= \
+                        self.__stable_extent:
+                    match = region
+                    break
+
+            if match is None:
+                self.__regions.append(_ClutterRegion(
+                    ctrs[i], extents[i], self.__clusterBounds(pts), now))
+                continue
+
+            match.last_seen = now
+            # Promoted by another cluster of the frame
+            if match.suppressed:
+                continue
+            match.bounds = self.__clusterBounds(pts)
+            if now - match.first_seen >= self.__dwell_sec:
+                match.suppressed = True
+                match.last_present = now
+                self._added += 1
+
+        # Forget candidates which moved or left before the dwell time
+        self.__regions = [r for r in self.__regions if r.suppressed or
+                          now - r.last_seen <= self.__forget_sec]
+        self.__updateMask()
+        return
+
+    def __updateMask(self):
+        bounds = [r.bounds for r in self.__regions if r.suppressed]
+        self.__mask = np.array(bounds).reshape(-1, 4)
+        return
+
+    def apply(self, unculled: np.ndarray, culled: np.ndarray, now: float
+              ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Move points within suppressed regions from the unculled to the culled
+        set, expiring regions whose object has left.
+
+        :param unculled: Unculled points of shape (n, 2) of form
+            (degree, distance).
+        :param culled: Culled points of shape (n, 2).
+        :param now: The time of the frame, in seconds.
+        :return: A tuple of unculled and culled points, respectively.
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+
+        mask = self.__mask
+        if len(mask) == 0 or len(unculled) == 0:
+            return (unculled, culled)
+
+        unculled = unculled.reshape(-1, 2)
+        # Test every point against every region at once
+        rel = (unculled[None, :, 0] - mask[:, None, 0]) % 360.
+        inside = (rel <= mask[:, None, 1]) & \
+            (unculled[None, :, 1] >= mask[:, None, 2]) & \
+            (unculled[None, :, 1] <= mask[:, None, 3])
+
+        # Expire regions no longer holding their object
+        present = inside.sum(axis=1) >= self.__min_points
+        suppressed = [r for r in self.__regions if r.suppressed]
+        expired = False
+        for (region, is_present) in zip(suppressed, present):
+            if is_present:
+                region.last_present = now
+            elif now - region.last_present > self.__expire_sec:
+                self.__regions.remove(region)
+                self._expired += 1
+                expired = True
+        if expired:
+            self.__updateMask()
+
+        sup = inside.any(axis=0)
+        n_sup = int(sup.sum())
+        if n_sup == 0:
+            return (unculled, culled)
+        self._suppressed_pts += n_sup
+
+        culled = np.concatenate((culled.reshape(-1, 2), unculled[sup]),
+                                axis=0)
+        culled = culled[culled[:, 0].argsort(kind="stable")]
+        return (unculled[~sup], culled)
+
+    def stats(self) -> dict:
+        """
+        Get counters of the clutter map.
+
+        :return: A dictionary of suppressed and candidate region counts,
+            regions added and expired, and suppressed points.
+        :rtype: dict
+        """
+
+        n_sup = sum(1 for r in self.__regions if r.suppressed)
+        return {
+            "suppressed": n_sup,
+            "candidates": len(self.__regions) - n_sup,
+            "added": self._added,
+            "expired": self._expired,
+            "suppressed_pts": self._suppressed_pts,
+        }
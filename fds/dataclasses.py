@@ -1,9 +1,30 @@
-from typing import List, Callable, Any
+from typing import List, Dict, Callable, Any, Optional
 from enum import IntEnum, auto
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import numpy as np
 
+from .clusters import PackedClusters
+from .dtypes import DEFAULT_DTYPE
+
+
+class _SlottedPickle(object):
+    """
+    Mixin for slotted dataclasses which are pickled, such as training sets
+    and calibrations, to keep loading pickles written before they were
+    slotted, whose state is a dictionary of fields.
+    """
+
+    __slots__ = ()
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            # Slotted instances pickle as (None, slot state)
+            state = state[1]
+        for (name, value) in state.items():
+            object.__setattr__(self, name, value)
+        return
+
 
 class SensorClassType(IntEnum):
     LIDAR = auto()
@@ -13,14 +34,46 @@ class LidarDeviceType(IntEnum):
     RPLIDAR = auto()
 
 
-@dataclass
-class GlobalTrainingSets:
+class OverloadPolicy(IntEnum):
+    """
+    Enumeration of the scans a sensor buffer keeps when processing falls
+    behind the sensor.
+    """
+
+    DROP_OLDEST = auto()  # Evict the oldest scan once the buffer is full
+    LATEST_ONLY = auto()  # Keep the newest scan only
+    DECIMATE = auto()  # Keep every nth scan while scans are unprocessed
+
+
+class CachePolicy(IntEnum):
+    """
+    Enumeration of eviction policies of the classification cache.
+    """
+
+    LRU = auto()  # Evict the least recently used entry
+    FIFO = auto()  # Evict the oldest inserted entry
+
+
+@dataclass(slots=True)
+class GlobalTrainingSets(_SlottedPickle):
     clsf_lidar_knn_nkp: int
     clsf_lidar_knn_set_kpdata: List[np.ndarray]
     clsf_lidar_knn_set_labels: List[int]
 
 
-@dataclass
+@dataclass(slots=True)
+class SensorPose:
+    """
+    Dataclass for the extrinsic pose of a sensor within the frame of the room
+    it is assigned to.
+    """
+
+    x: float = 0.  # Translation of the sensor origin, in units of distance
+    y: float = 0.
+    theta: float = 0.  # Rotation of the sensor's 0 degree axis, in degrees
+
+
+@dataclass(slots=True)
 class SensorInfo:
     """
     Dataclass for sensor information necessary to load calibration data into
@@ -33,38 +86,238 @@ class SensorInfo:
     devicetype: int
     calibration_type: int
     calibration_path: str
+    pose: SensorPose = field(default_factory=SensorPose)
 
 
-@dataclass
+@dataclass(slots=True)
 class RoomCallbacks:
-    event_cb: Callable[[int], Any]
-    pushdata_cb: Callable[[int, np.ndarray, np.ndarray, List[np.ndarray]], Any]
+    event_cb: Callable[[int, int], Any]  # Room uid and person/track id
+    pushdata_cb: Callable[[int, np.ndarray, PackedClusters], Any]
+    # Room uid and the activity state entered
+    state_cb: Optional[Callable[[int, Any], Any]] = None
+
+
+@dataclass(slots=True)
+class SchedulerConfig:
+    """
+    Dataclass for the targets of the adaptive processing scheduler of a room.
+    """
+
+    low_period_min_sec: float = 0.7
+    low_period_max_sec: float = 2.0
+    high_period_min_sec: float = 0.0
+    high_period_max_sec: float = 0.3
+    # Time without occupancy before sensors are idled
+    idle_after_sec: float = 300.
+    idle_probe_period_sec: float = 5.0
+    # Motor PWM while idle, zero stops scanning entirely
+    idle_motor_pwm: int = 0
+    motor_spinup_sec: float = 2.0
+    # Upper bound on the time from a person entering to being detected
+    max_detect_latency_sec: float = 8.0
+    # Fraction of a single core the room may spend processing
+    cpu_budget: float = 0.5
+    # Cluster centroid speed, in sensor units of distance (mm for RPLidar)
+    #  per second, to consider a cluster moving
+    motion_speed_thresh: float = 100.
+
+
+@dataclass(slots=True)
+class GeometricGateConfig:
+    """
+    Dataclass for the rules rejecting clusters implausible to be a person
+    before classification. Distances are in sensor units (mm for RPLidar).
+    """
 
+    min_points: int = 6
+    max_span_deg: float = 90.
+    min_width: float = 50.
+    max_width: float = 2000.
+    # Maximum mean distance of a cluster from the room origin
+    max_range: float = 12000.
 
-@dataclass
+
+@dataclass(slots=True)
+class RecorderConfig:
+    """
+    Dataclass for the black-box recorder of a room, persisting the frames
+    around each fall event.
+    """
+
+    enabled: bool = True
+    # Recordings of each room are written to a directory of their own
+    output_dir: str = "./recordings"
+    # Time recorded before and after an event
+    window_sec: float = 10.
+    post_sec: float = 5.
+    # Highest frame rate the window is held at, sizes the in-memory ring
+    max_frame_rate: float = 10.
+    # Bounds on the recordings kept per room, the oldest are deleted first
+    max_recordings: int = 50
+    max_disk_mb: float = 256.
+
+
+@dataclass(slots=True)
+class BackpressureConfig:
+    """
+    Dataclass for the buffering of scans between the acquisition of each
+    sensor and the processing of the room.
+    """
+
+    policy: OverloadPolicy = OverloadPolicy.DROP_OLDEST
+    # Scans held per sensor
+    depth: int = 5
+    # Scans kept, one in `decimation`, once `decimate_backlog` scans are
+    #  waiting to be processed with the DECIMATE policy
+    decimation: int = 2
+    decimate_backlog: int = 2
+
+
+@dataclass(slots=True)
+class CacheConfig:
+    """
+    Dataclass for the cache of classification results of a room.
+    """
+
+    # Maximum number of entries, zero disables the cache
+    size: int = 256
+    # Quantization step of keypoints, in sensor units of distance (mm for
+    #  RPLidar). Clusters whose keypoints are equal once quantized share an
+    #  entry
+    quantum: float = 25.
+    policy: CachePolicy = CachePolicy.LRU
+    # Time an entry stays valid, `None` for no expiry
+    ttl_sec: Optional[float] = 30.
+    # Key entries by the track of their cluster too, so that results are
+    #  never shared between people
+    key_by_track: bool = False
+
+
+@dataclass(slots=True)
 class RoomConfig:
     uid: int
     sensors_assigned: List[int]
+    # Per-room overrides of `SensorInfo.pose`, keyed by sensor uid
+    sensor_poses: Dict[int, SensorPose] = field(default_factory=dict)
+    # Maximum time difference between scans of different sensors assembled
+    #  and fused into a single frame
+    frame_skew_tol_sec: float = 0.5
+    scheduler: SchedulerConfig = field(default_factory=SchedulerConfig)
+    geometric_gate: GeometricGateConfig = \
+        field(default_factory=GeometricGateConfig)
+    # Cluster the HIGH state over the sliding window of scans incrementally,
+    #  rather than clustering each scan on its own
+    incremental_window: bool = False
+    # Cluster fused frames as range images of a fixed angular grid of this
+    #  many bins, rather than as samples, `None` for samples. Bins may not be
+    #  finer than the angular resolution of the sensors, as clusters are runs
+    #  of occupied bins. Images take precedence over the clustering of the
+    #  HIGH state chosen above
+    range_image_bins: Optional[int] = None
+    # Minimum number of bins of a run of a range image to be a cluster
+    range_image_min_bins: int = 6
+    recorder: RecorderConfig = field(default_factory=RecorderConfig)
+    backpressure: BackpressureConfig = \
+        field(default_factory=BackpressureConfig)
+    cache: CacheConfig = field(default_factory=CacheConfig)
 
 
-@dataclass
+@dataclass(slots=True)
+class InferenceConfig:
+    """
+    Dataclass for the service classifying the clusters of the rooms of a
+    domain in batches.
+    """
+
+    enabled: bool = True
+    # Time a batch is gathered for once its first request arrives, unless
+    #  every room has a request queued sooner
+    window_sec: float = 0.002
+    max_batch: int = 64
+    # Requests beyond the bound are predicted inline by their room
+    max_queue: int = 256
+    # Time a request may wait to be taken into a batch before its room
+    #  predicts it inline
+    timeout_sec: float = 0.05
+
+
+@dataclass(slots=True)
+class PriorityConfig:
+    """
+    Dataclass for admitting the frames of the rooms of a domain to
+    processing by the activity state of their room.
+    """
+
+    enabled: bool = True
+    # Frames processed at once, `None` for the number of cores
+    slots: Optional[int] = None
+    # Time a frame of a room in the HIGH state should wait at most to be
+    #  processed, and the time after which a waiting frame of a LOW room is
+    #  processed ahead of newer HIGH frames, so that LOW rooms never starve
+    high_deadline_sec: float = 0.05
+    low_deadline_sec: float = 2.0
+
+
+@dataclass(slots=True)
 class DomainConfig:
     uid: int
     room_configs: List[RoomConfig]
+    inference: InferenceConfig = field(default_factory=InferenceConfig)
+    priority: PriorityConfig = field(default_factory=PriorityConfig)
+
+
+@dataclass(slots=True)
+class SupervisorConfig:
+    """
+    Dataclass for running each domain in a worker process of its own,
+    supervised by the root process.
+    """
+
+    enabled: bool = False
+    # Pin each worker to its share of the available cores
+    cpu_affinity: bool = True
+    # Interval of the heartbeats of workers, and the time without one after
+    #  which a worker is considered hung and restarted
+    heartbeat_sec: float = 2.
+    heartbeat_timeout_sec: float = 15.
+    # Time a room of a worker may pull no frame before the worker is failed
+    #  as stuck, though it still beats. Must exceed the longest period of a
+    #  room, the probe period of idle rooms and the spin up of their sensors
+    progress_timeout_sec: float = 30.
+    # Time a worker is given to load training and start sensors before its
+    #  first heartbeat is due
+    startup_grace_sec: float = 30.
+    # Delay before restarting a failed worker, doubled per consecutive
+    #  failure up to the maximum
+    restart_backoff_sec: float = 1.
+    restart_backoff_max_sec: float = 60.
+    # Time a worker must run for its failures to no longer count as
+    #  consecutive
+    stable_after_sec: float = 60.
 
 
-@dataclass
+@dataclass(slots=True)
 class GlobalConfig:
     socket_dir: str
     sensors: List[SensorInfo]
     dom_configs: List[DomainConfig]
+    # Floating point type samples are processed in, see `.dtypes`
+    dtype: str = DEFAULT_DTYPE.name
+    # Local port to export metrics on in the Prometheus text format, `None`
+    #  to not export them over HTTP
+    metrics_port: Optional[int] = None
+    metrics_host: str = "127.0.0.1"
+    # Directory profiles, stack dumps and allocation snapshots requested
+    #  over the command socket are written to
+    diagnostics_dir: str = "./diagnostics"
+    supervisor: SupervisorConfig = field(default_factory=SupervisorConfig)
 
 
-@dataclass
-class CalibrationData:
+@dataclass(slots=True)
+class CalibrationData(_SlottedPickle):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class BoundsCalibrationData(CalibrationData):
     arcsec_bounds: np.ndarray
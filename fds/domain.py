@@ -1,4 +1,4 @@
-from typing import Optional, Callable, Any, List, Dict
+from typing import Optional, Callable, Any, Dict
 from enum import IntEnum
 
 import logging
@@ -6,15 +6,21 @@ import threading
 
 import numpy as np
 
-from .dataclasses import DomainConfig
+from .dataclasses import DomainConfig, RoomCallbacks
 from .sensor import Sensor
 from .algs import GlobalTrainingSets, LidarAlgSet
 from .room import Room
+from .clusters import PackedClusters
+from .metrics import MetricsRegistry
+from .inference import InferenceService
+from .scheduler import PriorityScheduler
+from .profiling import Diagnostics, FDSDiagnosticsException
 from .ipc import Socket, FallEventInfo
 
 # FUTURE: Plot should eventually be removed with routines merged into FDSSocket
 #   or other status communicator to send plots over a socket
 from .plot import LidarPlotter
+from .clock import Clock
 
 
 class Domain(object):
@@ -26,12 +32,23 @@ class Domain(object):
     class Callback(IntEnum):
         PAUSE = 0,
         RESUME = 1,
+        STATS = 2,
+        PROFILE_START = 3,
+        PROFILE_STOP = 4,
+        DUMP_STACKS = 5,
+        TRACEMALLOC_START = 6,
+        TRACEMALLOC_SNAPSHOT = 7,
+        TRACEMALLOC_STOP = 8,
 
     def __init__(self, domain_config: DomainConfig,
                  training: GlobalTrainingSets,
                  sensors: Dict[int, Sensor],
                  socket_dir: str,
-                 logger: logging.Logger):
+                 logger: logging.Logger,
+                 dtype: Optional[np.dtype] = None,
+                 metrics: Optional[MetricsRegistry] = None,
+                 diagnostics: Optional[Diagnostics] = None,
+                 clock: Optional[Clock] = None):
         """
         :param domain_config: A room specific configuration to use.
         :type domain_config: FDSDomainConfig
@@ -39,14 +56,55 @@ class Domain(object):
         :type socket: FDSSocket
         :param logger: The logger to use for logging.
         :type logger: logging.Logger
+        :param dtype: Data type the rooms of the domain process samples in,
+            defaults to the dtype policy.
+        :type dtype: Optional[np.dtype]
+        :param metrics: The registry to register the metrics of the domain
+            to, defaults to a registry of its own.
+        :type metrics: Optional[MetricsRegistry]
+        :param diagnostics: Diagnostics of the process to run on command,
+            diagnostic commands fail without them.
+        :type diagnostics: Optional[Diagnostics]
+        :param clock: The clock the rooms and threads of the domain run in,
+            defaults to real time.
+        :type clock: Optional[Clock]
         """
 
         self.__config = domain_config
-        self.__lidar_alg_set = LidarAlgSet(training)
+        self.__clock = Clock() if clock is None else clock
+        self.__lidar_alg_set = LidarAlgSet(training, dtype=dtype)
+        if metrics is None:
+            metrics = MetricsRegistry()
+        metrics = metrics.scope(domain=domain_config.uid)
+        self.__metrics = metrics
+        self.__diagnostics = diagnostics
+
+        # Rooms share a service classifying their clusters in batches, which
+        #  only pays off with more than one room
+        self.__inference = None
+        if domain_config.inference.enabled and \
+                len(domain_config.room_configs) > 1:
+            self.__inference = InferenceService(self.__lidar_alg_set,
+                                                domain_config.inference,
+                                                metrics, clock=self.__clock)
+        # Frames of rooms with activity are processed ahead of the polls of
+        #  empty rooms
+        self.__priority = None
+        if domain_config.priority.enabled and \
+                len(domain_config.room_configs) > 1:
+            self.__priority = PriorityScheduler(domain_config.priority,
+                                                metrics, clock=self.__clock)
 
         callback_map = {
             self.Callback.PAUSE: self.pause,
             self.Callback.RESUME: self.resume,
+            self.Callback.STATS: self.stats,
+            self.Callback.PROFILE_START: self.startProfile,
+            self.Callback.PROFILE_STOP: self.stopProfile,
+            self.Callback.DUMP_STACKS: self.dumpStacks,
+            self.Callback.TRACEMALLOC_START: self.startTracemalloc,
+            self.Callback.TRACEMALLOC_SNAPSHOT: self.snapshotTracemalloc,
+            self.Callback.TRACEMALLOC_STOP: self.stopTracemalloc,
         }
         socket = Socket(socket_dir, domain_config.uid, callback_map, logger)
         self.__socket = socket
@@ -57,20 +115,22 @@ class Domain(object):
         self.__threads_condexit = threading.Condition()
         self.__threads_toexit = 0
 
-        self.addThread(self.__plotter.__thread_plotLoop,
-                       name="FDS Plot Loop")
+        self.addThread(self.__plotter.plotLoop, name="FDS Plot Loop")
 
         self.__rooms = []
-        room_configs = self.__dom_config.room_configs
+        room_configs = self.__config.room_configs
         lidar_alg_set = self.__lidar_alg_set
         for room_config in room_configs:
             priv_sensors = []
             for uid in room_config.sensors_assigned:
                 priv_sensors.append(sensors[uid])
+            callbacks = RoomCallbacks(event_cb=self._emitFallEvent,
+                                      pushdata_cb=self._pushData)
             room = Room(room_config, lidar_alg_set, priv_sensors,
-                        self._emitFallEvent,
-                        logger)
-            self.addThread(target=room.__thread_classification,
+                        callbacks, logger, metrics=metrics,
+                        inference=self.__inference,
+                        priority=self.__priority, clock=self.__clock)
+            self.addThread(target=room.run,
                            name="FDS Classification Thread")
             self.__rooms.append(room)
 
@@ -84,10 +144,12 @@ class Domain(object):
         to ensure the `wait` function unblocks and exits.
         """
 
-        func()
-        with self.__threads_condexit:
-            self.__threads_toexit -= 1
-        self.__threads_condexit.notify(1)
+        try:
+            func()
+        finally:
+            with self.__threads_condexit:
+                self.__threads_toexit -= 1
+                self.__threads_condexit.notify_all()
         return
 
     def addThread(self, target: Callable[..., Any], name: Optional[str] = None,
@@ -103,8 +165,9 @@ class Domain(object):
         :type daemon: bool
         """
 
-        thread = threading.Thread(target=self.__threadWrapper, args=(target),
-                                  name=name, daemon=daemon)
+        thread = self.__clock.thread(target=self.__threadWrapper,
+                                     name=name, daemon=daemon,
+                                     args=(target,))
         self.__threads_toexit += 1
         self.__threads.append(thread)
         return
@@ -115,7 +178,7 @@ class Domain(object):
         """
 
         for thread in self.__threads:
-            thread.run()
+            thread.start()
         return
 
     def start(self):
@@ -125,8 +188,11 @@ class Domain(object):
 
         if self._running:
             return
+        if self.__inference is not None:
+            self.__inference.start()
         self.__socket.bindBegin()
         self.__runThreads()
+        self._running = True
         return
 
     def stop(self):
@@ -136,6 +202,10 @@ class Domain(object):
 
         if not self._running:
             return
+        self.__plotter.stop()
+        if self.__inference is not None:
+            self.__inference.stop()
+        self._running = False
         return
 
     def return_wait(self):
@@ -145,8 +215,9 @@ class Domain(object):
 
         # FUTURE: Use higher level (fds.py) condition to notify when waiting
         #   for multiple domains to exit
-        while self.__threads_toexit != 0:
-            self.__threads_condexit.wait(timeout=None)
+        with self.__threads_condexit:
+            while self.__threads_toexit != 0:
+                self.__threads_condexit.wait(timeout=None)
         return
 
     def pause(self, data: dict):
@@ -167,21 +238,118 @@ class Domain(object):
             room.resumeThreads()
         return
 
-    def _emitFallEvent(self, room_uid):
+    def progressAges(self) -> Dict[int, float]:
+        """
+        Get the time since each room of the domain last made progress.
+
+        :return: A dictionary of seconds by room uid.
+        :rtype: Dict[int, float]
+        """
+
+        now = self.__clock.monotonic()
+        return {room_config.uid: now - room.getProgress()
+                for (room_config, room) in zip(self.__config.room_configs,
+                                               self.__rooms)}
+
+    def stats(self, data: dict) -> dict:
+        """
+        Get the runtime metrics of the domain.
+
+        :return: A dictionary of samples per metric name, see
+            `MetricsRegistry.snapshot`.
+        :rtype: dict
+        """
+
+        return self.__metrics.snapshot()
+
+    def __diagnose(self, name: str, **kwargs) -> dict:
+        """
+        Run a diagnostic of the process by method name, reporting failures
+        to the commanding client rather than raising.
+        """
+
+        if self.__diagnostics is None:
+            return {"error": "Diagnostics are not available."}
+        try:
+            return getattr(self.__diagnostics, name)(**kwargs)
+        except (FDSDiagnosticsException, OSError) as err:
+            self.__logger.warning("Diagnostic `{0}` failed: {1}"
+                                  .format(name, err))
+            return {"error": str(err)}
+
+    def startProfile(self, data: dict) -> dict:
+        """
+        Start sampling the stacks of all threads of the process.
+
+        :param data: Optionally the `duration_sec` and `interval_sec` of the
+            profile.
+        :rtype: dict
+        """
+
+        kwargs = {k: float(data[k]) for k in ("duration_sec", "interval_sec")
+                  if k in data}
+        return self.__diagnose("startProfile", **kwargs)
+
+    def stopProfile(self, data: dict) -> dict:
+        """
+        End a running profile early.
+        """
+
+        return self.__diagnose("stopProfile")
+
+    def dumpStacks(self, data: dict) -> dict:
+        """
+        Write the stacks of all threads of the process.
+        """
+
+        return self.__diagnose("dumpStacks")
+
+    def startTracemalloc(self, data: dict) -> dict:
+        """
+        Start tracing allocations of the process.
+
+        :param data: Optionally the number of stack `frames` kept.
+        :rtype: dict
+        """
+
+        kwargs = {"frames": int(data["frames"])} if "frames" in data else {}
+        return self.__diagnose("startTracemalloc", **kwargs)
+
+    def snapshotTracemalloc(self, data: dict) -> dict:
+        """
+        Write traced allocations, or their changes since the last snapshot.
+        """
+
+        return self.__diagnose("snapshotTracemalloc")
+
+    def stopTracemalloc(self, data: dict) -> dict:
+        """
+        Stop tracing allocations.
+        """
+
+        return self.__diagnose("stopTracemalloc")
+
+    def _emitFallEvent(self, room_uid: int, person_id: int):
         """
         Emit a fall event from this instance.
+
+        :param room_uid: The room the fall occurred in.
+        :param person_id: The id of the track of the fallen person within the
+            room.
         """
 
-        fe = FallEventInfo(self.__config.uid, room_uid)
+        fe = FallEventInfo(self.__config.uid, room_uid, person_id)
         self.__socket.emitEvent(fe)
         return
 
-    # FUTURE: Remake this to push data over the socket, rather than plot
-    def _pushData(self, room_uid: int, geometry: np.ndarray, noise: np.ndarray,
-                  clusters: List[np.ndarray]):
+    # FUTURE: Remove plotting once clients plot from the data channel
+    def _pushData(self, room_uid: int, geometry: np.ndarray,
+                  clusters: PackedClusters):
         """
         Push clusters of samples to clients
         """
 
-        self.__plotter.drawPlot(geometry, noise, clusters)
+        self.__socket.emitData(self.__config.uid, room_uid, geometry,
+                               clusters)
+        self.__plotter.drawPlot(geometry, clusters)
         return
@@ -0,0 +1,42 @@
+from typing import Optional, Union
+
+import numpy as np
+
+
+# Floating point type of samples and of all data computed from them, from the
+#  sensor driver through filtering, clustering, keypoints and classification.
+#  Single precision halves the footprint and memory traffic of every buffer,
+#  and is ample for angles and distances in mm.
+DEFAULT_DTYPE: np.dtype = np.dtype(np.float32)
+
+SUPPORTED_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+
+class FDSDTypeException(Exception):
+    pass
+
+
+def resolveDType(dtype: Optional[Union[str, type, np.dtype]] = None
+                 ) -> np.dtype:
+    """
+    Get the data type of a dtype policy setting.
+
+    :param dtype: A name such as "float32", a type, or `None` for the default
+        policy.
+    :type dtype: Optional[Union[str, type, np.dtype]]
+    :return: The data type.
+    :rtype: np.dtype
+    :raises FDSDTypeException: If the data type is not a supported floating
+        point type.
+    """
+
+    if dtype is None:
+        return DEFAULT_DTYPE
+    try:
+        dtype = np.dtype(dtype)
+    except TypeError:
+        raise FDSDTypeException("Unknown data type `{0}`.".format(dtype))
+    if dtype not in SUPPORTED_DTYPES:
+        raise FDSDTypeException("Data type `{0}` is not supported."
+                                .format(dtype))
+    return dtype
@@ -1,13 +1,21 @@
-from typing import Optional
-from enum import IntEnum
+from typing import Callable, Dict, List, Optional
 
-import logging
 from logging import Logger
-import sys
+from multiprocessing.connection import Connection
+import multiprocessing
+import os
+import threading
+import time
 
 from .domain import Domain
 from .serialization import loadGlobalConfig, loadTrainingSets
-from .sensor import getSensors
+from .sensor import Sensor, getSensors
+from .dtypes import resolveDType
+from .metrics import MetricsRegistry, MetricsServer
+from .profiling import Diagnostics
+from .ipc import socketPath
+from .logs import LogLevel, LogHandler, getFDSLogger
+from .dataclasses import GlobalConfig, DomainConfig
 
 
 class FDSRootException(Exception):
@@ -31,19 +39,41 @@ class FDSRoot(object):
         """
 
         fds_config = loadGlobalConfig(config_path, logger)
-        training = loadTrainingSets(TEST_TRAINING_PATH_POSIX)
+        self.__config = fds_config
+        self.__logger = logger
+
+        # Supervised domains are built by their own worker processes
+        self.__supervisor = None
+        if fds_config.supervisor.enabled:
+            self.__supervisor = DomainSupervisor(
+                fds_config, TEST_TRAINING_PATH_POSIX, logger)
+            return
+
+        training = loadTrainingSets(TEST_TRAINING_PATH_POSIX, logger)
+
+        dtype = resolveDType(fds_config.dtype)
+        sensors = getSensors(fds_config.sensors, logger, dtype=dtype)
+
+        # Metrics of all domains are exported together
+        metrics = MetricsRegistry()
+        self.__metrics_server = None
+        if fds_config.metrics_port is not None:
+            self.__metrics_server = MetricsServer(
+                metrics, fds_config.metrics_host, fds_config.metrics_port,
+                logger)
 
-        sensors = getSensors(fds_config.sensors, logger)
+        # Diagnostics cover every thread of the process
+        diagnostics = Diagnostics(fds_config.diagnostics_dir, logger)
 
         domains = []
         for dom_config in fds_config.dom_configs:
-            domain = Domain(dom_config, self, training, sensors,
-                            fds_config.socket_dir, logger)
+            domain = Domain(dom_config, training, sensors,
+                            fds_config.socket_dir, logger, dtype=dtype,
+                            metrics=metrics, diagnostics=diagnostics)
             domains.append(domain)
 
         self.__domains = domains
-        self.__config = fds_config
-        self.__logger = logger
+        self.__metrics = metrics
         return
 
     def start(self):
@@ -53,6 +83,13 @@ class FDSRoot(object):
 
         self.__logger.info("Starting fall detection system.")
 
+        if self.__supervisor is not None:
+            self.__supervisor.run()
+            return
+
+        if self.__metrics_server is not None:
+            self.__metrics_server.start()
+
         domains = self.__domains
         for domain in domains:
             domain.start()
@@ -64,40 +101,477 @@ class FDSRoot(object):
         #   This loop is only here as a single domain instance is assumed.
         for domain in domains:
             domain.return_wait()
+
+        if self.__metrics_server is not None:
+            self.__metrics_server.stop()
+        return
+
+    def health(self) -> Optional[Dict[int, dict]]:
+        """
+        Get the health of every domain, if domains are supervised.
+
+        :rtype: Optional[Dict[int, dict]]
+        """
+
+        if self.__supervisor is None:
+            return None
+        return self.__supervisor.health()
+
+
+def sensorOwnership(fds_config: GlobalConfig) -> Dict[int, int]:
+    """
+    Map each sensor assigned to a room to the domain owning it. A sensor is
+    a device which can only be opened by a single process, so it may not be
+    assigned to the rooms of more than one domain.
+
+    :return: A dictionary of domain uids by sensor uid.
+    :rtype: Dict[int, int]
+    :raises FDSRootException: If a sensor is assigned to more than one
+        domain, or is not configured.
+    """
+
+    known = {si.uid for si in fds_config.sensors}
+    owners: Dict[int, int] = {}
+    for dom_config in fds_config.dom_configs:
+        for room_config in dom_config.room_configs:
+            for uid in room_config.sensors_assigned:
+                if uid not in known:
+                    raise FDSRootException(
+                        "Sensor {0} of room {1} of domain {2} is not "
+                        "configured.".format(uid, room_config.uid,
+                                             dom_config.uid))
+                owner = owners.setdefault(uid, dom_config.uid)
+                if owner != dom_config.uid:
+                    raise FDSRootException(
+                        "Sensor {0} is assigned to domains {1} and {2}."
+                        .format(uid, owner, dom_config.uid))
+    return owners
+
+
+def assignCPUs(n_domains: int, cpus: Optional[List[int]] = None
+               ) -> List[Optional[List[int]]]:
+    """
+    Split cores into contiguous shares, one per domain. If there are fewer
+    cores than domains, domains share single cores in turn.
+
+    :param n_domains: Number of domains.
+    :type n_domains: int
+    :param cpus: Cores to split, defaults to those available to the process.
+    :type cpus: Optional[List[int]]
+    :return: The cores of each domain, or `None` for each domain if the
+        platform does not support affinity.
+    :rtype: List[Optional[List[int]]]
+    """
+
+    if cpus is None:
+        if not hasattr(os, "sched_getaffinity"):
+            return [None] * n_domains
+        cpus = sorted(os.sched_getaffinity(0))
+    if n_domains > len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(0, n_domains)]
+    (share, extra) = divmod(len(cpus), n_domains)
+    shares = []
+    pos = 0
+    for i in range(0, n_domains):
+        n = share + (1 if i < extra else 0)
+        shares.append(cpus[pos:pos + n])
+        pos += n
+    return shares
+
+
+# Exit status of a worker whose rooms stopped making progress
+WORKER_STUCK_STATUS = 3
+
+
+def startHeartbeat(conn: Connection, interval_sec: float,
+                   health: Callable[[], dict]) -> threading.Thread:
+    """
+    Start sending heartbeats from a domain worker to its supervisor, each
+    carrying the health of the worker, until the supervisor goes away.
+    The health function may end the worker instead, as beats alone do not
+    prove it works.
+
+    :param conn: The worker end of the pipe to the supervisor.
+    :type conn: Connection
+    :param interval_sec: Time between heartbeats.
+    :type interval_sec: float
+    :param health: A function getting a picklable dictionary of the health
+        of the worker.
+    :type health: Callable[[], dict]
+    :rtype: threading.Thread
+    """
+
+    def beat():
+        while True:
+            try:
+                conn.send(health())
+            except (BrokenPipeError, EOFError, OSError):
+                break
+            time.sleep(interval_sec)
         return
 
+    thread = threading.Thread(target=beat, name="FDS Heartbeat",
+                              daemon=True)
+    thread.start()
+    return thread
 
-class LogLevel(IntEnum):
-    DEBUG = logging.DEBUG
-    INFO = logging.INFO
-    WARNING = logging.WARNING
-    ERROR = logging.ERROR
-    CRITICAL = logging.CRITICAL
 
+def runDomainWorker(fds_config: GlobalConfig, dom_config: DomainConfig,
+                    training_path: str, conn: Connection,
+                    heartbeat_sec: float, metrics_port: Optional[int],
+                    loglevel: int,
+                    get_sensors: Callable[..., Dict[int, Sensor]] = getSensors
+                    ) -> int:
+    """
+    Run a single domain in a worker process, opening only the sensors of its
+    rooms.
+
+    :param get_sensors: The function opening the sensors of the domain, with
+        the arguments of `getSensors`.
+    :type get_sensors: Callable[..., Dict[int, Sensor]]
+    :return: Exit status of the worker.
+    :rtype: int
+    """
 
-class LogHandler(logging.Handler):
+    logger = getFDSLogger(loglevel)
+    training = loadTrainingSets(training_path, logger)
+    dtype = resolveDType(fds_config.dtype)
+    owned = {uid for room_config in dom_config.room_configs
+             for uid in room_config.sensors_assigned}
+    sensors = get_sensors([si for si in fds_config.sensors
+                           if si.uid in owned], logger, dtype=dtype)
+
+    metrics = MetricsRegistry()
+    server = None
+    if metrics_port is not None:
+        server = MetricsServer(metrics, fds_config.metrics_host,
+                               metrics_port, logger)
+        server.start()
+    domain = Domain(dom_config, training, sensors, fds_config.socket_dir,
+                    logger, dtype=dtype, metrics=metrics,
+                    diagnostics=Diagnostics(fds_config.diagnostics_dir,
+                                            logger))
+    cpus = sorted(os.sched_getaffinity(0)) \
+        if hasattr(os, "sched_getaffinity") else None
+    progress_timeout_sec = fds_config.supervisor.progress_timeout_sec
+
+    def health() -> dict:
+        # The heartbeat thread beats on whatever the rooms do, so beats carry
+        #  the progress of the rooms, and a worker whose rooms are stuck
+        #  fails rather than beat on. Stuck threads never exit, so neither
+        #  does the worker but by force
+        ages = domain.progressAges()
+        stuck = sorted(uid for (uid, age) in ages.items()
+                       if age > progress_timeout_sec)
+        if len(stuck) != 0:
+            logger.error("Rooms {0} of domain {1} made no progress for {2} "
+                         "seconds, failing the worker"
+                         .format(stuck, dom_config.uid,
+                                 progress_timeout_sec))
+            for handler in logger.handlers:
+                handler.flush()
+            os._exit(WORKER_STUCK_STATUS)
+        return {"pid": os.getpid(), "cpus": cpus, "progress_age_sec": ages,
+                "metrics": metrics.snapshot()}
+
+    startHeartbeat(conn, heartbeat_sec, health)
+
+    domain.start()
+    domain.return_wait()
+    if server is not None:
+        server.stop()
+    return 0
+
+
+def _workerMain(target: Callable[..., int], cpus: Optional[List[int]],
+                *args):
     """
-    Class for custom filtering behavior on Logger objects.
+    Entry point of a domain worker process, pinning the process to its cores
+    before running the domain.
     """
 
-    def __init__(self, loglevel: LogLevel, logpath: Optional[str] = None):
-        super().__init__()
-        self.__loglevel = loglevel
-        self.__logpath = logpath
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    raise SystemExit(target(*args))
 
-    def emit(self, record: logging.LogRecord):
-        if (record.levelno <= logging.INFO):
-            sys.stdout.write(record.msg)
-        else:
-            sys.stderr.write(record.msg)
+
+class _DomainWorker(object):
+    """
+    Supervision state of the worker process of a domain.
+    """
+
+    __slots__ = ("dom_config", "cpus", "sensors", "metrics_port", "process",
+                 "conn", "started", "heartbeat", "health", "failures",
+                 "restarts", "restart_at", "finished", "last_failure")
+
+    def __init__(self, dom_config: DomainConfig, cpus: Optional[List[int]],
+                 sensors: List[int], metrics_port: Optional[int]):
+        self.dom_config = dom_config
+        self.cpus = cpus
+        self.sensors = sensors
+        self.metrics_port = metrics_port
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn: Optional[Connection] = None
+        self.started = 0.
+        self.heartbeat: Optional[float] = None
+        self.health: Optional[dict] = None
+        # Consecutive failures, reset once the worker runs stably
+        self.failures = 0
+        self.restarts = 0
+        self.restart_at: Optional[float] = None
+        self.finished = False
+        self.last_failure: Optional[str] = None
         return
 
 
-def getFDSLogger(loglevel: LogLevel) -> Logger:
-    logger = logging.getLogger("fds")
-    logger.setLevel(loglevel)
-    logger.addHandler(LogHandler(loglevel))
-    return logger
+class DomainSupervisor(object):
+    """
+    Supervisor running each domain in a worker process of its own, so that
+    one host serves many dwellings using all of its cores, and a domain which
+    crashes or hangs is restarted without disturbing the others.
+
+    Workers are pinned to their share of the cores, open only the sensors of
+    their own rooms and report their health in periodic heartbeats. A worker
+    which exits with an error, misses its heartbeats or whose rooms stop
+    pulling frames is restarted after a delay, doubled for each consecutive
+    failure.
+    """
+
+    def __init__(self, fds_config: GlobalConfig, training_path: str,
+                 logger: Logger,
+                 target: Callable[..., int] = runDomainWorker):
+        """
+        :param fds_config: Configuration of the fall detection system.
+        :type fds_config: GlobalConfig
+        :param training_path: Path of the training sets loaded by workers.
+        :type training_path: str
+        :param logger: The logger to use for logging.
+        :type logger: Logger
+        :param target: The function run by workers, with the arguments of
+            `runDomainWorker`.
+        :type target: Callable[..., int]
+        :raises FDSRootException: If sensors are not owned by single domains.
+        """
+
+        config = fds_config.supervisor
+        self.__fds_config = fds_config
+        self.__config = config
+        self.__training_path = training_path
+        self.__target = target
+        self.__logger = logger
+        self.__ownership = sensorOwnership(fds_config)
+        # Workers do not inherit the threads of the supervisor
+        self.__ctx = multiprocessing.get_context("spawn")
+
+        dom_configs = fds_config.dom_configs
+        shares = assignCPUs(len(dom_configs)) if config.cpu_affinity \
+            else [None] * len(dom_configs)
+        self.__workers: List[_DomainWorker] = []
+        for (i, dom_config) in enumerate(dom_configs):
+            sensors = sorted(uid for (uid, dom) in self.__ownership.items()
+                             if dom == dom_config.uid)
+            metrics_port = None if fds_config.metrics_port is None \
+                else fds_config.metrics_port + i
+            self.__workers.append(_DomainWorker(dom_config, shares[i],
+                                                sensors, metrics_port))
+
+        self.__stop_event = threading.Event()
+        self.__lock = threading.Lock()
+        return
+
+    @property
+    def ownership(self) -> Dict[int, int]:
+        """
+        Domain uids by the uids of the sensors they own.
+        """
+
+        return dict(self.__ownership)
+
+    def __spawn(self, worker: _DomainWorker, now: float):
+        (conn, child_conn) = self.__ctx.Pipe(duplex=False)
+        uid = worker.dom_config.uid
+        process = self.__ctx.Process(
+            target=_workerMain,
+            args=(self.__target, worker.cpus, self.__fds_config,
+                  worker.dom_config, self.__training_path, child_conn,
+                  self.__config.heartbeat_sec, worker.metrics_port,
+                  self.__logger.getEffectiveLevel()),
+            name="FDS Domain {0}".format(uid))
+        process.start()
+        # The supervisor only reads, the worker holds the only write end
+        child_conn.close()
+
+        worker.process = process
+        worker.conn = conn
+        worker.started = now
+        worker.heartbeat = None
+        worker.restart_at = None
+        self.__logger.info("Started domain {0} in process {1} on cores {2}"
+                           .format(uid, process.pid, worker.cpus))
+        return
+
+    def __reap(self, worker: _DomainWorker):
+        process = worker.process
+        if process.is_alive():
+            process.terminate()
+            process.join(self.__config.heartbeat_sec)
+            if process.is_alive():
+                process.kill()
+        process.join()
+        worker.conn.close()
+        worker.process = None
+        worker.conn = None
+        # Sockets of a killed worker are left behind, and would keep its
+        #  restart from binding them
+        for kind in ("rep", "pub"):
+            try:
+                os.remove(socketPath(self.__fds_config.socket_dir,
+                                     worker.dom_config.uid, kind))
+            except FileNotFoundError:
+                pass
+        return
+
+    def __fail(self, worker: _DomainWorker, now: float, reason: str):
+        """
+        Stop a failed worker and schedule its restart.
+        """
+
+        self.__reap(worker)
+        config = self.__config
+        if now - worker.started >= config.stable_after_sec:
+            worker.failures = 0
+        delay = min(config.restart_backoff_max_sec,
+                    config.restart_backoff_sec * 2 ** worker.failures)
+        worker.failures += 1
+        worker.restart_at = now + delay
+        worker.last_failure = reason
+        self.__logger.warning("Domain {0} {1}, restarting in {2:.1f} seconds"
+                              .format(worker.dom_config.uid, reason, delay))
+        return
+
+    def start(self):
+        """
+        Start the workers of all domains.
+        """
+
+        now = time.monotonic()
+        with self.__lock:
+            for worker in self.__workers:
+                self.__spawn(worker, now)
+        return
+
+    def poll(self, now: Optional[float] = None):
+        """
+        Collect heartbeats of workers, restart failed workers and start
+        workers whose restart is due.
+        """
+
+        now = time.monotonic() if now is None else now
+        config = self.__config
+        with self.__lock:
+            for worker in self.__workers:
+                if worker.finished:
+                    continue
+                if worker.process is None:
+                    if worker.restart_at is not None and \
+                            now >= worker.restart_at:
+                        worker.restarts += 1
+                        self.__spawn(worker, now)
+                    continue
+
+                try:
+                    while worker.conn.poll():
+                        worker.health = worker.conn.recv()
+                        worker.heartbeat = now
+                except (EOFError, OSError):
+                    pass
+
+                process = worker.process
+                if not process.is_alive():
+                    if process.exitcode == 0:
+                        self.__reap(worker)
+                        worker.finished = True
+                        self.__logger.info("Domain {0} exited"
+                                           .format(worker.dom_config.uid))
+                    elif process.exitcode == WORKER_STUCK_STATUS:
+                        self.__fail(worker, now, "made no progress")
+                    else:
+                        self.__fail(worker, now, "exited with code {0}"
+                                    .format(process.exitcode))
+                    continue
+                if worker.heartbeat is None:
+                    due = worker.started + config.startup_grace_sec
+                else:
+                    due = worker.heartbeat + config.heartbeat_timeout_sec
+                if now > due:
+                    self.__fail(worker, now, "missed its heartbeats")
+        return
+
+    def run(self):
+        """
+        Start and supervise the workers until stopped or all domains exit.
+        """
+
+        self.start()
+        interval = self.__config.heartbeat_sec / 2
+        while not self.__stop_event.wait(interval):
+            self.poll()
+            if all(worker.finished for worker in self.__workers):
+                break
+        self.shutdown()
+        return
+
+    def stop(self):
+        """
+        Stop supervising, such that `run` stops all workers and returns.
+        """
+
+        self.__stop_event.set()
+        return
+
+    def shutdown(self):
+        """
+        Stop all workers.
+        """
+
+        with self.__lock:
+            for worker in self.__workers:
+                if worker.process is not None:
+                    self.__reap(worker)
+        return
+
+    def health(self) -> Dict[int, dict]:
+        """
+        Get the health of every domain.
+
+        :return: A dictionary by domain uid of the pid, cores and sensors of
+            the worker, whether it is alive, the age of its last heartbeat,
+            its restart counters and the health reported by its last
+            heartbeat.
+        :rtype: Dict[int, dict]
+        """
+
+        now = time.monotonic()
+        health = {}
+        with self.__lock:
+            for worker in self.__workers:
+                process = worker.process
+                health[worker.dom_config.uid] = {
+                    "pid": None if process is None else process.pid,
+                    "alive": process is not None and process.is_alive(),
+                    "finished": worker.finished,
+                    "cpus": worker.cpus,
+                    "sensors": worker.sensors,
+                    "heartbeat_age_sec": None if worker.heartbeat is None
+                    else now - worker.heartbeat,
+                    "restarts": worker.restarts,
+                    "failures": worker.failures,
+                    "last_failure": worker.last_failure,
+                    "restart_in_sec": None if worker.restart_at is None
+                    else max(0., worker.restart_at - now),
+                    "reported": worker.health,
+                }
+        return health
 
 
 DEFAULT_CONFIG_PATH_POSIX = "/etc/rania-fds/fds.conf"
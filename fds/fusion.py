@@ -0,0 +1,136 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .arena import ScratchArena
+from .dtypes import DEFAULT_DTYPE
+from .dataclasses import SensorPose
+
+
+class ScanFusion(object):
+    """
+    Class for merging filtered scans from multiple sensors of a room into a
+    single polar frame centered on the room origin.
+
+    Sensor poses are precomputed on construction so that a frame is fused
+    with vectorized passes over the points of each sensor, written in place
+    to the output.
+    """
+
+    def __init__(self, poses: List[SensorPose], max_age_sec: float):
+        """
+        :param poses: Extrinsic poses of the sensors in the room, indexed in
+            the same order that scans are passed to `fuse`.
+        :type poses: List[SensorPose]
+        :param max_age_sec: Maximum age of a scan, relative to the newest scan
+            of the frame, for the scan to be fused into the frame.
+        :type max_age_sec: float
+        """
+
+        self.__ang_offsets = np.array([p.theta for p in poses], dtype=float)
+        self.__trans = np.array([(p.x, p.y) for p in poses],
+                                dtype=float).reshape(-1, 2)
+        self.__identity = [(p.x == 0. and p.y == 0. and p.theta == 0.)
+                           for p in poses]
+        self.__max_age_sec = max_age_sec
+        self.__scratch = ScratchArena()
+        return
+
+    def select(self, timestamps: List[Optional[float]]) -> List[int]:
+        """
+        Select the sensors to fuse into a frame.
+
+        :param timestamps: Timestamps of the latest scan of each sensor, or
+            `None` for sensors which have yet to produce a scan.
+        :type timestamps: List[Optional[float]]
+        :return: Indices of sensors with scans recent enough to fuse.
+        :rtype: List[int]
+        """
+
+        stamped = [t for t in timestamps if t is not None]
+        if len(stamped) == 0:
+            return []
+        oldest = max(stamped) - self.__max_age_sec
+        return [i for i in range(0, len(timestamps))
+                if timestamps[i] is not None and timestamps[i] >= oldest]
+
+    def fuse(self,
+             frames: List[Optional[Tuple[float, np.ndarray, np.ndarray]]],
+             out: Optional[Tuple[np.ndarray, np.ndarray]] = None
+             ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Fuse filtered scans of all sensors into the room frame.
+
+        :param frames: For each sensor, a tuple of the timestamp of the scan
+            and the unculled and culled samples of the scan, respectively, or
+            `None` if the sensor has no scan. Samples have shape (n, 2) of
+            form (degree, distance) in the frame of the sensor.
+        :type frames: List[Optional[Tuple[float, np.ndarray, np.ndarray]]]
+        :param out: A pair of arrays to write unculled and culled samples to,
+            instead of allocating them, each with at least as many rows as
+            samples of that set over all sensors.
+        :type out: Optional[Tuple[np.ndarray, np.ndarray]]
+        :return: A tuple of unculled and culled samples of shape (n, 2) of
+            form (degree, distance) in the room frame, ordered by increasing
+            degree.
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+
+        selected = self.select([None if f is None else f[0] for f in frames])
+        if len(selected) == 0:
+            if out is not None:
+                return (out[0][0:0], out[1][0:0])
+            return (np.empty((0, 2), dtype=DEFAULT_DTYPE),
+                    np.empty((0, 2), dtype=DEFAULT_DTYPE))
+
+        # A lone sensor at the room origin needs no transform
+        if len(selected) == 1 and self.__identity[selected[0]]:
+            frame = frames[selected[0]]
+            return (frame[1].reshape(-1, 2), frame[2].reshape(-1, 2))
+
+        fused = []
+        for k in range(1, 3):
+            parts = [frames[i][k].reshape(-1, 2) for i in selected]
+            n = sum(len(pts) for pts in parts)
+            dst = np.empty((n, 2), dtype=np.result_type(*parts)) \
+                if out is None else out[k - 1][0:n]
+
+            # Transform the points of each sensor into their own rows
+            pos = 0
+            for (i, pts) in zip(selected, parts):
+                self.__transform(pts, i, dst[pos:pos + len(pts)])
+                pos += len(pts)
+
+            # Order by increasing degree, in place
+            dst.view([("deg", dst.dtype), ("dist", dst.dtype)]).sort(
+                axis=0, order="deg")
+            fused.append(dst)
+        return (fused[0], fused[1])
+
+    def __transform(self, pts: np.ndarray, sensor: int, dst: np.ndarray):
+        """
+        Rotate and translate the points of a sensor into the room frame,
+        writing to `dst` without temporaries.
+        """
+
+        n = len(pts)
+        deg = dst[:, 0]
+        # Pose scalars are Python floats, so they do not promote
+        #  single precision samples
+        np.add(pts[:, 0], float(self.__ang_offsets[sensor]), out=deg)
+        np.radians(deg, out=deg)
+        np.sin(deg, out=dst[:, 1])
+        np.cos(deg, out=dst[:, 0])
+        # Columns are transformed one at a time, as broadcasting in place
+        #  over both columns makes a copy
+        for k in range(0, 2):
+            np.multiply(dst[:, k], pts[:, 1], out=dst[:, k])
+            np.add(dst[:, k], float(self.__trans[sensor, k]), out=dst[:, k])
+
+        dist = self.__scratch.take("dist", n, cols=None, dtype=dst.dtype)
+        np.hypot(dst[:, 0], dst[:, 1], out=dist)
+        np.arctan2(dst[:, 1], dst[:, 0], out=deg)
+        np.degrees(deg, out=deg)
+        np.mod(deg, 360., out=deg)
+        np.copyto(dst[:, 1], dist)
+        return
@@ -0,0 +1,203 @@
+import numpy as np
+
+from .util import convertPolarCartesian
+from .arena import ScratchArena
+from .clusters import PackedClusters
+from .dataclasses import GeometricGateConfig
+
+
+class OccupancyGate(object):
+    """
+    Class for a cheap occupancy test of filtered scans, used to skip
+    clustering of scans which cannot contain a cluster.
+
+    Unculled points are counted per angular bin, and the scan passes if some
+    contiguous run of occupied bins is long enough and holds enough points to
+    possibly form a cluster.
+    """
+
+    DEFAULT_BINS: int = 180
+    DEFAULT_MIN_RUN: int = 2
+    DEFAULT_MIN_POINTS: int = 6
+
+    def __init__(self, bins: int = DEFAULT_BINS,
+                 min_run: int = DEFAULT_MIN_RUN,
+                 min_points: int = DEFAULT_MIN_POINTS):
+        """
+        :param bins: Number of angular bins over [0-360) degrees.
+        :type bins: int
+        :param min_run: Minimum number of contiguous occupied bins.
+        :type min_run: int
+        :param min_points: Minimum number of points within a run, should not
+            exceed the minimum number of samples of a cluster.
+        :type min_points: int
+        """
+
+        self.__bins = bins
+        self.__min_run = min_run
+        self.__min_points = min_points
+        self.__scratch = ScratchArena()
+
+        self._hits = 0
+        self._misses = 0
+        return
+
+    def check(self, pts: np.ndarray) -> bool:
+        """
+        Test if the points could contain a cluster.
+
+        :param pts: An array of unculled points of shape (n_points, 2) with
+            the latter dimension of form (degree, distance).
+        :type pts: np.ndarray
+        :return: True if clustering should run, false otherwise.
+        :rtype: bool
+        """
+
+        passed = self.__check(pts)
+        if passed:
+            self._hits += 1
+        else:
+            self._misses += 1
+        return passed
+
+    def __check(self, pts: np.ndarray) -> bool:
+        if len(pts) < self.__min_points:
+            return False
+
+        bins = self.__bins
+        n = len(pts)
+        scaled = self.__scratch.take("scaled", n, cols=None, dtype=pts.dtype)
+        np.multiply(pts[:, 0], bins / 360., out=scaled)
+        idx = self.__scratch.take("idx", n, cols=None, dtype=np.intp)
+        np.copyto(idx, scaled, casting="unsafe")
+        np.mod(idx, bins, out=idx)
+        counts = np.bincount(idx, minlength=bins)
+        occupied = counts != 0
+        if occupied.all():
+            return True
+
+        # Rotate so that the bins start unoccupied, avoiding runs which wrap
+        #  around 0 degrees
+        shift = -int(np.argmin(occupied))
+        occupied = np.roll(occupied, shift)
+        counts = np.roll(counts, shift)
+
+        # Find the bounds of each run of occupied bins
+        edges = np.diff(occupied.astype(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+
+        cumsum = np.concatenate(([0], np.cumsum(counts)))
+        run_points = cumsum[ends] - cumsum[starts]
+        valid = ((ends - starts) >= self.__min_run) & \
+            (run_points >= self.__min_points)
+        return bool(valid.any())
+
+    def stats(self) -> dict:
+        """
+        Get counters of the gate.
+
+        :return: A dictionary of hits (clustering ran), misses (clustering
+            skipped) and the hit rate.
+        :rtype: dict
+        """
+
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": (self._hits / total) if total != 0 else 0.,
+        }
+
+
+class GeometricGate(object):
+    """
+    Class for rejecting clusters which cannot be a person before keypoint
+    extraction and classification.
+
+    Cheap features of all clusters are computed in a single vectorized pass:
+    point count, angular span, metric width and range.
+    """
+
+    REJECT_POINTS: str = "points"
+    REJECT_SPAN: str = "span"
+    REJECT_WIDTH: str = "width"
+    REJECT_RANGE: str = "range"
+
+    def __init__(self, config: GeometricGateConfig):
+        """
+        :param config: Rules of the gate.
+        :type config: GeometricGateConfig
+        """
+
+        self.__min_points = config.min_points
+        self.__max_span_deg = config.max_span_deg
+        self.__min_width = config.min_width
+        self.__max_width = config.max_width
+        self.__max_range = config.max_range
+
+        self._passed = 0
+        self._rejected = {self.REJECT_POINTS: 0, self.REJECT_SPAN: 0,
+                          self.REJECT_WIDTH: 0, self.REJECT_RANGE: 0}
+        return
+
+    def check(self, clusters: PackedClusters) -> np.ndarray:
+        """
+        Test which clusters are plausibly a person.
+
+        :param clusters: Clusters of points of form (degree, distance).
+        :type clusters: PackedClusters
+        :return: A boolean array of shape (n_clusters), true for clusters to
+            classify.
+        :rtype: np.ndarray
+        """
+
+        if len(clusters) == 0:
+            return np.empty(0, dtype=bool)
+
+        counts = clusters.counts
+        offsets = clusters.offsets[0:-1]
+        pts = clusters.points
+
+        # Angles relative to the first point of each cluster, so clusters
+        #  wrapping around 0 degrees have the correct span
+        first = np.repeat(pts[offsets, 0], counts)
+        rel = (pts[:, 0] - first + 180.) % 360. - 180.
+        span = np.maximum.reduceat(rel, offsets) - \
+            np.minimum.reduceat(rel, offsets)
+
+        cart = convertPolarCartesian(pts)
+        extent = np.maximum.reduceat(cart, offsets, axis=0) - \
+            np.minimum.reduceat(cart, offsets, axis=0)
+        width = np.hypot(extent[:, 0], extent[:, 1])
+
+        rng = np.add.reduceat(pts[:, 1], offsets) / counts
+
+        rules = (
+            (self.REJECT_POINTS, counts < self.__min_points),
+            (self.REJECT_SPAN, span > self.__max_span_deg),
+            (self.REJECT_WIDTH, (width < self.__min_width) |
+                (width > self.__max_width)),
+            (self.REJECT_RANGE, rng > self.__max_range),
+        )
+        passed = np.ones(len(clusters), dtype=bool)
+        for (name, rejected) in rules:
+            # Attribute each rejection to the first rule it fails
+            self._rejected[name] += int((passed & rejected).sum())
+            passed &= ~rejected
+
+        self._passed += int(passed.sum())
+        return passed
+
+    def stats(self) -> dict:
+        """
+        Get counters of the gate.
+
+        :return: A dictionary of passed clusters and rejected clusters by the
+            first rule they failed.
+        :rtype: dict
+        """
+
+        stats = {"passed": self._passed}
+        stats.update({"rejected_" + k: v for k, v in self._rejected.items()})
+        return stats
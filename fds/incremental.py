@@ -0,0 +1,217 @@
+from typing import Dict, List
+
+from collections import deque
+
+import numpy as np
+
+from .util import convertPolarCartesian
+from .clusters import PackedClusters
+
+
+class WindowClustering(object):
+    """
+    Class for incrementally clustering a sliding window of scans.
+
+    Points are binned into a cartesian grid of cells with the size of the
+    clustering radius. A cell is a core cell if it and its neighbours hold at
+    least the minimum number of samples, and clusters are the connected
+    components of core cells, together with occupied border cells adjacent to
+    them. Inserting the newest scan and expiring the oldest only touch the
+    cells of those scans, and only components containing changed cells are
+    relabeled, so the cost of a frame is proportional to the points that
+    changed rather than to the points of the whole window.
+    """
+
+    DEFAULT_CELL_SIZE: float = 150.
+
+    # Cell coordinates are packed into a single integer key
+    __KEY_SHIFT: int = 32
+    __KEY_OFFSET: int = 1 << 20
+    __NEIGHBOURS: List[int] = [(dx << 32) + dy
+                               for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+    def __init__(self, window: int, min_samples: int,
+                 cell_size: float = DEFAULT_CELL_SIZE):
+        """
+        :param window: Number of scans in the window.
+        :type window: int
+        :param min_samples: Minimum number of samples within the
+            neighbourhood of a core cell.
+        :type min_samples: int
+        :param cell_size: Size of a cell, in units of distance, acting as the
+            clustering radius.
+        :type cell_size: float
+        """
+
+        self.__window = window
+        self.__min_samples = min_samples
+        self.__cell_size = cell_size
+        self.reset()
+        return
+
+    def reset(self):
+        """
+        Remove all scans from the window.
+        """
+
+        # Per scan: polar points, cell key of each point, and the unique
+        #  cells with their counts
+        self.__scans: deque = deque()
+        self.__counts: Dict[int, int] = {}
+        # Cluster label of core and border cells
+        self.__labels: Dict[int, int] = {}
+        self.__members: Dict[int, set] = {}
+        self.__core: Dict[int, bool] = {}
+        self.__next_label = 0
+        return
+
+    def __keys(self, pts: np.ndarray) -> np.ndarray:
+        cart = convertPolarCartesian(pts)
+        cells = np.floor(cart / self.__cell_size).astype(np.int64)
+        return ((cells[:, 0] + self.__KEY_OFFSET) << self.__KEY_SHIFT) + \
+            (cells[:, 1] + self.__KEY_OFFSET)
+
+    def insert(self, pts: np.ndarray):
+        """
+        Insert the newest scan, expiring the oldest scan if the window is
+        full.
+
+        :param pts: Unculled points of shape (n, 2) of form
+            (degree, distance).
+        :type pts: np.ndarray
+        """
+
+        # Scans are kept across frames, so they must not be scratch views
+        pts = pts.reshape(-1, 2).copy()
+        keys = self.__keys(pts)
+        (cells, counts) = np.unique(keys, return_counts=True)
+        dirty = set()
+
+        if len(self.__scans) == self.__window:
+            (_, _, old_cells, old_counts) = self.__scans.popleft()
+            self.__addCounts(old_cells, -old_counts, dirty)
+        self.__scans.append((pts, keys, cells, counts))
+        self.__addCounts(cells, counts, dirty)
+
+        self.__relabel(dirty)
+        return
+
+    def __addCounts(self, cells: np.ndarray, counts: np.ndarray, dirty: set):
+        counts_map = self.__counts
+        for (cell, count) in zip(cells.tolist(), counts.tolist()):
+            total = counts_map.get(cell, 0) + count
+            if total == 0:
+                del counts_map[cell]
+            else:
+                counts_map[cell] = total
+            # Core status of neighbours depends on this cell
+            for n in self.__NEIGHBOURS:
+                dirty.add(cell + n)
+        return
+
+    def __isCore(self, cell: int) -> bool:
+        counts_map = self.__counts
+        if cell not in counts_map:
+            return False
+        total = 0
+        for n in self.__NEIGHBOURS:
+            total += counts_map.get(cell + n, 0)
+        return total >= self.__min_samples
+
+    def __setLabel(self, cell: int, label: int):
+        self.__labels[cell] = label
+        self.__members.setdefault(label, set()).add(cell)
+        return
+
+    def __relabel(self, dirty: set):
+        """
+        Relabel the components containing dirty cells.
+        """
+
+        labels = self.__labels
+        members = self.__members
+        core = self.__core
+        counts_map = self.__counts
+
+        # Update core status of dirty cells
+        for cell in dirty:
+            if self.__isCore(cell):
+                core[cell] = True
+            else:
+                core.pop(cell, None)
+
+        # Dissolve components touching dirty cells
+        dissolved = {labels[c] for c in dirty if c in labels}
+        seeds = list(dirty)
+        for label in dissolved:
+            cells = members.pop(label)
+            for cell in cells:
+                del labels[cell]
+            seeds.extend(cells)
+
+        # Flood fill new components from core seeds through core cells
+        for seed in seeds:
+            if seed in labels or seed not in core:
+                continue
+            label = self.__next_label
+            self.__next_label += 1
+            self.__setLabel(seed, label)
+            stack = [seed]
+            while len(stack) != 0:
+                cell = stack.pop()
+                for n in self.__NEIGHBOURS:
+                    ncell = cell + n
+                    if ncell in core:
+                        if ncell not in labels:
+                            self.__setLabel(ncell, label)
+                            stack.append(ncell)
+                    elif ncell in counts_map and ncell not in labels:
+                        # Occupied border cell
+                        self.__setLabel(ncell, label)
+
+        # Occupied seeds may border core cells of untouched components
+        for seed in seeds:
+            if seed in labels or seed not in counts_map:
+                continue
+            for n in self.__NEIGHBOURS:
+                label = labels.get(seed + n)
+                if label is not None and (seed + n) in core:
+                    self.__setLabel(seed, label)
+                    break
+        return
+
+    def snapshot(self) -> PackedClusters:
+        """
+        Get the clusters of the window, in the output format of
+        `LidarAlgContext.clusterLidarScanAdv`.
+
+        :return: The clusters with their centers in angular degrees, and
+            unclustered points of the window.
+        :rtype: PackedClusters
+        """
+
+        if len(self.__scans) == 0:
+            return PackedClusters.empty()
+
+        pts = np.concatenate([s[0] for s in self.__scans], axis=0)
+        keys = np.concatenate([s[1] for s in self.__scans], axis=0)
+
+        labels = self.__labels
+        if len(labels) == 0:
+            return PackedClusters.empty(pts)
+
+        # Map the cell of each point to its label, -1 for noise
+        label_cells = np.fromiter(labels.keys(), dtype=np.int64,
+                                  count=len(labels))
+        label_vals = np.fromiter(labels.values(), dtype=np.int64,
+                                 count=len(labels))
+        order = np.argsort(label_cells)
+        label_cells = label_cells[order]
+        label_vals = label_vals[order]
+        idx = np.minimum(np.searchsorted(label_cells, keys),
+                         len(label_cells) - 1)
+        pt_labels = np.where(label_cells[idx] == keys, label_vals[idx], -1)
+
+        clusters = PackedClusters.fromLabels(pts, pt_labels)
+        clusters.computeCenters()
+        return clusters
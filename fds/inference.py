@@ -0,0 +1,320 @@
+from typing import List, Optional
+
+from collections import deque
+import threading
+
+import numpy as np
+
+from .clock import Clock
+from .dataclasses import InferenceConfig
+from .metrics import MetricsRegistry
+
+
+# Upper bounds of the batch size buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class InferenceRequest(object):
+    """
+    A request for the label of a keypoint vector, reused for every request
+    of its client. A client has at most one request in flight.
+    """
+
+    PENDING = 0
+    TAKEN = 1
+    DONE = 2
+    CANCELLED = 3
+
+    __slots__ = ("keypoints", "generation", "label", "state", "enqueued",
+                 "done")
+
+    def __init__(self, done: threading.Event):
+        """
+        :param done: The event set once a request is answered, of the clock
+            of the service.
+        :type done: threading.Event
+        """
+
+        self.keypoints = np.empty(0)
+        self.generation = -1
+        self.label: Optional[int] = None
+        self.state = self.DONE
+        self.enqueued = 0.
+        self.done = done
+        return
+
+
+class InferenceService(object):
+    """
+    Classifies the keypoints of the rooms of an algorithm set in batches.
+
+    Rooms classifying clusters at once would otherwise each call the KNN
+    classifier with a single sample, and contend for the GIL with the fixed
+    cost of every call. Instead, requests are queued and the batching thread
+    gathers them for up to a short window, or until every client has a
+    request queued, then predicts their labels with a single vectorized
+    call and routes the labels back.
+
+    A request is rejected if the queue is full and cancelled if not taken
+    within the latency cap, and its client then predicts inline, so that a
+    slow or stopped service never delays classification by more than the
+    cap.
+    """
+
+    def __init__(self, alg_set, config: InferenceConfig,
+                 metrics: Optional[MetricsRegistry] = None,
+                 clock: Optional[Clock] = None):
+        """
+        :param alg_set: The algorithm set whose fitted classifier predicts
+            the labels.
+        :type alg_set: LidarAlgSet
+        :param config: The configuration of the batching.
+        :type config: InferenceConfig
+        :param metrics: The registry to register the metrics of the service
+            to, defaults to a registry of its own.
+        :type metrics: Optional[MetricsRegistry]
+        :param clock: The clock the rooms of the domain run in, which the
+            batching window and requests time out in, defaults to real time.
+        :type clock: Optional[Clock]
+        """
+
+        self.__alg_set = alg_set
+        self.__config = config
+        self.__clock = Clock() if clock is None else clock
+
+        # The batching thread waits on the clock, for the arrival of requests
+        #  or the end of the window, rather than on a condition of the lock
+        self.__queue = deque()
+        self.__lock = threading.Lock()
+        self.__arrived = self.__clock.event()
+        self.__clients = 0
+        self.__sentinel = False
+        self.__thread: Optional[threading.Thread] = None
+
+        # Batches are gathered into a buffer resized on refit only
+        self.__batch = np.empty((config.max_batch, 0), dtype=alg_set.dtype)
+
+        self._requests = 0
+        self._batches = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._stale = 0
+        self._errors = 0
+
+        self.__initMetrics(MetricsRegistry() if metrics is None else metrics)
+        return
+
+    def __initMetrics(self, metrics: MetricsRegistry):
+        """
+        Register the metrics of the service. Values counted by the service
+        are read when collected.
+        """
+
+        metrics.counter("fds_inference_requests_total",
+                        "Keypoint vectors queued for batched prediction."
+                        ).setFunction(lambda: self._requests)
+        metrics.counter("fds_inference_batches_total",
+                        "Batched predictions."
+                        ).setFunction(lambda: self._batches)
+        for (reason, func) in (("rejected", lambda: self._rejected),
+                               ("timeout", lambda: self._timeouts),
+                               ("stale", lambda: self._stale),
+                               ("error", lambda: self._errors)):
+            metrics.counter("fds_inference_fallbacks_total",
+                            "Requests predicted inline by their room.",
+                            reason=reason).setFunction(func)
+        metrics.gauge("fds_inference_queue_depth",
+                      "Requests waiting for a batch."
+                      ).setFunction(lambda: len(self.__queue))
+        self.__batch_hist = metrics.histogram(
+            "fds_inference_batch_size", "Requests predicted per batch.",
+            buckets=BATCH_SIZE_BUCKETS)
+        self.__wait_hist = metrics.histogram(
+            "fds_inference_wait_seconds",
+            "Time from queueing a request to its label being routed back.")
+        return
+
+    @property
+    def running(self) -> bool:
+        return self.__sentinel
+
+    def start(self):
+        with self.__lock:
+            if self.__sentinel:
+                return
+            self.__sentinel = True
+        self.__thread = self.__clock.thread(target=self.__thread_batch,
+                                            name="FDS Inference", daemon=True)
+        self.__thread.start()
+        return
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stop batching once the queued requests are answered. Requests made
+        afterwards are rejected.
+        """
+
+        with self.__lock:
+            self.__sentinel = False
+        self.__arrived.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            self.__thread = None
+        return
+
+    def register(self) -> InferenceRequest:
+        """
+        Register a client, such as the context of a room.
+
+        :return: The request to make every prediction of the client with.
+        :rtype: InferenceRequest
+        """
+
+        with self.__lock:
+            self.__clients += 1
+        return InferenceRequest(self.__clock.event())
+
+    def unregister(self, request: InferenceRequest):
+        with self.__lock:
+            self.__clients -= 1
+        return
+
+    def predict(self, request: InferenceRequest, keypoints: np.ndarray,
+                generation: int) -> Optional[int]:
+        """
+        Predict the label of a keypoint vector within the next batch.
+        Blocks for up to the latency cap, or until predicted.
+
+        :param request: The request of the client.
+        :type request: InferenceRequest
+        :param keypoints: The keypoints to classify, copied.
+        :type keypoints: np.ndarray
+        :param generation: The generation of the fitted classifier the
+            keypoints were computed for.
+        :type generation: int
+        :return: The predicted label, or `None` if the request was rejected,
+            timed out, failed or the classifier was refit since, and the
+            client should predict inline.
+        :rtype: Optional[int]
+        """
+
+        config = self.__config
+        with self.__lock:
+            if not self.__sentinel or len(self.__queue) >= config.max_queue:
+                self._rejected += 1
+                return None
+            if request.keypoints.shape != keypoints.shape:
+                request.keypoints = np.empty_like(keypoints)
+            np.copyto(request.keypoints, keypoints)
+            request.generation = generation
+            request.label = None
+            request.state = InferenceRequest.PENDING
+            request.enqueued = self.__clock.monotonic()
+            request.done.clear()
+            self.__queue.append(request)
+            self._requests += 1
+        self.__arrived.set()
+
+        if not request.done.wait(config.timeout_sec):
+            with self.__lock:
+                if request.state == InferenceRequest.PENDING:
+                    self.__queue.remove(request)
+                    request.state = InferenceRequest.CANCELLED
+                    self._timeouts += 1
+                    return None
+            # Taken into a batch being predicted, which is about to end
+            request.done.wait()
+        return request.label
+
+    def __take(self) -> List[InferenceRequest]:
+        """
+        Wait for a batch of requests, gathered for up to the batching window
+        once the first arrives. Returns no requests once stopped and drained.
+        """
+
+        config = self.__config
+        queue = self.__queue
+        clock = self.__clock
+        # Arrivals are cleared with the lock held before the queue is
+        #  checked, so a request queued after the check sets them again
+        while True:
+            with self.__lock:
+                if not self.__sentinel or len(queue) != 0:
+                    break
+                self.__arrived.clear()
+            self.__arrived.wait()
+        # Clients make a request at a time, so once each has one queued no
+        #  more can arrive
+        deadline = clock.monotonic() + config.window_sec
+        while True:
+            with self.__lock:
+                if not self.__sentinel or \
+                        len(queue) >= min(config.max_batch, self.__clients):
+                    break
+                self.__arrived.clear()
+            remaining = deadline - clock.monotonic()
+            if remaining <= 0:
+                break
+            self.__arrived.wait(remaining)
+        with self.__lock:
+            batch = [queue.popleft()
+                     for _ in range(0, min(len(queue), config.max_batch))]
+            for request in batch:
+                request.state = InferenceRequest.TAKEN
+        return batch
+
+    def __thread_batch(self):
+        """
+        Thread function.
+        Predict the labels of batches of requests until stopped.
+        """
+
+        while True:
+            batch = self.__take()
+            if len(batch) == 0:
+                break
+
+            # Requests computed for a previous classifier are answered with
+            #  no label, their clients recompute them
+            fitted = self.__alg_set.fitted
+            valid = [request for request in batch
+                     if request.generation == fitted.generation]
+            n = len(valid)
+            if n != 0:
+                if self.__batch.shape[1] != fitted.key_points_n:
+                    self.__batch = np.empty(
+                        (self.__config.max_batch, fitted.key_points_n),
+                        dtype=self.__alg_set.dtype)
+                samples = self.__batch[0:n]
+                for (i, request) in enumerate(valid):
+                    samples[i] = request.keypoints
+                # Clients must be answered whatever happens, a failed batch
+                #  is predicted inline by each of them
+                try:
+                    labels = fitted.knn_clsf.predict(samples)
+                    for (request, label) in zip(valid, labels):
+                        request.label = int(label)
+                except Exception:
+                    self._errors += n
+            self._stale += len(batch) - n
+            self._batches += 1
+            self.__batch_hist.observe(len(batch))
+
+            now = self.__clock.monotonic()
+            for request in batch:
+                self.__wait_hist.observe(now - request.enqueued)
+                request.state = InferenceRequest.DONE
+                request.done.set()
+        return 0
+
+    def stats(self) -> dict:
+        """
+        Get the request, batch and fallback counters of the service.
+
+        :rtype: dict
+        """
+
+        return {"requests": self._requests, "batches": self._batches,
+                "rejected": self._rejected, "timeouts": self._timeouts,
+                "stale": self._stale, "errors": self._errors,
+                "queue_depth": len(self.__queue)}
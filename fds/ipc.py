@@ -1,18 +1,25 @@
-from typing import Dict, Callable, Any
+from typing import Dict, Callable, Any, List, Tuple
 
-from threading import Thread
+from threading import Thread, Lock
 from os.path import exists
 import logging
 import json
 
+import numpy as np
 import zmq
 
+from .clusters import PackedClusters
+
 
 class EventInfo(dict):
     """
     Abstract class for events emitted by the fall detection system.
     """
 
+    # Events are plain dictionaries, without an attribute dictionary of their
+    #  own
+    __slots__ = ()
+
     def __init__(self, domain_id: int):
         super().__init__(self)
         self["dom_id"] = domain_id
@@ -21,16 +28,56 @@ class EventInfo(dict):
 
 class FallEventInfo(EventInfo):
 
-    def __init__(self, domain_id: int, room_id: int):
+    __slots__ = ()
+
+    def __init__(self, domain_id: int, room_id: int, person_id: int):
         super().__init__(domain_id)
         self["type"] = "fall_start"
         self["data"] = {}
         self["data"]["room_id"] = room_id
+        self["data"]["person_id"] = person_id
+        return
+
+
+class ClusterDataInfo(EventInfo):
+    """
+    Header of the clusters of a frame pushed over the data channel. The header
+    is followed by one message part per array, in the order of `arrays`, each
+    holding the raw bytes of the array.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, domain_id: int, room_id: int, geometry: np.ndarray,
+                 clusters: PackedClusters):
+        super().__init__(domain_id)
+        self["type"] = "cluster_data"
+        self["data"] = {}
+        self["data"]["room_id"] = room_id
+        self["data"]["arrays"] = [
+            {"name": name, "dtype": arr.dtype.str, "shape": arr.shape}
+            for (name, arr) in self.dataArrays(geometry, clusters)]
         return
 
+    @staticmethod
+    def dataArrays(geometry: np.ndarray, clusters: PackedClusters
+                   ) -> List[Tuple[str, np.ndarray]]:
+        """
+        Get the arrays of a frame to push, by name. Clusters are sent packed,
+        as their points and offsets.
+        """
+
+        arrays = [("geometry", geometry), ("noise", clusters.noise),
+                  ("points", clusters.points), ("offsets", clusters.offsets)]
+        if clusters.centers is not None:
+            arrays.append(("centers", clusters.centers))
+        return [(name, np.ascontiguousarray(arr)) for (name, arr) in arrays]
+
 
 class CommandInfo(dict):
 
+    __slots__ = ()
+
     def getCmdType(self) -> int:
         return self["type"]
 
@@ -42,20 +89,38 @@ class FDSSocketPathError(Exception):
     pass
 
 
+SOCKET_PREFIX = "fds"
+
+
+def socketPath(socket_dir: str, post_num: int, kind: str) -> str:
+    """
+    Get the path of a socket of a domain.
+
+    :param socket_dir: Directory of the sockets, with a trailing separator.
+    :type socket_dir: str
+    :param post_num: Identifier of the domain.
+    :type post_num: int
+    :param kind: "rep" for the command socket, "pub" for the event and data
+        socket.
+    :type kind: str
+    :rtype: str
+    """
+
+    return "{0}{1}{2}-{3}".format(socket_dir, SOCKET_PREFIX, post_num, kind)
+
+
 class Socket(object):
     """
     Class for managing connectiosn from the FDS to potentially multiple
     sources.
     """
 
-    __SOCKET_PREFIX = "fds"
-
     def __init__(self, socket_dir: str,
                  post_num: int,
                  callbacks: Dict[int, Callable[[dict], Any]],
                  logger: logging.Logger):
-        socket_path_rep = socket_dir + self.__SOCKET_PREFIX + post_num + "-rep"
-        socket_path_pub = socket_dir + self.__SOCKET_PREFIX + post_num + "-pub"
+        socket_path_rep = socketPath(socket_dir, post_num, "rep")
+        socket_path_pub = socketPath(socket_dir, post_num, "pub")
 
         if exists(socket_path_rep) or exists(socket_path_pub):
             raise FDSSocketPathError()
@@ -64,10 +129,13 @@ class Socket(object):
         self.__socket_paths = (socket_path_rep, socket_path_pub)
         self.__cmd_socket = zmq_ctxt.socket(zmq.REP)
         self.__pub_socket = zmq_ctxt.socket(zmq.PUB)
+        # Events and data are published from the threads of all rooms
+        self.__pub_lock = Lock()
         self.__zmq_ctxt = zmq_ctxt
 
         self.__listener_thread = Thread(target=self.__thread_cmdListener,
-                                        name="FDS Socket Command Listener")
+                                        name="FDS Socket Command Listener",
+                                        daemon=True)
 
         self._sockets_bound = False
         self.__callbacks_map = callbacks
@@ -83,7 +151,7 @@ class Socket(object):
 
     def _startListener(self):
         self.__cmd_socket.bind("ipc://" + self.__socket_paths[0])
-        self.__listener_thread.run()
+        self.__listener_thread.start()
         return
 
     def _startPublisher(self):
@@ -94,27 +162,61 @@ class Socket(object):
         cmd_socket = self.__cmd_socket
         while True:
             pkt = cmd_socket.recv()
+            # Every request must be replied to for the socket to receive
+            #  the next, including those which fail
             try:
                 ci = CommandInfo(json.loads(pkt))
             except json.JSONDecodeError:
                 self.__logger.warn("Could not decode command packet.")
+                cmd_socket.send_string(json.dumps(
+                    {"error": "Could not decode command packet."}))
                 continue
 
             ci_type = ci.getCmdType()
             if ci_type not in self.__callbacks_map:
-                self.__logger.warn(f"Command with id `{0}` not recognized."
+                self.__logger.warn("Command with id `{0}` not recognized."
                                    .format(ci_type))
+                cmd_socket.send_string(json.dumps(
+                    {"error": "Command with id `{0}` not recognized."
+                              .format(ci_type)}))
                 continue
             res = self.__callbacks_map[ci_type](ci.getCmdData())
 
             # Send result back to the commanding client
             # With ZMQ, this step is preferred in case there is a need to
             #   address the sending client (which sent the command).
-            # TODO: Send callback results instead of constant
-            cmd_socket.send(json.dumps(0))
+            # Commands without a result reply 0, as all commands once did
+            cmd_socket.send_string(json.dumps(0 if res is None else res))
         return
 
     def emitEvent(self, event: EventInfo):
         jdump = json.dumps(event)
-        self.__pub_socket.send(bytes(jdump, encoding="utf-8"))
+        with self.__pub_lock:
+            self.__pub_socket.send(bytes(jdump, encoding="utf-8"))
+        return
+
+    def emitData(self, domain_id: int, room_id: int, geometry: np.ndarray,
+                 clusters: PackedClusters):
+        """
+        Publish the clusters of a frame on the data channel, as a header
+        followed by the raw bytes of each packed array.
+
+        :param domain_id: The domain of the room.
+        :type domain_id: int
+        :param room_id: The room of the frame.
+        :type room_id: int
+        :param geometry: Culled samples of the frame.
+        :type geometry: np.ndarray
+        :param clusters: Clusters and noise of the frame.
+        :type clusters: PackedClusters
+        """
+
+        header = ClusterDataInfo(domain_id, room_id, geometry, clusters)
+        parts = [bytes(json.dumps(header), encoding="utf-8")]
+        # Arrays are copied into the messages as they are sent, as they may
+        #  be views of buffers reused by the next frame
+        parts.extend(memoryview(arr)
+                     for (_, arr) in header.dataArrays(geometry, clusters))
+        with self.__pub_lock:
+            self.__pub_socket.send_multipart(parts)
         return
@@ -0,0 +1,227 @@
+from typing import Dict, Optional, Tuple
+
+from enum import IntEnum
+from logging.handlers import QueueHandler, QueueListener, \
+    RotatingFileHandler
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+
+
+class LogLevel(IntEnum):
+    DEBUG = logging.DEBUG
+    INFO = logging.INFO
+    WARNING = logging.WARNING
+    ERROR = logging.ERROR
+    CRITICAL = logging.CRITICAL
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formatter appending the structured fields of a record, passed as
+    `extra={"fields": {...}}`, as `key=value` pairs after the message.
+    """
+
+    DEFAULT_FORMAT = "{asctime} {levelname} [{threadName}] {message}"
+
+    def __init__(self, fmt: str = DEFAULT_FORMAT):
+        super().__init__(fmt, style="{")
+        return
+
+    def format(self, record: logging.LogRecord) -> str:
+        # Messages of scripts are written with their own line endings
+        line = super().format(record).rstrip("\n")
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join("{0}={1}".format(k, v)
+                                   for (k, v) in fields.items())
+        return line
+
+
+class LogHandler(logging.Handler):
+    """
+    Class for custom filtering behavior on Logger objects.
+
+    Records are formatted with their arguments and written one per line, to
+    stdout up to INFO and stderr above, or to a rotated file if `logpath` is
+    given. Writes happen in the calling thread, use `getFDSLogger` to write
+    from a background thread instead.
+    """
+
+    DEFAULT_MAX_BYTES: int = 8 * 2 ** 20
+    DEFAULT_BACKUPS: int = 4
+
+    def __init__(self, loglevel: LogLevel, logpath: Optional[str] = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 backups: int = DEFAULT_BACKUPS):
+        """
+        :param loglevel: Minimum level of records to write.
+        :type loglevel: LogLevel
+        :param logpath: Path of a file to write to instead of stdout and
+            stderr, rotated once it reaches `max_bytes`.
+        :type logpath: Optional[str]
+        :param max_bytes: Size of the file to rotate at.
+        :type max_bytes: int
+        :param backups: Number of rotated files to keep.
+        :type backups: int
+        """
+
+        super().__init__(loglevel)
+        self.__loglevel = loglevel
+        self.__logpath = logpath
+        self.__file = None
+        if logpath is not None:
+            self.__file = RotatingFileHandler(logpath, maxBytes=max_bytes,
+                                              backupCount=backups)
+        self.setFormatter(StructuredFormatter())
+        return
+
+    def setFormatter(self, fmt: logging.Formatter):
+        super().setFormatter(fmt)
+        if self.__file is not None:
+            self.__file.setFormatter(fmt)
+        return
+
+    def emit(self, record: logging.LogRecord):
+        if self.__file is not None:
+            self.__file.emit(record)
+            return
+        try:
+            line = self.format(record) + "\n"
+            if (record.levelno <= logging.INFO):
+                sys.stdout.write(line)
+            else:
+                sys.stderr.write(line)
+        except Exception:
+            self.handleError(record)
+        return
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+        super().close()
+        return
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Filter limiting the rate of records of each call site, so that a message
+    logged per frame or per command cannot flood the log. Each call site has
+    a token bucket of `burst` records refilled at `rate` records per second.
+
+    The first record to pass after others of its call site were suppressed
+    carries their count in its `suppressed` field.
+    """
+
+    DEFAULT_RATE: float = 1.
+    DEFAULT_BURST: int = 10
+
+    def __init__(self, rate: float = DEFAULT_RATE,
+                 burst: int = DEFAULT_BURST):
+        super().__init__()
+        self.__rate = rate
+        self.__burst = burst
+        # Tokens, time of the last refill and suppressed count per site
+        self.__sites: Dict[Tuple[str, int], list] = {}
+        self.__lock = threading.Lock()
+        self._suppressed = 0
+        return
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self.__lock:
+            site = self.__sites.get(key)
+            if site is None:
+                site = [float(self.__burst), now, 0]
+                self.__sites[key] = site
+            site[0] = min(float(self.__burst),
+                          site[0] + (now - site[1]) * self.__rate)
+            site[1] = now
+            if site[0] < 1.:
+                site[2] += 1
+                self._suppressed += 1
+                return False
+            site[0] -= 1.
+            suppressed = site[2]
+            site[2] = 0
+        if suppressed != 0:
+            fields = dict(getattr(record, "fields", None) or {})
+            fields["suppressed"] = suppressed
+            record.fields = fields
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Queue handler which drops records if the queue is full, rather than
+    blocking or raising in the logging thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self._dropped = 0
+        return
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+        return
+
+
+DEFAULT_QUEUE_SIZE = 4096
+
+
+def getFDSLogger(loglevel: LogLevel, logpath: Optional[str] = None,
+                 name: str = "fds",
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 rate: Optional[float] = RateLimitFilter.DEFAULT_RATE,
+                 handler: Optional[logging.Handler] = None
+                 ) -> logging.Logger:
+    """
+    Get a logger which hands records to a background thread for writing, so
+    that logging never blocks a thread on I/O.
+
+    Records are rate limited per call site and formatted with their
+    arguments in the logging thread, then written by a `LogHandler` in the
+    background. Records are dropped if the queue is full. The writer is
+    flushed and stopped at exit.
+
+    :param loglevel: Minimum level of records to log.
+    :type loglevel: LogLevel
+    :param logpath: Path of a file to write to, rotated, instead of stdout
+        and stderr.
+    :type logpath: Optional[str]
+    :param name: Name of the logger.
+    :type name: str
+    :param queue_size: Maximum number of records waiting to be written.
+    :type queue_size: int
+    :param rate: Records per second allowed per call site, `None` to not
+        rate limit.
+    :type rate: Optional[float]
+    :param handler: The handler to write records with, instead of a
+        `LogHandler`.
+    :type handler: Optional[logging.Handler]
+    :rtype: logging.Logger
+    """
+
+    logger = logging.getLogger(name)
+    logger.setLevel(loglevel)
+
+    if handler is None:
+        handler = LogHandler(loglevel, logpath)
+    queue_handler = _NonBlockingQueueHandler(queue.Queue(queue_size))
+    if rate is not None:
+        queue_handler.addFilter(RateLimitFilter(rate))
+    listener = QueueListener(queue_handler.queue, handler,
+                             respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(queue_handler)
+    return logger
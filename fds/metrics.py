@@ -0,0 +1,443 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger
+import math
+import threading
+
+
+# Upper bounds of latency buckets, in seconds
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.)
+
+
+class FDSMetricsException(Exception):
+    pass
+
+
+class Counter(object):
+    """
+    A monotonically increasing value.
+
+    A counter is expected to be updated by a single thread, such as the
+    thread of its room, so updates are plain additions without locking. A
+    counter may instead read a value already counted elsewhere through a
+    function, called only when collected, which costs nothing on the hot
+    path.
+    """
+
+    __slots__ = ("_value", "_func")
+
+    def __init__(self):
+        self._value = 0.
+        self._func: Optional[Callable[[], float]] = None
+        return
+
+    def inc(self, amount: float = 1.):
+        self._value += amount
+        return
+
+    def setFunction(self, func: Callable[[], float]):
+        """
+        Read the value from `func` when collected, rather than counting it.
+        """
+
+        self._func = func
+        return
+
+    @property
+    def value(self) -> float:
+        if self._func is not None:
+            return float(self._func())
+        return self._value
+
+
+class Gauge(Counter):
+    """
+    A value which may go up and down.
+    """
+
+    __slots__ = ()
+
+    def set(self, value: float):
+        self._value = value
+        return
+
+
+class Histogram(object):
+    """
+    Counts of observed values within fixed buckets, with their sum.
+
+    As counters, a histogram is expected to be updated by a single thread.
+    """
+
+    __slots__ = ("__bounds", "_counts", "_sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        """
+        :param bounds: Increasing upper bounds of the buckets, a bucket for
+            values above the last bound is added.
+        :type bounds: Sequence[float]
+        """
+
+        self.__bounds = tuple(bounds)
+        self._counts = [0] * (len(self.__bounds) + 1)
+        self._sum = 0.
+        return
+
+    @property
+    def bounds(self) -> Tuple[float, ...]:
+        return self.__bounds
+
+    def observe(self, value: float):
+        self._counts[bisect_left(self.__bounds, value)] += 1
+        self._sum += value
+        return
+
+    def collect(self) -> Tuple[List[int], float, int]:
+        """
+        Get the cumulative count of each bucket, the sum and the count of
+        observed values.
+
+        :rtype: Tuple[List[int], float, int]
+        """
+
+        cumulative = []
+        count = 0
+        for n in list(self._counts):
+            count += n
+            cumulative.append(count)
+        return (cumulative, self._sum, count)
+
+
+class MetricFamily(object):
+    """
+    A named metric and its children, one per set of label values.
+    """
+
+    KINDS = ("counter", "gauge", "histogram")
+
+    def __init__(self, name: str, help: str, kind: str,
+                 labelnames: Tuple[str, ...],
+                 buckets: Optional[Sequence[float]] = None):
+        if kind not in self.KINDS:
+            raise FDSMetricsException("Unknown metric kind `{0}`."
+                                      .format(kind))
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = labelnames
+        self.buckets = None if buckets is None else tuple(buckets)
+        self.__children: Dict[Tuple[str, ...], object] = {}
+        self.__lock = threading.Lock()
+        return
+
+    def labels(self, **labels):
+        """
+        Get the child of a set of label values, creating it if needed.
+
+        Children should be taken once, such as on construction of their
+        owner, rather than per update.
+
+        :return: A `Counter`, `Gauge` or `Histogram` by kind of the family.
+        :raises FDSMetricsException: If the labels do not match the label
+            names of the family.
+        """
+
+        if set(labels) != set(self.labelnames):
+            raise FDSMetricsException(
+                "Labels {0} do not match {1} of metric `{2}`."
+                .format(sorted(labels), list(self.labelnames), self.name))
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.__lock:
+            child = self.__children.get(key)
+            if child is None:
+                if self.kind == "counter":
+                    child = Counter()
+                elif self.kind == "gauge":
+                    child = Gauge()
+                else:
+                    child = Histogram(self.buckets)
+                self.__children[key] = child
+        return child
+
+    def children(self) -> List[Tuple[Dict[str, str], object]]:
+        """
+        Get the children of the family with their labels.
+
+        :rtype: List[Tuple[Dict[str, str], object]]
+        """
+
+        with self.__lock:
+            items = list(self.__children.items())
+        return [(dict(zip(self.labelnames, key)), child)
+                for (key, child) in items]
+
+
+def _escapeLabel(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"") \
+        .replace("\n", "\\n")
+
+
+def _formatLabels(labels: Dict[str, str]) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join("{0}=\"{1}\"".format(k, _escapeLabel(v))
+                          for (k, v) in labels.items()) + "}"
+
+
+def _formatValue(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry(object):
+    """
+    Registry of the runtime metrics of the fall detection system.
+
+    A registry may be scoped with constant labels, such as the domain, which
+    every metric created through the scope carries. Scopes share the metrics
+    of their registry, and only collect metrics of their own labels.
+    """
+
+    def __init__(self, labels: Optional[Dict[str, str]] = None,
+                 _families: Optional[Dict[str, MetricFamily]] = None,
+                 _lock: Optional[threading.Lock] = None):
+        self.__labels = {} if labels is None else \
+            {k: str(v) for (k, v) in labels.items()}
+        self.__families = {} if _families is None else _families
+        self.__lock = threading.Lock() if _lock is None else _lock
+        return
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        return dict(self.__labels)
+
+    def scope(self, **labels) -> "MetricsRegistry":
+        """
+        Get a scope of the registry adding constant labels.
+
+        :rtype: MetricsRegistry
+        """
+
+        merged = self.labels
+        merged.update({k: str(v) for (k, v) in labels.items()})
+        return MetricsRegistry(merged, self.__families, self.__lock)
+
+    def __family(self, name: str, help: str, kind: str,
+                 labelnames: Sequence[str],
+                 buckets: Optional[Sequence[float]] = None) -> MetricFamily:
+        labelnames = tuple(self.__labels) + tuple(sorted(labelnames))
+        with self.__lock:
+            family = self.__families.get(name)
+            if family is None:
+                family = MetricFamily(name, help, kind, labelnames, buckets)
+                self.__families[name] = family
+            elif family.kind != kind or family.labelnames != labelnames:
+                raise FDSMetricsException(
+                    "Metric `{0}` already registered as a {1} of labels {2}."
+                    .format(name, family.kind, list(family.labelnames)))
+        return family
+
+    def __child(self, family: MetricFamily, labels: dict):
+        merged = self.labels
+        merged.update(labels)
+        return family.labels(**merged)
+
+    def counter(self, name: str, help: str, **labels) -> Counter:
+        """
+        Get the counter of a name and labels, registering it if needed.
+
+        :param name: Name of the metric, with the `_total` suffix.
+        :type name: str
+        :param help: Description of the metric.
+        :type help: str
+        :rtype: Counter
+        """
+
+        return self.__child(self.__family(name, help, "counter", labels),
+                            labels)
+
+    def gauge(self, name: str, help: str, **labels) -> Gauge:
+        """
+        Get the gauge of a name and labels, registering it if needed.
+
+        :rtype: Gauge
+        """
+
+        return self.__child(self.__family(name, help, "gauge", labels),
+                            labels)
+
+    def histogram(self, name: str, help: str,
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+                  **labels) -> Histogram:
+        """
+        Get the histogram of a name and labels, registering it if needed.
+
+        :param buckets: Increasing upper bounds of the buckets.
+        :type buckets: Sequence[float]
+        :rtype: Histogram
+        """
+
+        return self.__child(
+            self.__family(name, help, "histogram", labels, buckets), labels)
+
+    def __collect(self) -> List[Tuple[MetricFamily, list]]:
+        with self.__lock:
+            families = sorted(self.__families.values(), key=lambda f: f.name)
+        scope = self.__labels.items()
+        return [(family, [(labels, child)
+                          for (labels, child) in family.children()
+                          if scope <= labels.items()])
+                for family in families]
+
+    def exposition(self) -> str:
+        """
+        Get the metrics of the scope in the Prometheus text format.
+
+        :rtype: str
+        """
+
+        lines = []
+        for (family, children) in self.__collect():
+            if len(children) == 0:
+                continue
+            name = family.name
+            lines.append("# HELP {0} {1}".format(
+                name, family.help.replace("\\", "\\\\")
+                .replace("\n", "\\n")))
+            lines.append("# TYPE {0} {1}".format(name, family.kind))
+            for (labels, child) in children:
+                if family.kind != "histogram":
+                    lines.append("{0}{1} {2}".format(
+                        name, _formatLabels(labels),
+                        _formatValue(child.value)))
+                    continue
+                (cumulative, total, count) = child.collect()
+                for (bound, n) in zip(child.bounds + (math.inf,),
+                                      cumulative):
+                    bucket_labels = dict(labels)
+                    bucket_labels["le"] = _formatValue(bound)
+                    lines.append("{0}_bucket{1} {2}".format(
+                        name, _formatLabels(bucket_labels), n))
+                lines.append("{0}_sum{1} {2}".format(
+                    name, _formatLabels(labels), _formatValue(total)))
+                lines.append("{0}_count{1} {2}".format(
+                    name, _formatLabels(labels), count))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """
+        Get the metrics of the scope as a JSON serializable dictionary.
+
+        :return: A dictionary of a list of samples per metric name, each a
+            dictionary of its labels and its value, or its buckets, sum and
+            count for histograms.
+        :rtype: dict
+        """
+
+        snapshot = {}
+        for (family, children) in self.__collect():
+            samples = []
+            for (labels, child) in children:
+                if family.kind != "histogram":
+                    samples.append({"labels": labels, "value": child.value})
+                    continue
+                (cumulative, total, count) = child.collect()
+                samples.append({"labels": labels,
+                                "buckets": dict(zip(
+                                    [_formatValue(b) for b in
+                                     child.bounds + (math.inf,)],
+                                    cumulative)),
+                                "sum": total, "count": count})
+            if len(samples) != 0:
+                snapshot[family.name] = samples
+        return snapshot
+
+
+class MetricsServer(object):
+    """
+    Local HTTP server exporting a registry in the Prometheus text format at
+    `/metrics`.
+    """
+
+    CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, registry: MetricsRegistry, host: str, port: int,
+                 logger: Logger):
+        """
+        :param registry: The registry to export.
+        :type registry: MetricsRegistry
+        :param host: Address to listen on, should be local.
+        :type host: str
+        :param port: Port to listen on.
+        :type port: int
+        :param logger: The logger to use for logging.
+        :type logger: logging.Logger
+        """
+
+        self.__registry = registry
+        self.__address = (host, port)
+        self.__logger = logger
+        self.__server: Optional[ThreadingHTTPServer] = None
+        self.__thread: Optional[threading.Thread] = None
+        return
+
+    def __handlerClass(self) -> type:
+        registry = self.__registry
+        content_type = self.CONTENT_TYPE
+
+        class _Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            def log_message(self, format, *args):
+                # Scrapes are not logged
+                return
+
+        return _Handler
+
+    @property
+    def port(self) -> int:
+        """
+        Port the server listens on, useful if bound to port 0.
+        """
+
+        if self.__server is None:
+            return self.__address[1]
+        return self.__server.server_address[1]
+
+    def start(self):
+        self.__server = ThreadingHTTPServer(self.__address,
+                                            self.__handlerClass())
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         name="FDS Metrics Server",
+                                         daemon=True)
+        self.__thread.start()
+        self.__logger.info("Serving metrics on {0}:{1}"
+                           .format(self.__address[0], self.port))
+        return
+
+    def stop(self):
+        if self.__server is None:
+            return
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+        self.__server = None
+        return
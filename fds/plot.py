@@ -1,10 +1,10 @@
-from typing import List
-
 import threading
 
 import matplotlib.pyplot as plt
 import numpy as np
 
+from .clusters import PackedClusters
+
 
 # ---- Old plotting code
 def plot(x, y):
@@ -61,24 +61,43 @@ class LidarPlotter(object):
 
         self.__draw_event = threading.Event()
         self.__draw_get_lock = threading.Lock()
-        self.__ret = False
+        self.__plot_input = None
+        self.__doloop = True
 
-        self.__thread = threading.Thread(target=self.__thread_plotLoop,
+        self.__thread = threading.Thread(target=self.plotLoop,
                                          name="FDS Visual Plotting Loop")
         return
 
-    def __thread_plotLoop(self):
+    @staticmethod
+    def __setPoints(points, pts: np.ndarray, color: str):
+        """
+        Set the data of the plotted line to samples of form
+        (degree, distance).
+        """
+
+        points.set_data(np.radians(pts[:, 0]), pts[:, 1])
+        points.set_color(color)
+        return
+
+    def plotLoop(self):
+        """
+        Thread function.
+        Draw the frames given to `drawPlot` until stopped.
+        """
+
         # Alias plotting objects
         fig = self.__fig
-        ax = self.__ax
+        ax = self.__axes
 
         # Cache the background for blit
+        fig.canvas.draw()
         background = fig.canvas.copy_from_bbox(ax.bbox)
 
         self.__draw_event.wait()
+        if not self.__doloop:
+            return 0
 
         fig.show(False)
-        fig.draw()
 
         (points,) = ax.plot([], [], 'o', animated=True)
 
@@ -86,27 +105,24 @@ class LidarPlotter(object):
         while self.__doloop:
             # Get data when available
             with self.__draw_get_lock:
-                (geometry, noise, clusters) = self.__plot_input
+                (geometry, clusters) = self.__plot_input
 
             self.__draw_event.clear()
 
             # Plot data
-            points.set_data(geometry)
-            points.set_color(COLOR_PLOT_GEOM)
+            fig.canvas.restore_region(background)
+            self.__setPoints(points, geometry, COLOR_PLOT_GEOM)
             ax.draw_artist(points)
-            points.set_data(noise)
-            points.set_color(COLOR_PLOT_NOISE)
+            self.__setPoints(points, clusters.noise, COLOR_PLOT_NOISE)
             ax.draw_artist(points)
-            for cluster, i in zip(clusters,
-                                  range(0, len(COLOR_PLOT_CLUSTER_MAP))):
-                points.set_data(cluster)
-                points.set_color(
+            # Clusters are drawn from views of the packed points
+            for i in range(0, len(clusters)):
+                self.__setPoints(
+                    points, clusters[i],
                     COLOR_PLOT_CLUSTER_MAP[i % len(COLOR_PLOT_CLUSTER_MAP)])
                 ax.draw_artist(points)
 
             # (Re)draw the data
-            fig.canvas.restore_region(background)
-            ax.draw_artist(points)
             fig.canvas.blit(ax.bbox)
 
             fig.canvas.flush_events()
@@ -115,12 +131,12 @@ class LidarPlotter(object):
             self.__draw_event.wait()
 
         fig.set_visible(False)
-        return
+        return 0
 
     def start(self):
         self.__doloop = True
         self.__draw_event.clear()
-        self.__thread.run()
+        self.__thread.start()
         return
 
     def stop(self):
@@ -128,20 +144,17 @@ class LidarPlotter(object):
         self.__draw_event.set()
         return
 
-    def drawPlot(self, geometry: np.ndarray,
-                 noise: np.ndarray,
-                 clusters: List[np.ndarray]):
+    def drawPlot(self, geometry: np.ndarray, clusters: PackedClusters):
         """
         :param geometry: A filtered geometry sample set
         :type geometry: np.ndarray
-        :param noise: A noise sample set
-        :type noise: np.ndarray
-        :param clusters: A list of clusters belonging to dynamic objects
-        :type clusters: List[np.ndarray]
+        :param clusters: Clusters belonging to dynamic objects, and the noise
+            sample set
+        :type clusters: PackedClusters
         """
 
         with self.__draw_get_lock:
-            self.__plot_input = (geometry, noise, clusters)
+            self.__plot_input = (geometry, clusters)
 
         self.__draw_event.set()
         return
@@ -0,0 +1,242 @@
+from typing import Dict, Optional
+
+from logging import Logger
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+
+class FDSDiagnosticsException(Exception):
+    pass
+
+
+class Diagnostics(object):
+    """
+    On-demand diagnostics of the running process: sampling profiles of all
+    threads, dumps of their stacks and `tracemalloc` snapshot diffs, each
+    written to a file of the output directory.
+
+    Nothing is installed until a diagnostic is requested. The profiler
+    samples the stacks of all threads from a thread of its own, rather than
+    hooking every call with `sys.setprofile`, so threads being profiled are
+    not slowed, and no thread runs once a profile ends.
+    """
+
+    DEFAULT_INTERVAL_SEC: float = 0.01
+    DEFAULT_DURATION_SEC: float = 30.
+    MAX_DURATION_SEC: float = 600.
+    DEFAULT_TRACE_FRAMES: int = 16
+    # Lines of allocation statistics written per snapshot
+    SNAPSHOT_TOP: int = 50
+
+    def __init__(self, output_dir: str, logger: Logger):
+        """
+        :param output_dir: Directory to write results to, created as needed.
+        :type output_dir: str
+        :param logger: The logger to use for logging.
+        :type logger: logging.Logger
+        """
+
+        self.__output_dir = output_dir
+        self.__logger = logger
+
+        self.__lock = threading.Lock()
+        self.__profile_thread: Optional[threading.Thread] = None
+        self.__profile_stop = threading.Event()
+        self.__snapshot: Optional[tracemalloc.Snapshot] = None
+        return
+
+    @property
+    def output_dir(self) -> str:
+        return self.__output_dir
+
+    def __path(self, kind: str, ext: str) -> str:
+        os.makedirs(self.__output_dir, exist_ok=True)
+        now = time.time()
+        name = "{0}-{1}{2:03d}-{3}.{4}".format(
+            kind, time.strftime("%Y%m%dT%H%M%S.", time.localtime(now)),
+            int(now * 1000) % 1000, os.getpid(), ext)
+        return os.path.join(self.__output_dir, name)
+
+    def startProfile(self, duration_sec: float = DEFAULT_DURATION_SEC,
+                     interval_sec: float = DEFAULT_INTERVAL_SEC) -> dict:
+        """
+        Start sampling the stacks of all threads for a bounded duration. The
+        profile is written once it ends, as stacks in the folded format of
+        flame graph tools, prefixed by the name of their thread.
+
+        :param duration_sec: Time to sample for, bounded by
+            `MAX_DURATION_SEC`.
+        :type duration_sec: float
+        :param interval_sec: Time between samples.
+        :type interval_sec: float
+        :return: A dictionary of the path the profile will be written to and
+            the duration sampled for.
+        :rtype: dict
+        :raises FDSDiagnosticsException: If a profile is already running.
+        """
+
+        if not interval_sec > 0:
+            raise FDSDiagnosticsException("Interval must be positive.")
+        duration_sec = min(max(0., duration_sec), self.MAX_DURATION_SEC)
+        with self.__lock:
+            thread = self.__profile_thread
+            if thread is not None and thread.is_alive():
+                raise FDSDiagnosticsException("A profile is already running.")
+            path = self.__path("profile", "folded")
+            self.__profile_stop.clear()
+            thread = threading.Thread(
+                target=self.__thread_profile,
+                args=(path, time.monotonic() + duration_sec, interval_sec),
+                name="FDS Profiler", daemon=True)
+            self.__profile_thread = thread
+            thread.start()
+        self.__logger.info("Profiling for {0} seconds to {1}"
+                           .format(duration_sec, path))
+        return {"path": path, "duration_sec": duration_sec}
+
+    def stopProfile(self, timeout: Optional[float] = None) -> dict:
+        """
+        End a running profile early, writing it.
+
+        :return: A dictionary of whether a profile was running.
+        :rtype: dict
+        """
+
+        with self.__lock:
+            thread = self.__profile_thread
+            self.__profile_thread = None
+        running = thread is not None and thread.is_alive()
+        if running:
+            self.__profile_stop.set()
+            thread.join(timeout)
+        return {"stopped": running}
+
+    def __thread_profile(self, path: str, deadline: float,
+                         interval_sec: float):
+        """
+        Thread function.
+        Sample the stacks of all other threads until the deadline or stopped.
+        """
+
+        own = threading.get_ident()
+        counts: Dict[str, int] = {}
+        samples = 0
+        while time.monotonic() < deadline and \
+                not self.__profile_stop.wait(interval_sec):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for (ident, frame) in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{0} ({1}:{2})".format(
+                        code.co_name, os.path.basename(code.co_filename),
+                        frame.f_lineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            samples += 1
+
+        try:
+            with open(path, "w") as file:
+                for (stack, n) in sorted(counts.items()):
+                    file.write("{0} {1}\n".format(stack, n))
+        except OSError as err:
+            self.__logger.warning("Failed to write profile to {0}: {1}"
+                                  .format(path, err))
+            return 1
+        self.__logger.info("Wrote profile of {0} samples to {1}"
+                           .format(samples, path))
+        return 0
+
+    def dumpStacks(self) -> dict:
+        """
+        Write the current stack of every thread.
+
+        :return: A dictionary of the path written to and the number of
+            threads.
+        :rtype: dict
+        """
+
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        path = self.__path("stacks", "txt")
+        with open(path, "w") as file:
+            for (ident, frame) in frames.items():
+                file.write("Thread {0} ({1}):\n".format(
+                    names.get(ident, "unknown"), ident))
+                file.write("".join(traceback.format_stack(frame)))
+                file.write("\n")
+        return {"path": path, "threads": len(frames)}
+
+    def startTracemalloc(self, frames: int = DEFAULT_TRACE_FRAMES) -> dict:
+        """
+        Start tracing allocations, which slows every allocation until
+        stopped.
+
+        :param frames: Number of frames of the stack kept per allocation.
+        :type frames: int
+        :rtype: dict
+        """
+
+        with self.__lock:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(frames)
+                self.__snapshot = None
+        return {"started": started}
+
+    def snapshotTracemalloc(self) -> dict:
+        """
+        Take a snapshot of traced allocations, writing the largest
+        allocation sites, or the largest changes since the previous snapshot.
+
+        :return: A dictionary of the path written to and the traced size.
+        :rtype: dict
+        :raises FDSDiagnosticsException: If allocations are not traced.
+        """
+
+        with self.__lock:
+            if not tracemalloc.is_tracing():
+                raise FDSDiagnosticsException("Allocations are not traced.")
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            previous = self.__snapshot
+            self.__snapshot = snapshot
+        (current, peak) = tracemalloc.get_traced_memory()
+
+        if previous is None:
+            stats = snapshot.statistics("lineno")
+        else:
+            stats = snapshot.compare_to(previous, "lineno")
+        path = self.__path("tracemalloc", "txt")
+        with open(path, "w") as file:
+            file.write("Traced {0} bytes, peak {1} bytes, {2}\n".format(
+                current, peak,
+                "top sites" if previous is None
+                else "top changes since previous snapshot"))
+            for stat in stats[0:self.SNAPSHOT_TOP]:
+                file.write("{0}\n".format(stat))
+        return {"path": path, "traced_bytes": current, "peak_bytes": peak,
+                "diff": previous is not None}
+
+    def stopTracemalloc(self) -> dict:
+        """
+        Stop tracing allocations, discarding the last snapshot.
+
+        :rtype: dict
+        """
+
+        with self.__lock:
+            stopped = tracemalloc.is_tracing()
+            tracemalloc.stop()
+            self.__snapshot = None
+        return {"stopped": stopped}
@@ -0,0 +1,139 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .dtypes import resolveDType
+
+
+class RangeImage(object):
+    """
+    Class describing a fixed angular grid for the "range image"
+    representation of a scan.
+
+    A range image is an array of shape (bins, 2) holding the distance and
+    quality of the nearest sample of each angular bin, with NaN for bins
+    without samples. Unlike variable length sample arrays, range images of
+    the same grid are elementwise comparable, and neighbouring samples are
+    neighbouring bins, so clusters are contiguous runs of bins.
+    """
+
+    DEFAULT_BINS: int = 720
+
+    DIST: int = 0
+    QUALITY: int = 1
+
+    def __init__(self, bins: int = DEFAULT_BINS,
+                 dtype: Optional[np.dtype] = None):
+        """
+        :param bins: Number of angular bins over [0-360) degrees.
+        :type bins: int
+        :param dtype: Data type of images, defaults to the dtype policy.
+        :type dtype: Optional[np.dtype]
+        """
+
+        self.__bins = bins
+        self.__res = 360. / bins
+        self.__dtype = resolveDType(dtype)
+        # Angles of bin centers, the angles of the points of clusters
+        self.__centers = ((np.arange(0, bins) + 0.5) *
+                          self.__res).astype(self.__dtype)
+        return
+
+    @property
+    def bins(self) -> int:
+        return self.__bins
+
+    @property
+    def centers(self) -> np.ndarray:
+        return self.__centers
+
+    def empty(self, window: Optional[int] = None) -> np.ndarray:
+        """
+        Get an image, or window of images, with all bins empty.
+
+        :param window: Number of images in the window, `None` for a single
+            image.
+        :type window: Optional[int]
+        :rtype: np.ndarray
+        """
+
+        shape = (self.__bins, 2) if window is None \
+            else (window, self.__bins, 2)
+        return np.full(shape, np.nan, dtype=self.__dtype)
+
+    def binOf(self, deg: np.ndarray) -> np.ndarray:
+        """
+        Get the bin index of each angle, in degrees.
+        """
+
+        return (deg * (1. / self.__res)).astype(int) % self.__bins
+
+    def fromSamples(self, samples: np.ndarray,
+                    quality: Optional[np.ndarray] = None,
+                    out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Convert a scan into a range image.
+
+        :param samples: Samples of shape (n, 2) of form (degree, distance).
+        :type samples: np.ndarray
+        :param quality: Quality of each sample, if available.
+        :type quality: Optional[np.ndarray]
+        :param out: An image to write to, instead of allocating one.
+        :type out: Optional[np.ndarray]
+        :return: The range image of shape (bins, 2).
+        :rtype: np.ndarray
+        """
+
+        image = self.empty() if out is None else out
+        image.fill(np.nan)
+
+        samples = samples.reshape(-1, 2)
+        idx = self.binOf(samples[:, 0])
+        # Keep the nearest sample of each bin
+        order = np.lexsort((samples[:, 1], idx))
+        (bins, first) = np.unique(idx[order], return_index=True)
+        chosen = order[first]
+
+        image[bins, self.DIST] = samples[chosen, 1]
+        if quality is not None:
+            image[bins, self.QUALITY] = quality[chosen]
+        return image
+
+    def runs(self, image: np.ndarray, max_jump: float, min_len: int = 1
+             ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Segment a range image into runs of contiguous occupied bins, breaking
+        runs where the distance between neighbouring bins jumps. The last and
+        first bins are neighbours, so a run across 0 degrees is a single run.
+
+        :param image: A range image of shape (bins, 2).
+        :type image: np.ndarray
+        :param max_jump: Maximum distance difference between neighbouring
+            bins of a single run.
+        :type max_jump: float
+        :param min_len: Minimum number of bins of a run.
+        :type min_len: int
+        :return: A tuple of start (inclusive) and end (exclusive) bin indices
+            of each run. A run across 0 degrees is the last, and ends past
+            `bins`, its bins being indices modulo `bins`.
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+
+        dist = image[:, self.DIST]
+        occupied = ~np.isnan(dist)
+        # A bin starts a run if occupied and the previous bin is empty or too
+        #  far away
+        jump = np.abs(np.diff(dist)) > max_jump
+        cont = np.concatenate(([False], occupied[1:] & occupied[:-1] & ~jump))
+        starts = np.flatnonzero(occupied & ~cont)
+        ends = np.flatnonzero(
+            occupied & ~np.concatenate((cont[1:], [False]))) + 1
+        # Join the runs touching either edge of the image, before their
+        #  halves are dropped as too short
+        bins = self.__bins
+        if len(starts) > 1 and starts[0] == 0 and ends[-1] == bins and \
+                abs(dist[-1] - dist[0]) <= max_jump:
+            ends = np.concatenate((ends[1:-1], [ends[0] + bins]))
+            starts = starts[1:]
+        valid = (ends - starts) >= min_len
+        return (starts[valid], ends[valid])
@@ -0,0 +1,433 @@
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from collections import deque
+from logging import Logger
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from .dtypes import resolveDType
+from .dataclasses import RecorderConfig
+
+
+class _Recording(object):
+    """
+    A pending recording of the frames around a fall event.
+    """
+
+    __slots__ = ("start", "event", "end", "track_id", "wall_time")
+
+    def __init__(self, event: float, window_sec: float, post_sec: float,
+                 track_id: int):
+        self.start = event - window_sec
+        self.event = event
+        self.end = event + post_sec
+        self.track_id = track_id
+        self.wall_time = time.time()
+        return
+
+
+class BlackBoxRecorder(object):
+    """
+    Always-on recorder of the recent frames of a room, persisting the frames
+    which led to and followed each fall event so that false positives and
+    misses can be audited.
+
+    Frames are copied into a ring of preallocated slots by the classification
+    thread without locking or allocating. Each slot carries a sequence number
+    which is invalidated while the slot is written, so the writer thread,
+    which copies recordings out of the ring into memory-mapped files, detects
+    and discards frames overwritten while they were copied.
+
+    Recordings of a room are kept in a directory of their own, bounded in
+    number and size by deleting the oldest first.
+    """
+
+    FILE_PREFIX: str = "fall"
+    # Time the ring holds frames beyond the window of a recording, for the
+    #  writer to copy them out before they are overwritten
+    FLUSH_MARGIN_SEC: float = 2.
+    # Recordings waiting for their frames, further events are dropped
+    MAX_PENDING: int = 4
+
+    def __init__(self, config: RecorderConfig, room_uid: int,
+                 scan_points: List[int], logger: Logger,
+                 dtype: Optional[np.dtype] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param config: The configuration of the recorder.
+        :type config: RecorderConfig
+        :param room_uid: Unique identifier of the room recorded.
+        :type room_uid: int
+        :param scan_points: Maximum number of samples of a scan of each
+            sensor of the room.
+        :type scan_points: List[int]
+        :param logger: The logger to use for logging.
+        :type logger: logging.Logger
+        :param dtype: Data type of the recorded samples, defaults to the
+            dtype policy.
+        :type dtype: Optional[np.dtype]
+        :param clock: Monotonic time source frames are recorded in, in
+            seconds.
+        :type clock: Callable[[], float]
+        """
+
+        self.__config = config
+        self.__clock = clock
+        self.__room_uid = room_uid
+        self.__logger = logger
+        self.__dir = os.path.join(config.output_dir,
+                                  "room{0}".format(room_uid))
+
+        dtype = resolveDType(dtype)
+        n_sensors = max(1, len(scan_points))
+        max_points = max([1] + scan_points)
+        total_points = max(1, sum(scan_points))
+        self.__frame_dtype = np.dtype([
+            ("ts", np.float64),
+            ("state", np.int8),
+            ("raw_n", np.int32, (n_sensors,)),
+            ("raw", dtype, (n_sensors, max_points, 2)),
+            ("unculled_n", np.int32),
+            ("unculled", dtype, (total_points, 2)),
+            ("culled_n", np.int32),
+            ("culled", dtype, (total_points, 2)),
+        ])
+
+        n_slots = math.ceil((config.window_sec + config.post_sec +
+                             self.FLUSH_MARGIN_SEC) * config.max_frame_rate)
+        ring = np.zeros(max(2, n_slots), dtype=self.__frame_dtype)
+        self.__ring = ring
+        # Views of each field, taken once rather than per frame
+        self.__fields = tuple(ring[name] for name in (
+            "ts", "state", "raw_n", "raw", "unculled_n", "unculled",
+            "culled_n", "culled"))
+        # Sequence number of the frame held by each slot, -1 while written
+        #  or never written
+        self.__seq = np.full(len(self.__ring), -1, dtype=np.int64)
+        self.__head = 0
+        self.__next_seq = 0
+
+        self.__pending: deque = deque()
+        self.__cond = threading.Condition()
+        self.__sentinel = False
+        self.__thread = threading.Thread(
+            target=self.__thread_write,
+            name="FDS Recorder {0}".format(room_uid), daemon=True)
+
+        self._triggers = 0
+        self._coalesced = 0
+        self._dropped = 0
+        self._recordings = 0
+        self._torn = 0
+        self._skipped = 0
+        self._deleted = 0
+        self._errors = 0
+        return
+
+    @property
+    def directory(self) -> str:
+        return self.__dir
+
+    @property
+    def frameBytes(self) -> int:
+        return self.__frame_dtype.itemsize
+
+    def start(self):
+        self.__sentinel = True
+        self.__thread.start()
+        return
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop the writer, writing pending recordings with the frames recorded
+        so far.
+
+        :param timeout: Time to wait for the writer to exit, in seconds.
+        :type timeout: Optional[float]
+        :return: True if the writer exited promptly, false otherwise.
+        :rtype: bool
+        """
+
+        with self.__cond:
+            self.__sentinel = False
+            self.__cond.notify()
+        self.__thread.join(timeout)
+        return not self.__thread.is_alive()
+
+    def record(self, timestamp: float, scans: List[Optional[np.ndarray]],
+               unculled: np.ndarray, culled: np.ndarray, state: int = 0):
+        """
+        Copy a frame into the ring, overwriting the oldest frame.
+
+        :param timestamp: Time of the frame, in seconds of the clock.
+        :type timestamp: float
+        :param scans: The raw scan of each sensor, or `None` for sensors
+            without a scan in the frame.
+        :type scans: List[Optional[np.ndarray]]
+        :param unculled: Unculled samples of the frame in the room frame.
+        :type unculled: np.ndarray
+        :param culled: Culled samples of the frame in the room frame.
+        :type culled: np.ndarray
+        :param state: Activity state of the room.
+        :type state: int
+        """
+
+        (ts, states, raw_n, raw, unculled_n, unculled_pts, culled_n,
+         culled_pts) = self.__fields
+        slot = self.__head
+        self.__seq[slot] = -1
+
+        ts[slot] = timestamp
+        states[slot] = state
+        (raw, raw_n) = (raw[slot], raw_n[slot])
+        for i in range(0, len(raw)):
+            scan = scans[i] if i < len(scans) else None
+            n = 0 if scan is None else min(len(scan), raw.shape[1])
+            if n != 0:
+                np.copyto(raw[i, 0:n], scan[0:n], casting="same_kind")
+            raw_n[i] = n
+        for (pts, dst, dst_n) in ((unculled, unculled_pts, unculled_n),
+                                  (culled, culled_pts, culled_n)):
+            n = min(len(pts), dst.shape[1])
+            np.copyto(dst[slot, 0:n], pts[0:n], casting="same_kind")
+            dst_n[slot] = n
+
+        self.__seq[slot] = self.__next_seq
+        self.__next_seq += 1
+        self.__head = (slot + 1) % len(ts)
+        return
+
+    def trigger(self, timestamp: float, track_id: int):
+        """
+        Record the frames around a fall event, once the frames following it
+        have been recorded. Never blocks on writing the recording.
+
+        Events within the window following a pending event are part of its
+        recording, and are coalesced.
+
+        :param timestamp: Time of the event, in seconds of the clock.
+        :type timestamp: float
+        :param track_id: Identifier of the track which fell.
+        :type track_id: int
+        """
+
+        config = self.__config
+        with self.__cond:
+            self._triggers += 1
+            pending = self.__pending
+            if len(pending) != 0 and timestamp <= pending[-1].end:
+                self._coalesced += 1
+                return
+            if len(pending) >= self.MAX_PENDING:
+                self._dropped += 1
+                return
+            pending.append(_Recording(timestamp, config.window_sec,
+                                      config.post_sec, track_id))
+            self.__cond.notify()
+        return
+
+    def stats(self) -> dict:
+        """
+        Get counters of the recorder.
+
+        :return: A dictionary of recorded frames, triggered, coalesced and
+            dropped events, written and deleted recordings, frames torn by
+            being overwritten while copied, recordings skipped for exceeding
+            the disk bound and write errors, and the size of the ring.
+        :rtype: dict
+        """
+
+        with self.__cond:
+            pending = len(self.__pending)
+        return {
+            "frames": self.__next_seq,
+            "ring_frames": len(self.__ring),
+            "ring_bytes": self.__ring.nbytes,
+            "triggers": self._triggers,
+            "coalesced": self._coalesced,
+            "dropped": self._dropped,
+            "pending": pending,
+            "recordings": self._recordings,
+            "deleted": self._deleted,
+            "torn": self._torn,
+            "skipped": self._skipped,
+            "errors": self._errors,
+        }
+
+    def __cond_writeDue(self) -> bool:
+        if not self.__sentinel:
+            return True
+        if len(self.__pending) == 0:
+            return False
+        # Wait a frame beyond the end, for the last frame to be written
+        return self.__clock() >= \
+            self.__pending[0].end + 1. / self.__config.max_frame_rate
+
+    def __thread_write(self):
+        """
+        Thread function.
+        Write recordings once their frames have been recorded, until stopped.
+        """
+
+        while True:
+            with self.__cond:
+                while not self.__cond_writeDue():
+                    timeout = None
+                    if len(self.__pending) != 0:
+                        timeout = max(0., self.__pending[0].end -
+                                      self.__clock()) + \
+                            1. / self.__config.max_frame_rate
+                    self.__cond.wait(timeout)
+                if len(self.__pending) == 0:
+                    break
+                recording = self.__pending.popleft()
+
+            try:
+                self.__write(recording)
+            except OSError as err:
+                self._errors += 1
+                self.__logger.warning("Room {0} failed to write recording: "
+                                      "{1}".format(self.__room_uid, err))
+        return 0
+
+    def __write(self, recording: _Recording):
+        """
+        Copy the frames of a recording out of the ring into a memory-mapped
+        file, with a header of the event beside it.
+        """
+
+        ring = self.__ring
+        seq = self.__seq.copy()
+        ts = ring["ts"].copy()
+        slots = np.flatnonzero((seq >= 0) & (ts >= recording.start) &
+                               (ts <= recording.end))
+        # Oldest frames first, as they are the next to be overwritten
+        slots = slots[np.argsort(seq[slots])]
+
+        size = len(slots) * self.__frame_dtype.itemsize
+        if size > self.__config.max_disk_mb * 2 ** 20:
+            self._skipped += 1
+            self.__logger.warning("Room {0} recording of {1} bytes exceeds "
+                                  "the disk bound".format(self.__room_uid,
+                                                          size))
+            return
+        os.makedirs(self.__dir, exist_ok=True)
+        self.__bound(size)
+
+        wall_time = recording.wall_time
+        name = "{0}-{1}{2:03d}-track{3}".format(
+            self.FILE_PREFIX,
+            time.strftime("%Y%m%dT%H%M%S.", time.localtime(wall_time)),
+            int(wall_time * 1000) % 1000, recording.track_id)
+        path = os.path.join(self.__dir, name)
+        frames = np.lib.format.open_memmap(
+            path + ".npy.tmp", mode="w+", dtype=self.__frame_dtype,
+            shape=(len(slots),))
+        torn = 0
+        for (i, slot) in enumerate(slots):
+            frames[i] = ring[slot]
+            if self.__seq[slot] != seq[slot]:
+                # Overwritten while copied, marked so readers skip it
+                frames["ts"][i] = np.nan
+                torn += 1
+        frames.flush()
+        del frames
+
+        header = {
+            "room": self.__room_uid,
+            "track": recording.track_id,
+            "event_ts": recording.event,
+            "start_ts": recording.start,
+            "end_ts": recording.end,
+            "wall_time": recording.wall_time,
+            "frames": len(slots),
+            "torn": torn,
+        }
+        with open(path + ".json", "w") as file:
+            json.dump(header, file)
+        os.replace(path + ".npy.tmp", path + ".npy")
+
+        self._torn += torn
+        self._recordings += 1
+        self.__logger.info("Room {0} recorded {1} frames of fall event to "
+                           "{2}".format(self.__room_uid, len(slots), path))
+        return
+
+    def __bound(self, size: int):
+        """
+        Delete the oldest recordings until a recording of `size` bytes fits
+        within the bounds on the number and size of recordings.
+        """
+
+        config = self.__config
+        recordings = []
+        for entry in os.scandir(self.__dir):
+            if entry.name.startswith(self.FILE_PREFIX) and \
+                    entry.name.endswith(".npy"):
+                stat = entry.stat()
+                recordings.append((stat.st_mtime, entry.path, stat.st_size))
+        recordings.sort()
+
+        total = sum(r[2] for r in recordings) + size
+        max_bytes = config.max_disk_mb * 2 ** 20
+        while len(recordings) != 0 and \
+                (total > max_bytes or
+                 len(recordings) >= config.max_recordings):
+            (_, path, nbytes) = recordings.pop(0)
+            for victim in (path, path[0:-len(".npy")] + ".json"):
+                try:
+                    os.remove(victim)
+                except FileNotFoundError:
+                    pass
+            total -= nbytes
+            self._deleted += 1
+        return
+
+
+def loadRecording(path: str) -> tuple:
+    """
+    Load a recording written by `BlackBoxRecorder` without reading it into
+    memory.
+
+    :param path: Path of the recording, with or without its extension.
+    :type path: str
+    :return: A tuple of the header of the event and the memory-mapped frames,
+        ordered from oldest to newest. Frames with a NaN timestamp were torn
+        and hold no data.
+    :rtype: tuple
+    """
+
+    if path.endswith(".npy") or path.endswith(".json"):
+        path = os.path.splitext(path)[0]
+    with open(path + ".json", "r") as file:
+        header = json.load(file)
+    return (header, np.load(path + ".npy", mmap_mode="r"))
+
+
+def recordingScans(frames: np.ndarray, sensor: int = 0
+                   ) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    Iterate over the raw scans of a sensor in the frames of a recording, such
+    as to replay them with a `ReplayLidar`. Torn frames and frames without a
+    scan of the sensor are skipped.
+
+    :param frames: The frames of a recording, see `loadRecording`.
+    :type frames: np.ndarray
+    :param sensor: Index of the sensor within the room.
+    :type sensor: int
+    :return: An iterator of timestamped scans, views of the frames.
+    :rtype: Iterator[Tuple[float, np.ndarray]]
+    """
+
+    for frame in frames:
+        timestamp = float(frame["ts"])
+        n = int(frame["raw_n"][sensor])
+        if math.isnan(timestamp) or n == 0:
+            continue
+        yield (timestamp, frame["raw"][sensor, 0:n])
+    return
@@ -1,15 +1,30 @@
-from typing import List, Iterable
+from typing import List, Tuple, Optional
 
 from enum import Enum, auto
 from logging import Logger
 import threading
-from collections import deque
 import time
 
 import numpy as np
 
-from .sensor import Sensor, RPLidar
+from .sensor import Sensor, Lidar
 from .algs import LidarAlgSet
+from .arena import ScratchArena
+from .clusters import PackedClusters
+from .rangeimage import RangeImage
+from .fusion import ScanFusion
+from .acquisition import ScanBuffer, SensorAcquisition, FrameAssembler
+from .scheduler import AdaptiveScheduler, PriorityScheduler, sleepRemaining
+from .gates import OccupancyGate, GeometricGate
+from .changes import SectorChangeMap, ChangeRestrictedClustering
+from .incremental import WindowClustering
+from .tracking import ClusterTracker
+from .clutter import StaticClutterMap
+from .recorder import BlackBoxRecorder
+from .metrics import MetricsRegistry
+from .inference import InferenceService
+from .cache import ClassificationCache
+from .clock import Clock
 from .dataclasses import RoomConfig, RoomCallbacks
 
 
@@ -30,44 +45,260 @@ class Room(object):
 
         NONE = auto()
         PAUSED = auto()
+        IDLE = auto()
         LOW = auto()
         HIGH = auto()
 
     __SENSOR_THREAD_TIMEOUT_SEC: float = 2.0
     __PAUSE_TIMEOUT_SEC: float = 8.0
     __SCAN_MIN_WINDOW_SIZE: int = 5
-    __LOW_CLASSIFY_PERIOD_SEC: float = 0.7
+
+    # Stages of a frame whose latencies are measured
+    STAGES: Tuple[str, ...] = ("assemble", "filter", "fuse", "clutter",
+                               "cluster", "classify")
 
     def __init__(self, room_config: RoomConfig,
                  lidar_alg_set: LidarAlgSet,
                  sensors: List[Sensor],
                  callbacks: RoomCallbacks,
-                 logger: Logger):
+                 logger: Logger,
+                 metrics: Optional[MetricsRegistry] = None,
+                 inference: Optional[InferenceService] = None,
+                 priority: Optional[PriorityScheduler] = None,
+                 clock: Optional[Clock] = None):
         """
         :param room_config: A room specific configuration to use.
         :type room_config: FDSRoomConfig
         :param logger: The logger to use for logging.
         :type logger: logging.Logger
+        :param metrics: The registry to register the metrics of the room to,
+            defaults to a registry of its own.
+        :type metrics: Optional[MetricsRegistry]
+        :param inference: The service classifying the clusters of the rooms
+            sharing the algorithm set in batches, by default the room
+            classifies inline.
+        :type inference: Optional[InferenceService]
+        :param priority: The scheduler admitting the frames of the rooms of
+            the domain to processing by activity state, by default frames
+            are processed as soon as due.
+        :type priority: Optional[PriorityScheduler]
+        :param clock: The clock the room and its sensor workers run in,
+            defaults to real time.
+        :type clock: Optional[Clock]
         """
 
         self.__config = room_config
+        self.__clock = Clock() if clock is None else clock
         self.__callbacks = callbacks
 
         self.__sensors = sensors
         self.__lidar_sensors = []
         for sensor in sensors:
-            if isinstance(sensor, RPLidar):
+            if isinstance(sensor, Lidar):
                 self.__lidar_sensors.append(sensor)
 
+        # Room configured poses take precedence over sensor poses
+        lidar_poses = []
+        for lidar in self.__lidar_sensors:
+            lidar_poses.append(room_config.sensor_poses.get(lidar.info.uid,
+                                                            lidar.info.pose))
+        self.__lidar_fusion = ScanFusion(lidar_poses,
+                                         room_config.frame_skew_tol_sec)
+
+        # Each sensor gets its own buffer, filled by its own worker. Scans are
+        #  held in the data type the algorithms run in, and dropped by the
+        #  overload policy of the room if processing falls behind
+        backpressure = room_config.backpressure
+        self.__lidar_buffers = [
+            ScanBuffer(backpressure.depth, lidar.MAX_SCAN_POINTS,
+                       dtype=lidar_alg_set.dtype,
+                       policy=backpressure.policy,
+                       decimation=backpressure.decimation,
+                       decimate_backlog=backpressure.decimate_backlog,
+                       clock=self.__clock)
+            for lidar in self.__lidar_sensors]
+        self.__lidar_assembler = FrameAssembler(
+            self.__lidar_buffers, room_config.frame_skew_tol_sec)
+        self.__lidar_acquisitions: List[SensorAcquisition] = []
+
+        self.__scheduler = AdaptiveScheduler(room_config.scheduler,
+                                             self.__clock.monotonic())
+        self.__priority = priority
+        self.__admitted = False
+
         # Initialize algorithms with parameters
         # TODO: Need complete parameter set
-        self.__lidar_alg_set = lidar_alg_set
-
-        self.__scans = np.ndarray(self._SCAN_MIN_WINDOW_SIZE)
+        # Per-frame buffers are preallocated for the largest possible frame,
+        #  so that processing a frame allocates nothing
+        self.__arena = ScratchArena(max(1, sum(
+            lidar.MAX_SCAN_POINTS for lidar in self.__lidar_sensors)),
+            dtype=lidar_alg_set.dtype)
+        # Names of the per-sensor buffers, built once rather than per frame
+        n_lidar = len(self.__lidar_sensors)
+        self.__arena_names = tuple(
+            ["{0}{1}".format(prefix, i) for i in range(0, n_lidar)]
+            for prefix in ("scan", "unculled", "culled"))
+
+        # The algorithm set is shared between rooms, each room runs it with a
+        #  context of its own
+        cache = room_config.cache
+        self.__lidar_alg_ctx = lidar_alg_set.createContext(
+            cache=ClassificationCache(cache.size, quantum=cache.quantum,
+                                      policy=cache.policy,
+                                      ttl_sec=cache.ttl_sec,
+                                      key_by_track=cache.key_by_track,
+                                      clock=self.__clock.monotonic),
+            arena=self.__arena, inference=inference)
+        # Gate may not require more points than needed to form a cluster
+        self.__occupancy_gate = OccupancyGate(
+            min_points=lidar_alg_set.dbs_min_samples)
+        self.__geometric_gate = GeometricGate(room_config.geometric_gate)
+        self.__change_clustering = ChangeRestrictedClustering(
+            self.__lidar_alg_ctx, SectorChangeMap())
+        self.__window_clustering = None
+        self.__tracker = ClusterTracker()
+        self.__clutter_map = StaticClutterMap()
+        # Frames leading to and following fall events are kept for auditing
+        self.__recorder = None
+        if room_config.recorder.enabled:
+            self.__recorder = BlackBoxRecorder(
+                room_config.recorder, room_config.uid,
+                [lidar.MAX_SCAN_POINTS for lidar in self.__lidar_sensors],
+                logger, dtype=lidar_alg_set.dtype,
+                clock=self.__clock.monotonic)
+        if room_config.incremental_window:
+            self.__window_clustering = WindowClustering(
+                self.__SCAN_MIN_WINDOW_SIZE, lidar_alg_set.dbs_min_samples)
+        # The image of the fused frame is preallocated
+        self.__range_grid = None
+        if room_config.range_image_bins is not None:
+            grid = RangeImage(room_config.range_image_bins,
+                              dtype=lidar_alg_set.dtype)
+            self.__range_grid = grid
+            self.__frame_image = grid.empty()
+
+        self.__scans = np.ndarray(self.__SCAN_MIN_WINDOW_SIZE)
+        self._activity_state = self.ActivityState.NONE
+        # Time spent in each activity state, up to entering the current one
+        self.__state_since = self.__clock.monotonic()
+        # Time the latest frame was pulled, proof the room is not stuck
+        self._progress = self.__state_since
+        self.__state_seconds = {state: 0. for state in self.ActivityState}
+
+        self.__initMetrics(MetricsRegistry() if metrics is None else metrics)
 
         self.__logger = logger
         return
 
+    def __initMetrics(self, metrics: MetricsRegistry):
+        """
+        Register the metrics of the room. Values already counted by the
+        components of the room are read when collected, only latencies,
+        cluster counts and events are observed per frame.
+        """
+
+        room = str(self.__config.uid)
+        metrics = metrics.scope(room=room)
+        metrics.counter("fds_frames_total", "Frames assembled and processed."
+                        ).setFunction(lambda: self.__lidar_assembler._frames)
+        metrics.counter("fds_scans_late_total",
+                        "Scans too far apart in time to join a frame."
+                        ).setFunction(lambda: self.__lidar_assembler._late)
+        for (lidar, buffer) in zip(self.__lidar_sensors,
+                                   self.__lidar_buffers):
+            sensor = lidar.info.uid
+            metrics.counter("fds_scans_total", "Scans read from a sensor.",
+                            sensor=sensor
+                            ).setFunction(lambda b=buffer: b._pushed)
+            metrics.counter("fds_scans_dropped_total",
+                            "Scans dropped before joining any frame.",
+                            sensor=sensor
+                            ).setFunction(lambda b=buffer: b._dropped)
+            metrics.counter("fds_scans_failed_total",
+                            "Scans a sensor failed to read.", sensor=sensor
+                            ).setFunction(lambda b=buffer: b._failed)
+            metrics.counter("fds_scans_decimated_total",
+                            "Scans not kept while processing was behind.",
+                            sensor=sensor
+                            ).setFunction(lambda b=buffer: b._decimated)
+            metrics.gauge("fds_scan_buffer_depth",
+                          "Scans buffered for a sensor.", sensor=sensor
+                          ).setFunction(lambda b=buffer: b.depth)
+            metrics.gauge("fds_scan_backlog",
+                          "Buffered scans not yet used by any frame.",
+                          sensor=sensor
+                          ).setFunction(lambda b=buffer: b.backlog)
+        for state in self.ActivityState:
+            metrics.counter("fds_state_seconds_total",
+                            "Time spent in an activity state.",
+                            state=state.name
+                            ).setFunction(
+                                lambda s=state: self.__stateSeconds(s))
+        ctx = self.__lidar_alg_ctx
+        metrics.counter("fds_knn_predictions_total",
+                        "Clusters classified by the KNN classifier."
+                        ).setFunction(lambda: ctx.predictions)
+        metrics.counter("fds_cache_hits_total",
+                        "Clusters classified from the cache."
+                        ).setFunction(lambda: ctx.getCacheStats()["hits"])
+
+        self.__stage_hists = {
+            stage: metrics.histogram("fds_stage_seconds",
+                                     "Latency of a stage of a frame.",
+                                     stage=stage)
+            for stage in self.STAGES}
+        self.__frame_age_hist = metrics.histogram(
+            "fds_frame_age_seconds",
+            "Age of the newest scan of a frame when assembled.")
+        self.__clusters_hist = metrics.histogram(
+            "fds_clusters_per_frame", "Clusters found in a frame.",
+            buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32))
+        self.__events_counter = metrics.counter("fds_fall_events_total",
+                                                "Fall events emitted.")
+        return
+
+    def __enterState(self, state: "Room.ActivityState"):
+        """
+        Transition to an activity state, accounting the time spent in the
+        previous state.
+        """
+
+        now = self.__clock.monotonic()
+        self.__state_seconds[self._activity_state] += now - self.__state_since
+        self.__state_since = now
+        changed = state is not self._activity_state
+        self._activity_state = state
+        if changed and self.__callbacks.state_cb is not None:
+            self.__callbacks.state_cb(self.__config.uid, state)
+        return
+
+    def __stateSeconds(self, state: "Room.ActivityState") -> float:
+        seconds = self.__state_seconds[state]
+        if state is self._activity_state:
+            seconds += self.__clock.monotonic() - self.__state_since
+        return seconds
+
+    def __admit(self, high: bool):
+        """
+        Wait for the priority scheduler to admit the next frame, if not
+        already admitted.
+        """
+
+        if self.__priority is not None and not self.__admitted:
+            self.__priority.acquire(high)
+            self.__admitted = True
+        return
+
+    def __yieldSlot(self):
+        """
+        Hand the slot of a processed frame back to the priority scheduler.
+        """
+
+        if self.__admitted:
+            self.__priority.release()
+            self.__admitted = False
+        return
+
     def __cond_pauseCheck(self):
         return (self.__threads_to_pause == 0)
 
@@ -84,13 +315,13 @@ class Room(object):
 
         if not self.__pause_all_cond.wait_for(self.__cond_pauseCheck,
                                               timeout=self.__PAUSE_TIMEOUT_SEC):
-            self.__logger.warn(f"Pausing exceeded timeout of {0} seconds."
-                               .format(self.__PAUSE_TIMEOUT_SEC))
+            self.__logger.warning("Pausing exceeded timeout of {0} seconds."
+                                  .format(self.__PAUSE_TIMEOUT_SEC))
         else:
             self.__pause_all_cond.wait_for(self.__cond_pauseCheck,
                                            timeout=None)
 
-        self._activity_state = self.ActivityState.PAUSED
+        self.__enterState(self.ActivityState.PAUSED)
         return
 
     def resumeThreads(self):
@@ -122,115 +353,217 @@ class Room(object):
             return True
         return False
 
-    def __thread_sensorScanPull(self):
-        """
-        Thread function.
-        Asynchronously copy sensor scans from alternate windows to ensure
-        `__thread_sensorScan` is able to produce and store new, up-tod-date
-        scans for `__thread_classification` to consume.
+    def __pullLidarFrame(self) -> Tuple[np.ndarray, np.ndarray]:
         """
+        Assemble a synchronized frame from the scans of each sensor, filter
+        each scan with the calibration of its sensor and fuse all scans into
+        the frame of the room.
 
-        self.__threads_to_pause += 1
+        :return: A tuple of unculled and culled samples in the room frame,
+            ordered by increasing degree.
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
 
-        # Wait until the classification thread requests data
-        self.__sensor_pull_event.wait(timeout=None)
-        while self._sensor_sentinel:
-            self.__sensor_pull_event.clear()
+        # A room whose every sensor was given up on fails, so that its
+        #  domain is restarted
+        acquisitions = self.__lidar_acquisitions
+        if len(acquisitions) != 0 and all(a.failed for a in acquisitions):
+            raise FDSRoomException("Every sensor of room {0} failed."
+                                   .format(self.__config.uid))
+
+        arena = self.__arena
+        (scan_names, unculled_names, culled_names) = self.__arena_names
+        stage_hists = self.__stage_hists
+
+        t_start = time.perf_counter()
+        lidar_frame = self.__lidar_assembler.assemble(
+            [arena.take(scan_names[i], lidar.MAX_SCAN_POINTS)
+             for (i, lidar) in enumerate(self.__lidar_sensors)])
+        timestamps = [None if scan is None else scan[0]
+                      for scan in lidar_frame]
+        t_end = time.perf_counter()
+        stage_hists["assemble"].observe(t_end - t_start)
+        assembled = [ts for ts in timestamps if ts is not None]
+        if len(assembled) != 0:
+            self.__frame_age_hist.observe(
+                self.__clock.monotonic() - max(assembled))
+        t_start = t_end
+
+        # Only filter scans recent enough to be fused
+        frames = [None] * len(lidar_frame)
+        n_total = 0
+        for i in self.__lidar_fusion.select(timestamps):
+            (timestamp, scan) = lidar_frame[i]
+            n = len(scan)
+            (unculled, culled) = self.__lidar_sensors[i].filterSamples(
+                scan, out=(arena.take(unculled_names[i], n),
+                           arena.take(culled_names[i], n)))
+            frames[i] = (timestamp, unculled, culled)
+            n_total += n
+        t_end = time.perf_counter()
+        stage_hists["filter"].observe(t_end - t_start)
+        t_start = t_end
+
+        (unculled, culled) = self.__lidar_fusion.fuse(
+            frames, out=(arena.take("unculled", n_total),
+                         arena.take("culled", n_total)))
+        t_end = time.perf_counter()
+        stage_hists["fuse"].observe(t_end - t_start)
+        t_start = t_end
+
+        # Suppress learned static clutter right after filtering
+        now = self.__clock.monotonic()
+        (unculled, culled) = self.__clutter_map.apply(unculled, culled, now)
+        stage_hists["clutter"].observe(time.perf_counter() - t_start)
+
+        if self.__recorder is not None:
+            self.__recorder.record(
+                now, [None if scan is None else scan[1]
+                      for scan in lidar_frame],
+                unculled, culled, self._activity_state.value)
+        self._progress = now
+        return (unculled, culled)
+
+    def __clusterRangeImage(self, unculled: np.ndarray) -> PackedClusters:
+        """
+        Cluster the points of a frame as runs of bins of its range image,
+        built once from the fused frame.
+        """
 
-            # Copy scans from the alternate windows
-            for i in range(0, len(self._lidar_sensors)):
-                for scan in self.__lidar_scan_windows_alt[i]:
-                    self.__lidar_scan_windows.append(scan)
+        grid = self.__range_grid
+        image = grid.fromSamples(unculled, out=self.__frame_image)
+        return self.__lidar_alg_ctx.clusterRangeImage(
+            image, grid, min_bins=self.__config.range_image_min_bins)
 
-            # Clear alternate windows - to prevent adding old scans to the
-            # main windows
-            for i in range(0, len(self._lidar_sensors)):
-                self.__lidar_scan_windows_alt[i].clear()
+    def __clusterLow(self, unculled: np.ndarray) -> PackedClusters:
+        """
+        Cluster points for occupancy in the LOW and IDLE activity states,
+        skipping clustering if the occupancy gate fails.
+        """
 
-            self.__sensor_pull_event.wait(timeout=None)
-        return 0
+        t_start = time.perf_counter()
+        if not self.__occupancy_gate.check(unculled):
+            lidar_clusters = PackedClusters.empty(unculled)
+        elif self.__range_grid is not None:
+            lidar_clusters = self.__clusterRangeImage(unculled)
+        else:
+            lidar_clusters = self.__lidar_alg_ctx.clusterLidarScan(unculled)
+        self.__stage_hists["cluster"].observe(time.perf_counter() - t_start)
+        self.__clusters_hist.observe(len(lidar_clusters))
+        return lidar_clusters
 
-    def __thread_sensorScan(self):
+    def __clusterHigh(self, unculled: np.ndarray
+                      ) -> Tuple[PackedClusters, List[Optional[int]]]:
         """
-        Thread function.
-        Get sensor scans and data asynchronously and continuously, spawned by
-        `__thread_classification()`.
+        Cluster points in the HIGH activity state, either incrementally over
+        the window of scans or restricted to sectors changed since the last
+        scan.
+
+        :return: A tuple of clusters with centers and unclustered points,
+            and activities carried forward for clusters, or `None` for
+            clusters which need classifying, respectively.
         """
 
-        self.__threads_to_pause += 1
+        t_start = time.perf_counter()
+        window_clustering = self.__window_clustering
+        if self.__range_grid is not None:
+            # Runs of bins are clustered afresh, tracks carry activities
+            lidar_clusters = self.__clusterRangeImage(unculled)
+            activities = [None] * len(lidar_clusters)
+        elif window_clustering is None:
+            (lidar_clusters, activities) = \
+                self.__change_clustering.update(unculled)
+        else:
+            window_clustering.insert(unculled)
+            lidar_clusters = window_clustering.snapshot()
+            activities = [None] * len(lidar_clusters)
+        self.__stage_hists["cluster"].observe(time.perf_counter() - t_start)
+        self.__clusters_hist.observe(len(lidar_clusters))
+        return (lidar_clusters, activities)
+
+    def __resetClusterHigh(self):
+        self.__change_clustering.reset()
+        if self.__window_clustering is not None:
+            self.__window_clustering.reset()
+        return
 
-        # Sensor scan thread controls pull thread
-        sensor_pull_thread = threading.Thread(
-            target=self.__thread_sensorScanPull,
-            name="FDS Sensor Data Pull")
-        sensor_pull_thread.run()
+    def __waitFreshScan(self):
+        """
+        Wait for a scan not yet used by any frame, so that frames due faster
+        than the sensors scan are not processed again on the same scans.
+        """
 
-        # Initialize fixed-length queues
-        self.__lidar_scan_windows: List[deque] = []
-        self.__lidar_scan_windows_alt = []
-        for lidar in self.__lidar_sensors:
-            self.__lidar_scan_windows.append(deque(
-                iterable=[],
-                maxlen=Room._SCAN_MIN_WINDOW_SIZE))
-            self.__lidar_scan_windows_alt.append(deque(
-                iterable=[],
-                maxlen=Room._SCAN_MIN_WINDOW_SIZE))
-
-        # Start the sensors
-        for lidar in self.__lidar_sensors:
-            lidar.startScanning()
-
-        # Begin sensor sampling/scan loop
-        while self._sensor_sentinel:
-            # Check for pause event
-            if not self.__pause_event.is_set():
-                # Room transitions to PAUSED state, wait for unpause
-                self.__pause_event.wait(timeout=None)
-
-            # Prevent the thread from pushing scans to the main queues
-            # when the classification thread requests data.
-            if not self.__sensor_pull_lock.locked():
-                # Add to window
-                for i in range(0, len(self.__lidar_sensors)):
-                    lidar = self.__lidar_sensors[i]
-                    self.__lidar_scan_windows[i].append(lidar.getRawData())
-            else:
-                # Add to temporary windows
-                for i in range(0, len(self.__lidar_sensors)):
-                    lidar = self.__lidar_sensors[i]
-                    self.__lidar_scan_windows_alt[i].append(lidar.getRawData())
+        buffers = self.__lidar_buffers
+        if len(buffers) == 0 or any(b.backlog != 0 for b in buffers):
+            return
+        buffers[0].waitScan(self.__SENSOR_THREAD_TIMEOUT_SEC)
+        return
 
-        for lidar in self.__lidar_sensors:
-            lidar.stopScanning()
+    def __idleSensors(self):
+        """
+        Idle all sensors of the room and discard their outdated scans.
+        """
 
-        # Ensure pull thread stops
-        self.__sensor_pull_event.set()
-        sensor_pull_thread.join()
-        self._sensor_sentinel = True  # Reset to true for exit
-        return 0
+        pwm = self.__config.scheduler.idle_motor_pwm
+        for acquisition in self.__lidar_acquisitions:
+            acquisition.idle(pwm)
+        for buffer in self.__lidar_buffers:
+            buffer.clear()
+        return
 
-    def __pullLidarData(self) -> Iterable[np.ndarray]:
+    def __wakeSensors(self):
+        """
+        Wake all sensors of the room and wait for their first scans since.
         """
-        Pull sensor scans generated by the sensorScan thread.
 
-        :return: An ordered list of raw scans, ordered by increasing degree.
-        :rtype: Iterable[np.ndarray]
+        # Workers idle after the scan in progress, which may be buffered
+        #  after the buffers were cleared, and slowed sensors scan on while
+        #  idle. Scans from before the wake are discarded again, and any
+        #  pushed meanwhile are skipped, so only scans since are waited for
+        woken = self.__clock.monotonic()
+        for buffer in self.__lidar_buffers:
+            buffer.clear()
+            buffer.markConsumed(woken)
+        for acquisition in self.__lidar_acquisitions:
+            acquisition.wake()
+        timeout = self.__config.scheduler.motor_spinup_sec + \
+            self.__SENSOR_THREAD_TIMEOUT_SEC
+        for buffer in self.__lidar_buffers:
+            buffer.waitScan(timeout)
+        return
+
+    def __classificationProcessIdle(self):
         """
+        Idle sensors in the IDLE activity state after the room has long been
+        unoccupied, periodically waking them to probe for occupancy with the
+        same algorithm as the LOW activity state.
+        """
+
+        self.__enterState(self.ActivityState.IDLE)
+        self.__logScheduleChange()
+
+        scheduler = self.__scheduler
+
+        lidar_clusters = PackedClusters.empty()
+        while (len(lidar_clusters) == 0):
+            self.__idleSensors()
+
+            # Checkpoint for pausing
+            if not self.__checkPause():
+                self.__clock.sleep(scheduler.probePeriod())
+
+            self.__wakeSensors()
+            self.__admit(False)
+            (unculled, culled) = self.__pullLidarFrame()
+
+            lidar_clusters = self.__clusterLow(unculled)
+            self.__yieldSlot()
 
-        sensor_windows = []
-        # Freeze the main set of queues...
-        self.__sensor_ret_cond = False
-        # ...and start copying them.
-        for i in range(0, len(self._lidar_sensors)):
-            # Copy the lists backing the windows (the deques)
-            scan_window = list(self.__lidar_scan_windows[i])
-            sensor_windows.append(scan_window)
-        # Let the sensorPull thread add scans from the alternate windows
-        self.__sensor_pull_event.set()
-        # Unfreeze the main set of queues
-        self.__sensor_ret_cond = True
+        scheduler.markOccupied(self.__clock.monotonic())
 
-        return sensor_windows
+        # Set the next state/function to transition to.
+        self.__classificationProcess = self.__classificationProcessHigh
+        return 0
 
     def __classificationProcessLow(self):
         """
@@ -240,98 +573,180 @@ class Room(object):
         number of points, before switching to the HIGH activity state and
         exiting.
         """
-        # FUTURE: Process with arbitrary sensors
 
-        self._activity_state = self.ActivityState.LOW
+        self.__enterState(self.ActivityState.LOW)
+        self.__logScheduleChange()
 
-        lidar_alg_set = self.__lidar_alg_set
+        scheduler = self.__scheduler
 
-        time_tosleep = time.monotonic()
+        time_start = self.__clock.monotonic()
+        work_start = self.__clock.threadTime()
 
         # Check for occupancy
-        lidar_windows = self.__pullLidarData()
-        lidar_window = lidar_windows[0]
-        (unculled, culled) = self.__lidar_sensors[0].filterData(lidar_window)
+        self.__admit(False)
+        (unculled, culled) = self.__pullLidarFrame()
 
-        (lidar_clusters, noise) = \
-            lidar_alg_set.clusterLidarScan(unculled)
+        lidar_clusters = self.__clusterLow(unculled)
+        self.__yieldSlot()
 
         while (len(lidar_clusters) == 0):
-            self.__callbacks.pushdata_cb(0, culled, noise, lidar_clusters)
+            self.__callbacks.pushdata_cb(0, culled, lidar_clusters)
+            scheduler.recordWork(self.__clock.threadTime() - work_start)
+
+            now = self.__clock.monotonic()
+            if scheduler.idleDue(now):
+                self.__classificationProcess = \
+                    self.__classificationProcessIdle
+                return 0
 
             # Checkpoint for pausing
             if not self.__checkPause():
-                time_tosleep = self.__LOW_CLASSIFY_PERIOD_SEC - \
-                    (time.monotonic() - time_tosleep)
-                time.sleep(time_tosleep)
+                self.__clock.sleep(sleepRemaining(scheduler.lowPeriod(now),
+                                                  time_start, now))
 
-            time_tosleep = time.monotonic()
+            # Polls deferred by busier rooms process the latest frame once
+            #  admitted
+            self.__admit(False)
+            time_start = self.__clock.monotonic()
+            work_start = self.__clock.threadTime()
 
-            lidar_windows = self.__pullLidarData()
-            # FUTURE: Process with arbitrary sensors
-            lidar_window = lidar_windows[0]
-            (unculled, culled) = self.__lidar_sensors[0] \
-                .filterData(lidar_window)
+            (unculled, culled) = self.__pullLidarFrame()
 
-            (lidar_clusters, noise) = \
-                lidar_alg_set.clusterLidarScan(unculled)
+            lidar_clusters = self.__clusterLow(unculled)
+            self.__yieldSlot()
+
+        scheduler.markOccupied(self.__clock.monotonic())
 
         # Set the next state/function to transition to.
         self.__classificationProcess = self.__classificationProcessHigh
         return 0
 
+    def __classifyClusters(self, lidar_clusters: PackedClusters,
+                           activities: List[Optional[int]]) -> np.ndarray:
+        """
+        Track and classify the clusters of a frame of the HIGH activity state,
+        emitting fall events.
+
+        :param lidar_clusters: Clusters with centers of the frame.
+        :param activities: Activities carried forward for clusters, or `None`
+            for clusters which need classifying.
+        :return: A boolean array marking clusters of tracks which never
+            moved nor fell, which may be static clutter.
+        """
+
+        t_start = time.perf_counter()
+        lidar_alg_ctx = self.__lidar_alg_ctx
+        tracker = self.__tracker
+        track_ids = tracker.update(lidar_clusters)
+        # Implausible clusters are never classified
+        plausible = self.__geometric_gate.check(lidar_clusters)
+
+        for i in range(0, len(lidar_clusters)):
+            if not plausible[i]:
+                continue
+            activity = activities[i]
+            # Clusters carried from unchanged sectors keep their activity,
+            #  tracks only classify again once their shape changed
+            if activity is None:
+                if tracker.needsClassify(i):
+                    # Process key samples
+                    cluster_pts = lidar_clusters[i]
+                    center = lidar_clusters.centers[i]
+                    activity = lidar_alg_ctx.classifyLidarCluster(
+                        cluster_pts, center, track_ids[i])
+                    tracker.recordActivity(i, activity)
+                    if self.__window_clustering is None and \
+                            self.__range_grid is None:
+                        self.__change_clustering.recordActivity(i, activity)
+                else:
+                    activity = tracker.activityOf(i)
+            if (activity == 1):  # fall detected
+                tracker.recordFall(i)
+                self.__callbacks.event_cb(self.__config.uid, track_ids[i])
+                self.__events_counter.inc()
+                if self.__recorder is not None:
+                    self.__recorder.trigger(self.__clock.monotonic(),
+                                            track_ids[i])
+                break
+        self.__stage_hists["classify"].observe(time.perf_counter() - t_start)
+
+        # Furniture is learned whatever its label, but tracks remember having
+        #  moved or fallen, so a person lying or sitting still is not
+        return np.array([tracker.isStatic(i)
+                         for i in range(0, len(lidar_clusters))], dtype=bool)
+
     def __classificationProcessHigh(self):
         """
         Use a higher power/intensity classification algorithm in the HIGH
         activity state to find falls in a room with continued activity.
         """
-        # FUTURE: Process with arbitrary sensors
 
-        self._activity_state = self.ActivityState.HIGH
+        self.__enterState(self.ActivityState.HIGH)
+        self.__logScheduleChange()
 
-        lidar_alg_set = self.__lidar_alg_set
+        self.__resetClusterHigh()
+        self.__tracker.reset()
+        scheduler = self.__scheduler
+        scheduler.resetMotion()
 
         # TODO: Run KNN here to process scan which caused changeover
 
+        time_start = self.__clock.monotonic()
+        work_start = self.__clock.threadTime()
+
         # Check for occupancy to ensure there exists clusters to process
-        lidar_windows = self.__pullLidarData()
-        lidar_window = lidar_windows[0]
-        (unculled, culled) = self.__lidar_sensors[0].filterData(lidar_window)
+        self.__waitFreshScan()
+        self.__admit(True)
+        (unculled, culled) = self.__pullLidarFrame()
 
-        (lidar_clusters, noise) = \
-            lidar_alg_set.clusterLidarScanAdv(unculled)
+        (lidar_clusters, activities) = \
+            self.__clusterHigh(unculled)
 
         while (len(lidar_clusters) != 0):
-            # Process each cluster
-            for cluster in lidar_clusters:
-                # Process key samples
-                cluster_pts = cluster[0]
-                center = cluster[1]
-                activity = \
-                    lidar_alg_set.classifyLidarCluster(cluster_pts, center)
-                if (activity == 1):  # fall detected
-                    self.__callbacks.event_cb(self.__config.uid)
-                    break
-
-            self.__callbacks.pushdata_cb(0, culled, noise, lidar_clusters)
+            static = self.__classifyClusters(lidar_clusters, activities)
+
+            self.__callbacks.pushdata_cb(0, culled, lidar_clusters)
+            self.__yieldSlot()
+
+            # Learn clusters which never moved nor fell as static clutter
+            now = self.__clock.monotonic()
+            self.__clutter_map.observe(lidar_clusters, now, learn=static)
+
+            # Only process at a high rate while clusters are moving
+            scheduler.markOccupied(now)
+            scheduler.updateMotion(lidar_clusters.centroids(), now)
+            scheduler.recordWork(self.__clock.threadTime() - work_start)
 
             # Checkpoint for pausing
-            self.__checkPause()
+            if not self.__checkPause():
+                self.__clock.sleep(sleepRemaining(scheduler.highPeriod(),
+                                                  time_start, now))
+
+            self.__waitFreshScan()
+            self.__admit(True)
+            time_start = self.__clock.monotonic()
+            work_start = self.__clock.threadTime()
 
-            lidar_windows = self.__pullLidarData()
-            # FIXME: Process with arbitrary sensors
-            lidar_window = lidar_windows[0]
-            (unculled, culled) = self.__lidar_sensors[0] \
-                .filterData(lidar_window)
+            (unculled, culled) = self.__pullLidarFrame()
 
             # Keep checking for occupancy
-            (lidar_clusters, noise) = \
-                lidar_alg_set.clusterLidarScanAdv(unculled)
+            (lidar_clusters, activities) = \
+                self.__clusterHigh(unculled)
+
+        self.__yieldSlot()
 
         # Set the next state/function to transition to.
-        self.__classificationProcess = self.__classificationProcessHigh
+        self.__classificationProcess = self.__classificationProcessLow
         return 0
 
+    def run(self) -> int:
+        """
+        Run the processing of the room in the calling thread until it exits,
+        such as from a thread of its clock.
+        """
+
+        return self.__thread_classification()
+
     def __thread_classification(self):
         """
         Thread function.
@@ -341,36 +756,147 @@ class Room(object):
         """
 
         # Construct synchronization primitizes
-        self.__pause_event = threading.Event()
+        self.__pause_event = self.__clock.event()
+        self.__pause_event.set()
         self.__pause_all_cond = threading.Condition()
         self.__threads_to_pause = 1  # For condition, to check threads pause
         self.__threads_pausing = 0
-        self.__sensor_ret_cond = True
-        self.__sensor_pull_event = threading.Event()
 
-        # Room thread controls sensor thread, not the pool
-        sensor_thread = threading.Thread(target=self.__thread_sensorScan,
-                                         name="FDS Sensor Data Scan Loop")
-        self._sensor_sentinel = True
-        sensor_thread.run()
+        # Room thread controls one acquisition worker per sensor, not the pool
+        acquisitions = self.__lidar_acquisitions
+        for lidar, buffer in zip(self.__lidar_sensors, self.__lidar_buffers):
+            acquisition = SensorAcquisition(lidar, buffer, self.__pause_event,
+                                            self.__logger, self.__clock)
+            acquisition.start()
+            acquisitions.append(acquisition)
+        if self.__recorder is not None:
+            self.__recorder.start()
 
         # Begin fall detection processing loop using low power classification
-        self._activity_state = self.ActivityState.LOW
+        self.__enterState(self.ActivityState.LOW)
         self.__classificationProcess = self.__classificationProcessLow
         # Run loop, classificationProcess method pointer is set in
         #  classification process
-        while True:
-            try:
-                exit_status = self.__classificationProcess()
-                if (exit_status != 0):  # start graceful exit
-                    break
-            except FDSRoomException as err:
-                raise err
-
-        self._sensor_sentinel = False
-        sensor_thread.join(self.__SENSOR_THREAD_TIMEOUT_SEC)
-        if (not self._sensor_sentinel):
-            self.__logger.debug("Sensor thread did not join promptly, exceeded"
-                                " {0} seconds"
-                                .format(self.__SENSOR_THREAD_TIMEOUT_SEC))
+        try:
+            while True:
+                try:
+                    exit_status = self.__classificationProcess()
+                    if (exit_status != 0):  # start graceful exit
+                        break
+                except FDSRoomException as err:
+                    raise err
+        finally:
+            # Sensors are released even when the room fails
+            for acquisition in acquisitions:
+                if not acquisition.stop(self.__SENSOR_THREAD_TIMEOUT_SEC):
+                    self.__logger.debug(
+                        "Sensor thread did not join promptly, exceeded {0} "
+                        "seconds".format(self.__SENSOR_THREAD_TIMEOUT_SEC))
+            # Pending recordings are written with the frames recorded so far
+            if self.__recorder is not None:
+                self.__recorder.stop()
         return 0
+
+    def getProgress(self) -> float:
+        """
+        Get the time the room last pulled a frame, which a room stuck, such
+        as deadlocked, stops advancing. A paused room is not stuck.
+
+        :return: The time, in seconds of the clock of the room.
+        :rtype: float
+        """
+
+        if self._activity_state is self.ActivityState.PAUSED:
+            return self.__clock.monotonic()
+        return self._progress
+
+    def getAcquisitionStats(self) -> dict:
+        """
+        Get counters for scan acquisition and frame assembly of the room.
+
+        :return: A dictionary of assembled frame, late and dropped scan counts
+            and per-sensor buffer depths.
+        :rtype: dict
+        """
+
+        return self.__lidar_assembler.stats()
+
+    def getGateStats(self) -> dict:
+        """
+        Get hit and miss counters of the occupancy gate run before clustering
+        in the LOW and IDLE activity states.
+
+        :rtype: dict
+        """
+
+        return self.__occupancy_gate.stats()
+
+    def getClutterStats(self) -> dict:
+        """
+        Get counters of the static clutter map of the room.
+
+        :rtype: dict
+        """
+
+        return self.__clutter_map.stats()
+
+    def getGeometricGateStats(self) -> dict:
+        """
+        Get pass and rejection counters of the geometric gate run before
+        classification in the HIGH activity state.
+
+        :rtype: dict
+        """
+
+        return self.__geometric_gate.stats()
+
+    def getCacheStats(self) -> dict:
+        """
+        Get counters of the classification cache of the room.
+
+        :rtype: dict
+        """
+
+        return self.__lidar_alg_ctx.getCacheStats()
+
+    def getArenaStats(self) -> dict:
+        """
+        Get the size of the per-frame scratch arena of the room, and the
+        number of times it had to grow.
+
+        :rtype: dict
+        """
+
+        return self.__arena.stats()
+
+    def getRecorderStats(self) -> dict:
+        """
+        Get counters of the black-box recorder of the room.
+
+        :return: A dictionary of counters, empty if the recorder is disabled.
+        :rtype: dict
+        """
+
+        if self.__recorder is None:
+            return {}
+        return self.__recorder.stats()
+
+    def getSchedule(self) -> dict:
+        """
+        Get the activity state of the room and the processing rates chosen by
+        its scheduler.
+
+        :return: A dictionary of the activity state name and chosen rates.
+        :rtype: dict
+        """
+
+        schedule = self.__scheduler.report(self.__clock.monotonic())
+        schedule["state"] = self._activity_state.name
+        return schedule
+
+    def __logScheduleChange(self):
+        self.__logger.debug("Room {0} entered state {1}: {2}"
+                            .format(self.__config.uid,
+                                    self._activity_state.name,
+                                    self.getSchedule()))
+        return
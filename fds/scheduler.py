@@ -0,0 +1,323 @@
+from typing import Optional
+
+import heapq
+import os
+import threading
+
+import numpy as np
+
+from .clock import Clock
+from .metrics import MetricsRegistry
+from .dataclasses import SchedulerConfig, PriorityConfig
+
+
+class AdaptiveScheduler(object):
+    """
+    Class for choosing the processing period of a room from its recent
+    occupancy, cluster motion and processing cost.
+
+    Periods of the LOW state lengthen the longer the room is unoccupied, up to
+    the point where the sensors are idled and only probed periodically. Periods
+    of the HIGH state are only shortened while clusters are moving. No period
+    is chosen shorter than what the CPU budget allows, nor longer than what the
+    maximum detection latency allows.
+    """
+
+    # Smoothing factor for the moving average of processing time
+    __WORK_EMA_ALPHA: float = 0.2
+
+    def __init__(self, config: SchedulerConfig, now: float):
+        """
+        :param config: Scheduling targets of the room.
+        :type config: SchedulerConfig
+        :param now: The current time, in seconds.
+        :type now: float
+        """
+
+        self.__config = config
+        self.__last_occupied = now
+        self.__work_ema = 0.
+
+        self.__prev_ctrs: Optional[np.ndarray] = None
+        self.__prev_ctrs_time = now
+
+        self._moving = False
+        self._low_period = config.low_period_min_sec
+        self._high_period = config.high_period_max_sec
+        self._probe_period = self.probePeriod()
+        return
+
+    def recordWork(self, work_sec: float):
+        """
+        Record the processing time spent on a single frame.
+        """
+
+        alpha = self.__WORK_EMA_ALPHA
+        self.__work_ema = (1 - alpha) * self.__work_ema + alpha * work_sec
+        return
+
+    def markOccupied(self, now: float):
+        self.__last_occupied = now
+        return
+
+    def __budgetPeriod(self) -> float:
+        """
+        Get the shortest period which keeps processing within the CPU budget.
+        """
+
+        return self.__work_ema / self.__config.cpu_budget
+
+    def lowPeriod(self, now: float) -> float:
+        """
+        Get the period of the LOW state, growing from its minimum to its
+        maximum as the room approaches idling.
+        """
+
+        config = self.__config
+        unoccupied = now - self.__last_occupied
+        frac = min(1., unoccupied / config.idle_after_sec)
+        period = config.low_period_min_sec + \
+            frac * (config.low_period_max_sec - config.low_period_min_sec)
+        period = min(period, config.max_detect_latency_sec)
+        self._low_period = max(period, self.__budgetPeriod())
+        return self._low_period
+
+    def idleDue(self, now: float) -> bool:
+        """
+        Check if the room has been unoccupied long enough to idle sensors.
+        """
+
+        return (now - self.__last_occupied) >= self.__config.idle_after_sec
+
+    def probePeriod(self) -> float:
+        """
+        Get the period between probes of the IDLE state, accounting for the
+        time for sensor motors to spin back up.
+        """
+
+        config = self.__config
+        period = min(config.idle_probe_period_sec,
+                     config.max_detect_latency_sec - config.motor_spinup_sec)
+        self._probe_period = max(period, 0.)
+        return self._probe_period
+
+    def updateMotion(self, ctrs: np.ndarray, now: float) -> bool:
+        """
+        Update whether clusters are moving from the centroids of a frame.
+
+        :param ctrs: Cartesian cluster centroids of shape (n_clusters, 2).
+        :type ctrs: np.ndarray
+        :param now: The time of the frame, in seconds.
+        :type now: float
+        :return: True if any cluster is moving, false otherwise.
+        :rtype: bool
+        """
+
+        prev = self.__prev_ctrs
+        dt = now - self.__prev_ctrs_time
+        if prev is None or len(prev) == 0 or len(ctrs) == 0 or dt <= 0:
+            # Appearing or vanishing clusters count as motion
+            moving = (prev is None or len(prev) != len(ctrs))
+        else:
+            # Displacement of each cluster from its nearest previous cluster
+            dists = np.linalg.norm(ctrs[:, None, :] - prev[None, :, :],
+                                   axis=2).min(axis=1)
+            moving = bool(dists.max() / dt > self.__config.motion_speed_thresh)
+
+        self.__prev_ctrs = ctrs
+        self.__prev_ctrs_time = now
+        self._moving = moving
+        return moving
+
+    def highPeriod(self) -> float:
+        """
+        Get the period of the HIGH state from the latest cluster motion.
+        """
+
+        config = self.__config
+        period = config.high_period_min_sec if self._moving \
+            else config.high_period_max_sec
+        self._high_period = max(period, self.__budgetPeriod())
+        return self._high_period
+
+    def resetMotion(self):
+        self.__prev_ctrs = None
+        self._moving = False
+        return
+
+    def report(self, now: float) -> dict:
+        """
+        Get the rates currently chosen by the scheduler.
+
+        :return: A dictionary of chosen periods, in seconds, cluster motion,
+            smoothed processing time and time since last occupied.
+        :rtype: dict
+        """
+
+        return {
+            "low_period_sec": self._low_period,
+            "high_period_sec": self._high_period,
+            "probe_period_sec": self._probe_period,
+            "moving": self._moving,
+            "work_sec": self.__work_ema,
+            "unoccupied_sec": now - self.__last_occupied,
+        }
+
+
+def sleepRemaining(period: float, start: float, now: float) -> float:
+    """
+    Get the time left to sleep of a period which began at `start`.
+    """
+
+    return max(0., period - (now - start))
+
+
+class PriorityScheduler(object):
+    """
+    Class for admitting the frames of the rooms of a domain to a bounded
+    number of processing slots, by the activity state of their room.
+
+    Each frame is given a deadline by its priority, short for rooms in the
+    HIGH state and long for others, and waiting frames are admitted earliest
+    deadline first. Frames of rooms where someone moves are thus processed
+    ahead of the polls of empty rooms, which are deferred while the slots
+    are busy. A deferred room processes the latest frame once admitted, so
+    the frames it missed are coalesced rather than queued. A deferred frame
+    eventually has the earliest deadline, so no room starves.
+
+    Frames are admitted whole, a frame being processed is never interrupted.
+    """
+
+    def __init__(self, config: PriorityConfig,
+                 metrics: Optional[MetricsRegistry] = None,
+                 clock: Optional[Clock] = None):
+        """
+        :param config: The slots and deadlines of the scheduler.
+        :type config: PriorityConfig
+        :param metrics: The registry to register the metrics of the
+            scheduler to, defaults to a registry of its own.
+        :type metrics: Optional[MetricsRegistry]
+        :param clock: The clock the rooms of the domain run in, which frames
+            wait and their deadlines pass in, defaults to real time.
+        :type clock: Optional[Clock]
+        """
+
+        self.__config = config
+        self.__clock = Clock() if clock is None else clock
+        self.__slots = config.slots if config.slots is not None \
+            else (os.cpu_count() or 1)
+        self.__free = self.__slots
+
+        # Waiting frames as [deadline, sequence, high, enqueued, event]
+        self.__waiting = []
+        self.__high_waiting = 0
+        self.__seq = 0
+        self.__lock = threading.Lock()
+
+        self._admitted = 0
+        self._deferred = 0
+        self._promoted = 0
+        self._missed = 0
+
+        self.__initMetrics(MetricsRegistry() if metrics is None else metrics)
+        return
+
+    def __initMetrics(self, metrics: MetricsRegistry):
+        metrics.counter("fds_priority_admitted_total",
+                        "Frames admitted to processing."
+                        ).setFunction(lambda: self._admitted)
+        metrics.counter("fds_priority_deferred_total",
+                        "Frames of rooms not in the HIGH state which waited "
+                        "for a slot.").setFunction(lambda: self._deferred)
+        metrics.counter("fds_priority_promoted_total",
+                        "Deferred frames admitted ahead of waiting HIGH "
+                        "frames.").setFunction(lambda: self._promoted)
+        metrics.counter("fds_priority_deadline_missed_total",
+                        "HIGH frames admitted after their deadline."
+                        ).setFunction(lambda: self._missed)
+        metrics.gauge("fds_priority_waiting",
+                      "Frames waiting for a slot."
+                      ).setFunction(lambda: len(self.__waiting))
+        self.__wait_hists = {
+            high: metrics.histogram("fds_priority_wait_seconds",
+                                    "Time frames waited for a slot.",
+                                    priority="high" if high else "low")
+            for high in (True, False)}
+        return
+
+    @property
+    def slots(self) -> int:
+        return self.__slots
+
+    def __admit(self, high: bool, enqueued: float, now: float):
+        """
+        Account a frame being admitted, with the lock held.
+        """
+
+        wait = now - enqueued
+        self._admitted += 1
+        self.__wait_hists[high].observe(wait)
+        if high and wait > self.__config.high_deadline_sec:
+            self._missed += 1
+        return
+
+    def acquire(self, high: bool) -> float:
+        """
+        Wait for a slot to process a frame in.
+
+        :param high: Whether the room of the frame is in the HIGH state.
+        :type high: bool
+        :return: The time waited for the slot, in seconds.
+        :rtype: float
+        """
+
+        config = self.__config
+        now = self.__clock.monotonic()
+        with self.__lock:
+            if self.__free > 0 and len(self.__waiting) == 0:
+                self.__free -= 1
+                self.__admit(high, now, now)
+                return 0.
+            deadline = now + (config.high_deadline_sec if high
+                              else config.low_deadline_sec)
+            event = self.__clock.event()
+            heapq.heappush(self.__waiting,
+                           [deadline, self.__seq, high, now, event])
+            self.__seq += 1
+            if high:
+                self.__high_waiting += 1
+            else:
+                self._deferred += 1
+        event.wait()
+        return self.__clock.monotonic() - now
+
+    def release(self):
+        """
+        Release the slot of a processed frame, handing it to the waiting
+        frame of the earliest deadline.
+        """
+
+        with self.__lock:
+            if len(self.__waiting) == 0:
+                self.__free += 1
+                return
+            (_, _, high, enqueued, event) = heapq.heappop(self.__waiting)
+            if high:
+                self.__high_waiting -= 1
+            elif self.__high_waiting != 0:
+                self._promoted += 1
+            self.__admit(high, enqueued, self.__clock.monotonic())
+        event.set()
+        return
+
+    def stats(self) -> dict:
+        """
+        Get the admission counters of the scheduler.
+
+        :rtype: dict
+        """
+
+        return {"slots": self.__slots, "admitted": self._admitted,
+                "deferred": self._deferred, "promoted": self._promoted,
+                "deadline_missed": self._missed,
+                "waiting": len(self.__waiting)}
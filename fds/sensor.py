@@ -1,4 +1,4 @@
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Iterable
 from abc import abstractmethod
 
 import logging
@@ -7,6 +7,9 @@ import numpy as np
 import rplidar
 
 from .serialization import loadCalibration
+from .arena import ScratchArena, partitionRows
+from .dtypes import resolveDType
+from .clock import Clock
 from .dataclasses import BoundsCalibrationData, CalibrationData, SensorInfo, \
     SensorClassType, LidarDeviceType
 
@@ -21,7 +24,9 @@ class SensorCalibration(object):
 
 class LidarCalibration(SensorCalibration):
 
-    def filterFunc(self, points: np.ndarray):
+    def filterFunc(self, points: np.ndarray,
+                   out: Optional[Tuple[np.ndarray, np.ndarray]] = None
+                   ) -> Tuple[np.ndarray, np.ndarray]:
         raise NotImplementedError
 
 
@@ -31,7 +36,8 @@ class RPLidarCalibration(LidarCalibration):
 
 class BoundsFiltering(RPLidarCalibration):
 
-    def __init__(self, data: BoundsCalibrationData):
+    def __init__(self, data: BoundsCalibrationData,
+                 dtype: Optional[np.dtype] = None):
         """
         :param bounds: Array of shape (n, 2), where the second dimension is
             structured in the format (a, b) where `a` is the end of the
@@ -39,12 +45,21 @@ class BoundsFiltering(RPLidarCalibration):
             for the interval.
             Arc-interval in the passed array is assumed to increase.
         :type bounds: np.ndarray
+        :param dtype: Data type of the samples to filter, defaults to the
+            dtype policy.
+        :type dtype: Optional[np.dtype]
         """
 
-        self._bounds = data.arcsec_bounds
+        dtype = resolveDType(dtype)
+        # Bounds are kept in the type of the samples, so comparing them does
+        #  not convert the samples
+        self._bounds = np.asarray(data.arcsec_bounds, dtype=dtype)
+        self.__scratch = ScratchArena(dtype=dtype)
         return
 
-    def filterFunc(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    def filterFunc(self, points: np.ndarray,
+                   out: Optional[Tuple[np.ndarray, np.ndarray]] = None
+                   ) -> Tuple[np.ndarray, np.ndarray]:
         """
         :param points: An array of polar points of shape (n, 2), where the
             second dimension is structured in the format (deg, dist) where
@@ -52,25 +67,38 @@ class BoundsFiltering(RPLidarCalibration):
             of a point.
             Points are assumed to be listed in increasing angle.
         :type points: np.ndarray
+        :param out: A pair of arrays of at least `n` rows to write unculled
+            and culled points to, instead of allocating them.
+        :type out: Optional[Tuple[np.ndarray, np.ndarray]]
+        :return: A tuple of unculled and culled points, respectively, as views
+            of `out` if given.
+        :rtype: Tuple[np.ndarray, np.ndarray]
         """
 
+        points = points.reshape(-1, 2)
+        n = len(points)
         bounds = self._bounds
-        unculled_list = []
-        culled_list = []
-
-        i = 0
-        for p in points:
-            # Go to next interval if the next point(s) exceed the arc
-            if p[0] > bounds[i][0]:
-                i += 1
-            # For the selected interval, cull points if they are over the bound
-            if p[1] > bounds[i][1]:
-                culled_list.append(p)
-            else:
-                unculled_list.append(p)
-
-        unculled = np.array(unculled_list)
-        culled = np.array(culled_list)
+        scratch = self.__scratch
+
+        # Points are sorted, so the interval of each point is the number of
+        #  interval ends it exceeds, counted from where each end falls
+        ends = np.searchsorted(points[:, 0], bounds[:, 0], side="right")
+        interval = scratch.take("interval", n + 1, cols=None, dtype=np.intp)
+        interval.fill(0)
+        np.add.at(interval, ends, 1)
+        np.cumsum(interval, out=interval)
+
+        bound = scratch.take("bound", n, cols=None, dtype=points.dtype)
+        np.take(bounds[:, 1], interval[0:n], out=bound, mode="clip")
+        # For the selected interval, cull points if they are over the bound
+        culled_mask = scratch.take("mask", n, cols=None, dtype=bool)
+        np.greater(points[:, 1], bound, out=culled_mask)
+
+        if out is None:
+            n_culled = int(np.count_nonzero(culled_mask))
+            out = (np.empty((n - n_culled, 2), dtype=points.dtype),
+                   np.empty((n_culled, 2), dtype=points.dtype))
+        (unculled, culled) = partitionRows(points, culled_mask, out, scratch)
         return (unculled, culled)
 
 
@@ -79,6 +107,14 @@ class Sensor(object):
     Abstract class for a generic sensor type.
     """
 
+    @property
+    def info(self) -> SensorInfo:
+        """
+        The information the sensor was initialized with.
+        """
+
+        return self._info
+
     @property
     @classmethod
     @abstractmethod
@@ -97,27 +133,36 @@ class Lidar(Sensor):
     Abstract subclass for a generic LiDAR type.
     """
 
+    DEFAULT_MOTOR_PWM: int = 0
+    # Maximum number of samples of a scan, used to size scratch buffers
+    MAX_SCAN_POINTS: int = 2048
+
     @property
     @classmethod
     def classtype(cls) -> int:
         return SensorClassType.LIDAR
 
     @abstractmethod
-    def getRawSamples(self) -> np.ndarray:
+    def getRawSamples(self, out: Optional[np.ndarray] = None) -> np.ndarray:
         """
         Get a scan from the sensor.
 
+        :param out: An array of at least `MAX_SCAN_POINTS` rows to write
+            samples to, instead of allocating one.
+        :type out: Optional[np.ndarray]
         :return: A set of sample data with shape (n, 2), where samples are of
             the form (degree, distance), with `degree` in units of degrees of
             range [0-360), and `distance` in units of meters of range [0-inf).
-            Both units are of type `float`
+            Both units are of the data type of the sensor. A view of `out` if
+            given and large enough.
         :rtype: np.ndarray
         """
 
         raise NotImplementedError
 
     @abstractmethod
-    def filterSamples(self, samples: np.ndarray
+    def filterSamples(self, samples: np.ndarray,
+                      out: Optional[Tuple[np.ndarray, np.ndarray]] = None
                       ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Get filtered data using the set calibration scheme for
@@ -125,6 +170,9 @@ class Lidar(Sensor):
 
         :param data: A list of scans to process.
         :type data: np.ndarray
+        :param out: A pair of arrays of at least `n` rows to write unculled
+            and culled samples to, instead of allocating them.
+        :type out: Optional[Tuple[np.ndarray, np.ndarray]]
         :return: A tuple with unculled and filtered/culled samples,
             respectively.
         :rtype: Tuple[np.ndarray, np.ndarray]
@@ -140,6 +188,17 @@ class Lidar(Sensor):
     def stopScanning(self):
         raise NotImplementedError
 
+    def setMotorPWM(self, pwm: int):
+        """
+        Set the speed of the motor of the sensor. Does nothing for sensors
+        without a motor speed control.
+
+        :param pwm: Duty cycle of the motor, in device specific units.
+        :type pwm: int
+        """
+
+        return
+
 
 class FDSCalibrationSupportError:
     pass
@@ -152,6 +211,7 @@ class RPLidar(Lidar):
     """
 
     _MIN_SCAN_LEN_DEFAULT = 5
+    DEFAULT_MOTOR_PWM = 660
     CALIBRATIONS_SUPPORT_MAP = {
         BoundsCalibrationData: BoundsFiltering
     }
@@ -160,7 +220,10 @@ class RPLidar(Lidar):
                  calibration_data: Optional[CalibrationData],
                  logger: logging.Logger,
                  baudrate: int = 115200, timeout: int = 1,
-                 min_scan_len: int = _MIN_SCAN_LEN_DEFAULT):
+                 min_scan_len: int = _MIN_SCAN_LEN_DEFAULT,
+                 dtype: Optional[np.dtype] = None):
+        self._info = sensor_info
+        self.__dtype = resolveDType(dtype)
         self.__rpl = rplidar.RPLidar(sensor_info.path, baudrate, timeout,
                                      logger=None)
         self.__min_scan_len = min_scan_len
@@ -171,11 +234,11 @@ class RPLidar(Lidar):
             try:
                 cls = self.CALIBRATIONS_SUPPORT_MAP[type(calibration_data)]
             except KeyError:
-                logger.error(f"Given calibration for sensor `{0}` is not"
-                             f"supported."
+                logger.error("Given calibration for sensor `{0}` is not "
+                             "supported."
                              .format(sensor_info.uid))
                 raise FDSCalibrationSupportError()
-            self.__calibration = cls(calibration_data)
+            self.__calibration = cls(calibration_data, dtype=self.__dtype)
 
         self.__iterator = None
 
@@ -186,14 +249,19 @@ class RPLidar(Lidar):
     def devicetype(cls) -> int:
         return LidarDeviceType.RPLIDAR
 
-    def getRawSamples(self) -> np.ndarray:
+    def getRawSamples(self, out: Optional[np.ndarray] = None) -> np.ndarray:
         scan = next(self.__iterator)
         scan_fv = [(deg, dist) for _, deg, dist in scan]
-        return np.array(scan_fv)
-
-    def filterSamples(self, samples: np.ndarray
+        if out is None or len(scan_fv) > len(out):
+            return np.array(scan_fv, dtype=self.__dtype).reshape(-1, 2)
+        samples = out[0:len(scan_fv)]
+        samples[:] = scan_fv
+        return samples
+
+    def filterSamples(self, samples: np.ndarray,
+                      out: Optional[Tuple[np.ndarray, np.ndarray]] = None
                       ) -> Tuple[np.ndarray, np.ndarray]:
-        return self.__calibration.filterFunc(samples)
+        return self.__calibration.filterFunc(samples, out=out)
 
     def startScanning(self):
         if self.__iterator is None:
@@ -203,8 +271,155 @@ class RPLidar(Lidar):
         return
 
     def stopScanning(self):
-        # self.__rpl.stop_motor()
         self.__rpl.stop()
+        self.__rpl.stop_motor()
+        # Scanning restarts with a new iterator
+        self.__iterator = None
+        return
+
+    def setMotorPWM(self, pwm: int):
+        # Applied to the running motor, and kept for when it restarts
+        self.__rpl.motor_speed = pwm
+        return
+
+
+class ReplayLidar(Lidar):
+    """
+    Lidar replaying recorded scans, each at the time it was recorded relative
+    to the first, in the time of a clock. On a `VirtualClock`, recordings
+    replay as fast as they are processed.
+
+    Scans recorded while the sensor is stopped are skipped, as a stopped
+    sensor does not scan. Once all scans are replayed, the sensor scans no
+    more.
+    """
+
+    DEFAULT_MOTOR_PWM = RPLidar.DEFAULT_MOTOR_PWM
+    CALIBRATIONS_SUPPORT_MAP = RPLidar.CALIBRATIONS_SUPPORT_MAP
+    # Time between checks for scans once all are replayed
+    END_POLL_SEC: float = 1.
+
+    def __init__(self, sensor_info: SensorInfo,
+                 scans: Iterable[Tuple[float, np.ndarray]],
+                 calibration_data: Optional[CalibrationData],
+                 logger: logging.Logger,
+                 clock: Optional[Clock] = None,
+                 dtype: Optional[np.dtype] = None):
+        """
+        :param sensor_info: The information of the sensor replayed.
+        :type sensor_info: SensorInfo
+        :param scans: The timestamped scans to replay, ordered by time, such
+            as from `recordingScans`. Iterated as replayed.
+        :type scans: Iterable[Tuple[float, np.ndarray]]
+        :param calibration_data: The calibration to filter samples with, all
+            samples are unculled without one.
+        :type calibration_data: Optional[CalibrationData]
+        :param logger: The logger to use for logging.
+        :type logger: logging.Logger
+        :param clock: The clock to replay scans in, defaults to real time.
+        :type clock: Optional[Clock]
+        :param dtype: Data type of the samples, defaults to the dtype policy.
+        :type dtype: Optional[np.dtype]
+        """
+
+        self._info = sensor_info
+        self.__dtype = resolveDType(dtype)
+        self.__scans = iter(scans)
+        self.__clock = Clock() if clock is None else clock
+
+        self.__calibration = None
+        if calibration_data is not None:
+            try:
+                cls = self.CALIBRATIONS_SUPPORT_MAP[type(calibration_data)]
+            except KeyError:
+                logger.error("Given calibration for sensor `{0}` is not "
+                             "supported."
+                             .format(sensor_info.uid))
+                raise FDSCalibrationSupportError()
+            self.__calibration = cls(calibration_data, dtype=self.__dtype)
+
+        self.__next: Optional[Tuple[float, np.ndarray]] = None
+        # Offset from the time of the recording to the time of the clock,
+        #  set when first scanning
+        self.__offset: Optional[float] = None
+        self.__started_at = 0.
+        self.__pwm = self.DEFAULT_MOTOR_PWM
+        self._replayed = 0
+        self._skipped = 0
+        self.__finished = False
+
+        self.__logger = logger
+        return
+
+    @property
+    @classmethod
+    def devicetype(cls) -> int:
+        return LidarDeviceType.RPLIDAR
+
+    @property
+    def finished(self) -> bool:
+        """
+        Whether all scans were replayed.
+        """
+
+        return self.__finished
+
+    def __peek(self) -> Optional[Tuple[float, np.ndarray]]:
+        if self.__next is None and not self.__finished:
+            self.__next = next(self.__scans, None)
+            self.__finished = self.__next is None
+        return self.__next
+
+    def getRawSamples(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        clock = self.__clock
+        while True:
+            scan = self.__peek()
+            if scan is None:
+                clock.sleep(self.END_POLL_SEC)
+                continue
+            due = scan[0] + self.__offset
+            if due < self.__started_at:
+                self.__next = None
+                self._skipped += 1
+                continue
+            now = clock.monotonic()
+            if due > now:
+                clock.sleep(due - now)
+            self.__next = None
+            self._replayed += 1
+            break
+
+        samples = np.asarray(scan[1]).reshape(-1, 2)
+        if out is None or len(samples) > len(out):
+            return samples.astype(self.__dtype)
+        out = out[0:len(samples)]
+        np.copyto(out, samples, casting="same_kind")
+        return out
+
+    def filterSamples(self, samples: np.ndarray,
+                      out: Optional[Tuple[np.ndarray, np.ndarray]] = None
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+        if self.__calibration is not None:
+            return self.__calibration.filterFunc(samples, out=out)
+        if out is None:
+            return (samples.copy(), samples[0:0].copy())
+        (unculled, culled) = (out[0][0:len(samples)], out[1][0:0])
+        np.copyto(unculled, samples)
+        return (unculled, culled)
+
+    def startScanning(self):
+        now = self.__clock.monotonic()
+        if self.__offset is None:
+            scan = self.__peek()
+            self.__offset = now - (now if scan is None else scan[0])
+        self.__started_at = now
+        return
+
+    def stopScanning(self):
+        return
+
+    def setMotorPWM(self, pwm: int):
+        self.__pwm = pwm
         return
 
 
@@ -223,14 +438,16 @@ class FDSSensorTypeException(Exception):
     pass
 
 
-def getSensors(sensors_info: List[SensorInfo], logger: logging.Logger
-               ) -> Dict[int, Sensor]:
+def getSensors(sensors_info: List[SensorInfo], logger: logging.Logger,
+               dtype: Optional[np.dtype] = None) -> Dict[int, Sensor]:
     """
     Initialize all sensors used by the FDS.
 
     :param List[SensorInfo] sensors_info: A list of SensorInfos with details
         for Initializing Sensors
     :param logging.Logger logger: A logger for logging errors.
+    :param Optional[np.dtype] dtype: Data type of samples of the sensors,
+        defaults to the dtype policy.
     :return: A list of Sensors
     :rtype: Dict[Sensor]
     """
@@ -247,10 +464,10 @@ def getSensors(sensors_info: List[SensorInfo], logger: logging.Logger
             # Get the corresponding class from the map to construct
             cls: Sensor = SENSOR_TYPE_CLASS_MAP[si.classtype][si.devicetype]
         except KeyError:
-            logger.error(f"Sensor info for `{0}` had bad class or device type."
-                         .format(si.location))
+            logger.error("Sensor info for `{0}` had bad class or device "
+                         "type.".format(si.uid))
             raise FDSSensorTypeException
         calibration_data = loadCalibration(si, logger)
-        sensor = cls(si.path, calibration_data, logger=logger)
+        sensor = cls(si, calibration_data, logger=logger, dtype=dtype)
         sensors_dict[si.uid] = sensor
     return sensors_dict
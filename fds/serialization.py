@@ -79,8 +79,8 @@ def loadCalibration(info: SensorInfo, logger: Logger) -> CalibrationData:
 
     expcls = CALIBRATION_MAP[info.calibration_type]
     if not isinstance(obj, expcls):
-        logger.error(f"Incorrect calibration class {0} loaded. "
-                     f"Expected {1}.".format(type(obj), expcls))
+        logger.error("Incorrect calibration class {0} loaded. "
+                     "Expected {1}.".format(type(obj), expcls))
         raise FDSDeserialFormatError
     return obj
 
@@ -94,7 +94,7 @@ def loadTrainingSets(set_path: str, logger: Logger) -> GlobalTrainingSets:
         obj = pickle.load(file)
 
     if not isinstance(obj, GlobalTrainingSets):
-        logger.error(f"Incorrect training set class {0} loaded. "
-                     f"Expected {1}".format(type(obj), GlobalTrainingSets))
+        logger.error("Incorrect training set class {0} loaded. "
+                     "Expected {1}".format(type(obj), GlobalTrainingSets))
         raise FDSDeserialFormatError
     return obj
@@ -0,0 +1,237 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from .util import convertPolarCartesian
+from .clusters import PackedClusters
+
+
+def clusterFeatures(clusters: PackedClusters
+                    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get cartesian features of all clusters in a single pass.
+
+    :param clusters: Clusters of points of form (degree, distance).
+    :type clusters: PackedClusters
+    :return: A tuple of centroids of shape (n_clusters, 2), extents (the
+        diagonal of the bounding box) and point counts, respectively.
+    :rtype: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    """
+
+    if len(clusters) == 0:
+        return (np.empty((0, 2)), np.empty(0), np.empty(0, dtype=int))
+
+    counts = clusters.counts
+    offsets = clusters.offsets[0:-1]
+    cart = convertPolarCartesian(clusters.points)
+
+    ctrs = np.add.reduceat(cart, offsets, axis=0) / counts[:, None]
+    span = np.maximum.reduceat(cart, offsets, axis=0) - \
+        np.minimum.reduceat(cart, offsets, axis=0)
+    extents = np.hypot(span[:, 0], span[:, 1])
+    return (ctrs, extents, counts)
+
+
+class _Track(object):
+    """
+    State of a single tracked cluster.
+    """
+
+    __slots__ = ("uid", "ctr", "extent", "count", "misses", "clsf_extent",
+                 "clsf_count", "activity", "origin", "moved", "fell")
+
+    def __init__(self, uid: int, ctr: np.ndarray, extent: float, count: int):
+        self.uid = uid
+        self.ctr = ctr
+        self.extent = extent
+        self.count = count
+        self.misses = 0
+        # Centroid at creation, and whether the track ever left it or fell
+        self.origin = ctr
+        self.moved = False
+        self.fell = False
+        # Shape at the time of the last classification
+        self.clsf_extent = None
+        self.clsf_count = None
+        self.activity = None
+        return
+
+
+class ClusterTracker(object):
+    """
+    Class for associating clusters across frames, giving each a persistent
+    track identity.
+
+    Clusters are matched to tracks by minimizing a cost of centroid distance
+    and extent difference, computed as a single matrix for all pairs. Tracks
+    remember the activity they were last classified with, so classification
+    is only repeated once the shape of a track has changed, and whether they
+    ever moved from where they were created or fell, so that only static
+    objects are taken for clutter.
+    """
+
+    DEFAULT_MAX_DIST: float = 500.
+    DEFAULT_EXTENT_WEIGHT: float = 0.5
+    DEFAULT_SHAPE_THRESH: float = 0.2
+    DEFAULT_MAX_MISSES: int = 3
+    DEFAULT_STATIC_DIST: float = 50.
+
+    def __init__(self, max_dist: float = DEFAULT_MAX_DIST,
+                 extent_weight: float = DEFAULT_EXTENT_WEIGHT,
+                 shape_thresh: float = DEFAULT_SHAPE_THRESH,
+                 max_misses: int = DEFAULT_MAX_MISSES,
+                 static_dist: float = DEFAULT_STATIC_DIST):
+        """
+        :param max_dist: Maximum centroid distance, in units of distance,
+            between a cluster and the track it is matched to.
+        :type max_dist: float
+        :param extent_weight: Weight of extent difference in the cost of a
+            match.
+        :type extent_weight: float
+        :param shape_thresh: Relative change of extent or point count of a
+            track, since its last classification, to classify it again.
+        :type shape_thresh: float
+        :param max_misses: Number of consecutive frames a track may go
+            unmatched before it is dropped.
+        :type max_misses: int
+        :param static_dist: Maximum distance, in units of distance, of the
+            centroid of a static track from its centroid at creation.
+        :type static_dist: float
+        """
+
+        self.__max_dist = max_dist
+        self.__extent_weight = extent_weight
+        self.__shape_thresh = shape_thresh
+        self.__max_misses = max_misses
+        self.__static_dist = static_dist
+
+        self.__tracks: List[_Track] = []
+        # Tracks matched to each cluster of the latest frame
+        self.__matched: List[_Track] = []
+        self.__next_uid = 0
+        return
+
+    def reset(self):
+        self.__tracks = []
+        self.__matched = []
+        return
+
+    def update(self, clusters: PackedClusters) -> List[int]:
+        """
+        Associate the clusters of a new frame with tracks.
+
+        :param clusters: Clusters of points of form (degree, distance).
+        :type clusters: PackedClusters
+        :return: The track id of each cluster.
+        :rtype: List[int]
+        """
+
+        (ctrs, extents, counts) = clusterFeatures(clusters)
+        tracks = self.__tracks
+        matched: List[Optional[_Track]] = [None] * len(clusters)
+
+        if len(tracks) != 0 and len(clusters) != 0:
+            t_ctrs = np.array([t.ctr for t in tracks])
+            t_extents = np.array([t.extent for t in tracks])
+            dists = np.linalg.norm(ctrs[:, None, :] - t_ctrs[None, :, :],
+                                   axis=2)
+            cost = dists + self.__extent_weight * \
+                np.abs(extents[:, None] - t_extents[None, :])
+            # Pairs too far apart may never be matched
+            cost[dists > self.__max_dist] = np.inf
+            cost_finite = np.where(np.isinf(cost), 1e12, cost)
+            (rows, cols) = linear_sum_assignment(cost_finite)
+            for (r, c) in zip(rows, cols):
+                if not np.isinf(cost[r, c]):
+                    matched[r] = tracks[c]
+
+        for i in range(0, len(clusters)):
+            track = matched[i]
+            if track is None:
+                track = _Track(self.__next_uid, ctrs[i], extents[i],
+                               counts[i])
+                self.__next_uid += 1
+                tracks.append(track)
+                matched[i] = track
+            else:
+                track.ctr = ctrs[i]
+                track.extent = extents[i]
+                track.count = counts[i]
+                track.misses = 0
+                if np.linalg.norm(track.ctr - track.origin) > \
+                        self.__static_dist:
+                    track.moved = True
+
+        # Drop tracks unmatched for too long
+        matched_ids = {id(t) for t in matched}
+        for track in tracks:
+            if id(track) not in matched_ids:
+                track.misses += 1
+        self.__tracks = [t for t in tracks
+                         if t.misses <= self.__max_misses]
+
+        self.__matched = matched
+        return [t.uid for t in matched]
+
+    def needsClassify(self, idx: int) -> bool:
+        """
+        Check if a cluster of the latest frame needs classifying, being new or
+        having changed shape since the last classification of its track.
+
+        :param idx: Index of the cluster in the latest frame.
+        :type idx: int
+        :rtype: bool
+        """
+
+        track = self.__matched[idx]
+        if track.activity is None:
+            return True
+        thresh = self.__shape_thresh
+        d_extent = abs(track.extent - track.clsf_extent) / \
+            max(track.clsf_extent, 1e-9)
+        d_count = abs(track.count - track.clsf_count) / \
+            max(track.clsf_count, 1)
+        return (d_extent > thresh) or (d_count > thresh)
+
+    def recordActivity(self, idx: int, activity: int):
+        """
+        Record the classified activity of a cluster of the latest frame with
+        its track.
+        """
+
+        track = self.__matched[idx]
+        track.activity = activity
+        track.clsf_extent = track.extent
+        track.clsf_count = track.count
+        return
+
+    def activityOf(self, idx: int) -> Optional[int]:
+        """
+        Get the last classified activity of the track of a cluster of the
+        latest frame.
+        """
+
+        return self.__matched[idx].activity
+
+    def recordFall(self, idx: int):
+        """
+        Record that a cluster of the latest frame was detected fallen with
+        its track.
+        """
+
+        self.__matched[idx].fell = True
+        return
+
+    def isStatic(self, idx: int) -> bool:
+        """
+        Check if the track of a cluster of the latest frame stayed where it
+        was created and never fell, such that it may be static clutter.
+
+        :param idx: Index of the cluster in the latest frame.
+        :type idx: int
+        :rtype: bool
+        """
+
+        track = self.__matched[idx]
+        return not (track.moved or track.fell)
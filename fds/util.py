@@ -1,8 +1,82 @@
+from typing import Dict, Optional
+
 import numpy as np
 
+from .arena import ScratchArena
+
+
+# Angles of RPLidar samples are fixed point, in steps of 1/64 of a degree
+ANGLE_STEPS_PER_DEG: int = 64
+
+# (cos, sin) of every quantized angle of a revolution, by data type
+_TRIG_TABLE = np.empty((360 * ANGLE_STEPS_PER_DEG, 2))
+np.radians(np.arange(0, len(_TRIG_TABLE)) / ANGLE_STEPS_PER_DEG,
+           out=_TRIG_TABLE[:, 1])
+np.cos(_TRIG_TABLE[:, 1], out=_TRIG_TABLE[:, 0])
+np.sin(_TRIG_TABLE[:, 1], out=_TRIG_TABLE[:, 1])
+_TRIG_TABLES: Dict[np.dtype, np.ndarray] = {_TRIG_TABLE.dtype: _TRIG_TABLE}
+
+
+def _trigTable(dtype: np.dtype) -> np.ndarray:
+    table = _TRIG_TABLES.get(dtype)
+    if table is None:
+        table = _TRIG_TABLE.astype(dtype)
+        _TRIG_TABLES[dtype] = table
+    return table
+
+
+def convertPolarCartesian(pts: np.ndarray,
+                          out: Optional[np.ndarray] = None,
+                          scratch: Optional[ScratchArena] = None
+                          ) -> np.ndarray:
+    """
+    Convert polar points of form (degree, distance) to cartesian points of
+    form (x, y).
+
+    If all angles are quantized to `ANGLE_STEPS_PER_DEG`, as sampled by the
+    sensor, cosines and sines are looked up from a table rather than
+    computed. Other angles, such as those transformed into the frame of a
+    room, are computed.
+
+    :param pts: Points of shape (n, 2).
+    :type pts: np.ndarray
+    :param out: An array of shape (n, 2) to write to, instead of allocating
+        one of the floating point type of `pts`. Must not be `pts`.
+    :type out: Optional[np.ndarray]
+    :param scratch: The arena to take the table indices from, instead of
+        allocating them.
+    :type scratch: Optional[ScratchArena]
+    :rtype: np.ndarray
+    """
+
+    n = len(pts)
+    if out is None:
+        out = np.empty((n, 2), dtype=np.result_type(pts, np.float32))
+
+    # Angles are staged in the output to avoid temporaries. The first angle
+    #  is tested alone, so computed angles are rejected in constant time
+    quantized = n != 0 and \
+        float(pts[0, 0] * ANGLE_STEPS_PER_DEG).is_integer()
+    if quantized:
+        steps = out[:, 0]
+        np.multiply(pts[:, 0], ANGLE_STEPS_PER_DEG, out=steps)
+        np.rint(steps, out=out[:, 1])
+        np.subtract(steps, out[:, 1], out=steps)
+        quantized = not steps.any()
+
+    if quantized:
+        if scratch is None:
+            idx = np.empty(n, dtype=np.intp)
+        else:
+            idx = scratch.take("trig_idx", n, cols=None, dtype=np.intp)
+        np.copyto(idx, out[:, 1], casting="unsafe")
+        # Angles outside of [0, 360) wrap around the table
+        np.take(_trigTable(out.dtype), idx, axis=0, out=out, mode="wrap")
+    else:
+        np.radians(pts[:, 0], out=out[:, 1])
+        np.cos(out[:, 1], out=out[:, 0])
+        np.sin(out[:, 1], out=out[:, 1])
 
-def convertPolarCartesian(pts: np.ndarray) -> np.ndarray:
-    pts = pts.copy()
-    x = pts[:, 1] * np.cos(np.radians(pts[:, 0]))
-    y = pts[:, 1] * np.sin(np.radians(pts[:, 0]))
-    return np.array((x, y)).transpose()
+    np.multiply(out[:, 0], pts[:, 1], out=out[:, 0])
+    np.multiply(out[:, 1], pts[:, 1], out=out[:, 1])
+    return out
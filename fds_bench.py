@@ -0,0 +1,1435 @@
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+import argparse
+import functools
+import logging
+import os
+import pickle
+import signal
+import tempfile
+import urllib.request
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from fds.algs import LidarAlgSet, LidarAlgContext
+from fds.arena import ScratchArena
+from fds.dtypes import DEFAULT_DTYPE, resolveDType
+from fds.acquisition import ScanBuffer, FrameAssembler
+from fds.fusion import ScanFusion
+from fds.gates import OccupancyGate
+from fds.sensor import BoundsFiltering, ReplayLidar
+from fds.room import Room
+from fds.changes import SectorChangeMap, ChangeRestrictedClustering
+from fds.clock import Clock, VirtualClock
+from fds.recorder import BlackBoxRecorder, loadRecording
+from fds.metrics import MetricsRegistry, MetricsServer
+from fds.inference import InferenceService
+from fds.cache import ClassificationCache
+from fds.scheduler import PriorityScheduler
+from fds.util import convertPolarCartesian, ANGLE_STEPS_PER_DEG
+from fds.dataclasses import GlobalTrainingSets, BoundsCalibrationData, \
+    SensorPose, RecorderConfig, GlobalConfig, DomainConfig, RoomConfig, \
+    SensorInfo, SensorClassType, LidarDeviceType, SupervisorConfig, \
+    InferenceConfig, PriorityConfig, OverloadPolicy, RoomCallbacks
+from fds.fds import LogHandler, LogLevel, DomainSupervisor, \
+    runDomainWorker
+from fds.logs import getFDSLogger
+
+
+DEFAULT_SEED = 0
+DEFAULT_SCANS = 50
+DEFAULT_THREADS = 8
+DEFAULT_ITERATIONS = 20
+DEFAULT_KEYPOINTS_NUM = 16
+
+ALLOC_STAGES = ("assemble", "filter", "fuse", "gate", "cluster")
+
+DEFAULT_FRAMES = 200
+DEFAULT_WARMUP = 20
+
+DEFAULT_REPEAT = 200
+# Maximum difference, in units of distance, of looked up conversions
+CONVERT_TOLERANCE = 1e-6
+
+# Minimum fraction of frames clustered and clusters labelled alike by the
+#  dtype policy and double precision
+PARITY_MIN_AGREEMENT = 0.99
+# Maximum difference of the centers of matching clusters, in degrees
+PARITY_CENTER_TOLERANCE = 1e-2
+
+# Events recorded, each after the window of the previous event
+DEFAULT_EVENTS = 4
+RECORDER_FRAME_RATE = 50.
+RECORDER_WINDOW_SEC = 0.4
+RECORDER_POST_SEC = 0.2
+
+DEFAULT_UPDATES = 200000
+# Maximum cost of timing a stage and observing its latency
+METRICS_MAX_UPDATE_SEC = 5e-6
+
+DEFAULT_LOG_FRAMES = 500
+# Time taken by the sink to write a record, as a terminal or disk under load
+LOG_SINK_DELAY_SEC = 0.001
+# Maximum cost added to a frame by logging a record asynchronously
+LOG_MAX_ADDED_SEC = 1e-4
+
+# Domains of the supervisor benchmark: one steady, one which crashes, one
+#  which hangs and one whose room deadlocks shortly after starting
+SUPERVISOR_STEADY = 0
+SUPERVISOR_CRASHING = 1
+SUPERVISOR_HANGING = 2
+SUPERVISOR_STALLING = 3
+SUPERVISOR_FAIL_AFTER_SEC = 0.3
+SUPERVISOR_PROGRESS_TIMEOUT_SEC = 2.
+DEFAULT_SUPERVISE_SEC = 20.
+
+DEFAULT_ROOMS = 8
+DEFAULT_ROUNDS = 10
+
+# Rooms of the priority benchmark polling as fast as admitted, alongside a
+#  single room in the HIGH state processing at its period
+DEFAULT_LOW_ROOMS = 16
+DEFAULT_LOAD_SEC = 5.
+PRIORITY_HIGH_PERIOD_SEC = 0.1
+PRIORITY_DEADLINE_SEC = 0.05
+PRIORITY_LOW_DEADLINE_SEC = 2.
+
+# Scans of the backpressure benchmark unless given, read at the rate of an
+#  RPLidar by two sensors and processed at a third of it
+DEFAULT_BACKPRESSURE_SCANS = 3000
+BACKPRESSURE_SCAN_PERIOD_SEC = 0.1
+BACKPRESSURE_FRAME_PERIOD_SEC = 0.3
+BACKPRESSURE_DEPTH = 5
+BACKPRESSURE_DECIMATION = 2
+
+# Slow drift: a person moves away from the sensor by less than the range
+#  threshold of the change map per frame, next to a still one
+DEFAULT_DRIFT_FRAMES = 60
+DRIFT_STEP = 40.
+DRIFT_START_DIST = 1000.
+DRIFT_NOISE = 2.
+# Maximum difference of the distance of the drifting cluster from the
+#  person, a range threshold and a step of drift
+DRIFT_TOLERANCE = SectorChangeMap.DEFAULT_RANGE_THRESH + DRIFT_STEP
+
+# Replayed activity: the room is empty, then a resident walks in it with a
+#  carer, as clustering needs more than one object in a scan once the walls
+#  are culled, the resident falling in some visits, and both leave
+DEFAULT_REPLAY_HOURS = 1.
+DEFAULT_REPLAY_ROOMS = 1
+DEFAULT_REALTIME_SEC = 30.
+REPLAY_SCAN_PERIOD_SEC = 0.1
+REPLAY_STAND_DIST = 1000.
+REPLAY_FALLEN_DIST = 1600.
+REPLAY_WALK_DEG_PER_SEC = 10.
+REPLAY_HALF_SPAN_DEG = 8.
+REPLAY_CARER_DEG = 60.
+REPLAY_FALL_CHANCE = 0.3
+# Maximum difference of the times of state transitions and first events of
+#  a real-time run from a virtual run, about a LOW period
+REPLAY_TIME_TOLERANCE_SEC = 1.
+
+SCAN_SAMPLES = 360
+SCAN_WALL_DIST = 3000.
+SCAN_MAX_POINTS = 2048
+# Growth of the transient bytes allocated by a stage per frame allowed when
+#  scans grow, as allocations should not depend on the number of points
+ALLOC_SLACK_BYTES = 1024
+
+
+def syntheticScan(rng: np.random.Generator, people: int = 2,
+                  samples: int = SCAN_SAMPLES) -> np.ndarray:
+    """
+    Generate a scan of a round room with people standing in it.
+
+    :return: An array of points of shape (n_points, 2) of form
+        (degree, distance), ordered by increasing angle.
+    """
+
+    ang = np.sort(rng.uniform(0., 360., samples))
+    dist = SCAN_WALL_DIST + rng.normal(0., 10., samples)
+    for _ in range(0, people):
+        ctr = rng.uniform(0., 360.)
+        half_span = rng.uniform(3., 8.)
+        near = np.abs((ang - ctr + 180.) % 360. - 180.) < half_span
+        dist[near] = rng.uniform(800., 2000.) + \
+            rng.normal(0., 15., int(near.sum()))
+    return np.column_stack((ang, dist))
+
+
+def syntheticTrainingSet(rng: np.random.Generator,
+                         nkp: int = DEFAULT_KEYPOINTS_NUM
+                         ) -> GlobalTrainingSets:
+    """
+    Generate a training set of keypoint vectors of two activity labels.
+    """
+
+    kpdata = []
+    labels = []
+    for label in (0, 1):
+        for _ in range(0, 32):
+            base = 1000. + 600. * label
+            kpdata.append(base + rng.normal(0., 50., nkp))
+            labels.append(label)
+    return GlobalTrainingSets(clsf_lidar_knn_nkp=nkp,
+                              clsf_lidar_knn_set_kpdata=kpdata,
+                              clsf_lidar_knn_set_labels=labels)
+
+
+def runPipeline(ctx: LidarAlgContext, scans: list) -> list:
+    """
+    Cluster and classify each scan with a context.
+
+    :return: A list with the cluster centers and labels of each scan.
+    """
+
+    results = []
+    for scan in scans:
+        clusters = ctx.clusterLidarScanAdv(scan)
+        results.append([(round(float(clusters.centers[i]), 6),
+                         ctx.classifyLidarCluster(clusters[i],
+                                                  clusters.centers[i]))
+                        for i in range(0, len(clusters))])
+    return results
+
+
+def stress(args, logger: logging.Logger) -> bool:
+    """
+    Run the pipeline from many threads sharing a single algorithm set, each
+    with its own context, checking every thread gets the serial results.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    training = syntheticTrainingSet(rng)
+    alg_set = LidarAlgSet(training)
+    scans = [syntheticScan(rng) for _ in range(0, args.scans)]
+
+    expected = runPipeline(alg_set.createContext(), scans)
+
+    mismatches = []
+    errors = []
+    lock = threading.Lock()
+    start = threading.Barrier(args.threads)
+
+    def worker(idx: int):
+        try:
+            ctx = alg_set.createContext()
+            start.wait()
+            for _ in range(0, args.iterations):
+                if runPipeline(ctx, scans) != expected:
+                    with lock:
+                        mismatches.append(idx)
+                    return
+        except Exception as e:
+            with lock:
+                errors.append(e)
+        return
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(0, args.threads)]
+    t_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    # Refitting to the same training set must not change any result
+    if args.refit:
+        while any(t.is_alive() for t in threads):
+            alg_set.loadTrainingSet(training)
+            time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - t_start
+
+    frames = args.threads * args.iterations * args.scans
+    logger.info("Stress: {0} threads, {1} frames in {2:.2f}s "
+                "({3:.1f} frames/s).\n".format(args.threads, frames, elapsed,
+                                               frames / elapsed))
+    for e in errors:
+        logger.error("Worker raised: {0!r}\n".format(e))
+    if len(mismatches) != 0:
+        logger.error("Threads {0} diverged from the serial results.\n"
+                     .format(sorted(mismatches)))
+    return len(errors) == 0 and len(mismatches) == 0
+
+
+def allocPeaks(args, samples: int) -> Tuple[dict, dict]:
+    """
+    Run the LOW state frame pipeline of two sensors on preallocated buffers,
+    measuring the peak transient allocation of each stage per frame.
+
+    :return: A tuple of the peak bytes of each stage and the arena stats.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    alg_set = LidarAlgSet(syntheticTrainingSet(rng))
+    arena = ScratchArena(2 * SCAN_MAX_POINTS)
+    ctx = alg_set.createContext(arena=arena)
+
+    bounds = np.column_stack((np.arange(1, 73) * 5.,
+                              np.full(72, SCAN_WALL_DIST - 200.)))
+    filters = [BoundsFiltering(BoundsCalibrationData(arcsec_bounds=bounds))
+               for _ in range(0, 2)]
+    buffers = [ScanBuffer(5, SCAN_MAX_POINTS) for _ in range(0, 2)]
+    assembler = FrameAssembler(buffers, 1.)
+    fusion = ScanFusion([SensorPose(), SensorPose(100., -50., 90.)], 1.)
+    gate = OccupancyGate(min_points=alg_set.dbs_min_samples)
+    scans = [syntheticScan(rng, samples=samples)
+             for _ in range(0, args.scans)]
+
+    peaks = {stage: 0 for stage in ALLOC_STAGES}
+    state = {}
+
+    def runStage(stage: str, func: Callable[[], Any], measure: bool) -> Any:
+        tracemalloc.reset_peak()
+        (current, _) = tracemalloc.get_traced_memory()
+        state[stage] = func()
+        (_, peak) = tracemalloc.get_traced_memory()
+        if measure:
+            peaks[stage] = max(peaks[stage], peak - current)
+        return state[stage]
+
+    def filterAll() -> list:
+        frames = []
+        for (i, (ts, scan)) in enumerate(state["assemble"]):
+            n = len(scan)
+            (unculled, culled) = filters[i].filterFunc(
+                scan, out=(arena.take("unculled{0}".format(i), n),
+                           arena.take("culled{0}".format(i), n)))
+            frames.append((ts, unculled, culled))
+        return frames
+
+    tracemalloc.start()
+    for frame in range(0, args.warmup + args.frames):
+        # Producing scans is the acquisition workers' job, not measured
+        for (i, buffer) in enumerate(buffers):
+            scan = scans[(frame + i) % len(scans)]
+            slot = buffer.spare()
+            slot[0:len(scan)] = scan
+            buffer.push(frame * 0.1, slot[0:len(scan)])
+
+        measure = frame >= args.warmup
+        runStage("assemble", lambda: assembler.assemble(
+            [arena.take("scan0", SCAN_MAX_POINTS),
+             arena.take("scan1", SCAN_MAX_POINTS)]), measure)
+        runStage("filter", filterAll, measure)
+        n_total = sum(len(s[1]) + len(s[2]) for s in state["filter"])
+        (unculled, _) = runStage("fuse", lambda: fusion.fuse(
+            state["filter"], out=(arena.take("unculled", n_total),
+                                  arena.take("culled", n_total))), measure)
+        if runStage("gate", lambda: gate.check(unculled), measure):
+            runStage("cluster", lambda: ctx.clusterLidarScan(unculled),
+                     measure)
+    tracemalloc.stop()
+    return (peaks, arena.stats())
+
+
+def alloc(args, logger: logging.Logger) -> bool:
+    """
+    Measure per-frame allocations of the frame pipeline at two scan sizes,
+    failing if the allocations of any stage grow with the number of points.
+    """
+
+    (peaks_small, _) = allocPeaks(args, SCAN_SAMPLES)
+    (peaks_large, arena_stats) = allocPeaks(args, 4 * SCAN_SAMPLES)
+
+    for stage in ALLOC_STAGES:
+        logger.info("Alloc: {0:<9} peak {1:>8} / {2:>8} bytes/frame "
+                    "({3} / {4} points)\n"
+                    .format(stage, peaks_small[stage], peaks_large[stage],
+                            SCAN_SAMPLES, 4 * SCAN_SAMPLES))
+    logger.info("Alloc: arena {0}\n".format(arena_stats))
+
+    # Clustering is excused for the allocations within DBSCAN
+    grown = [stage for stage in ALLOC_STAGES[:-1]
+             if peaks_large[stage] - peaks_small[stage] > ALLOC_SLACK_BYTES]
+    if len(grown) != 0:
+        logger.error("Allocations of stages {0} grow with scan size.\n"
+                     .format(grown))
+    if arena_stats["grows"] != 0:
+        logger.error("Arena grew {0} times.\n".format(arena_stats["grows"]))
+    return len(grown) == 0 and arena_stats["grows"] == 0
+
+
+def convert(args, logger: logging.Logger) -> bool:
+    """
+    Time polar to cartesian conversion of angles quantized as sampled, which
+    are looked up from tables, against arbitrary angles, which are computed,
+    checking that looked up conversions match computed ones.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    arena = ScratchArena(SCAN_MAX_POINTS)
+    out = np.empty((SCAN_MAX_POINTS, 2))
+
+    computed = [syntheticScan(rng, samples=SCAN_MAX_POINTS)
+                for _ in range(0, args.scans)]
+    quantized = []
+    for scan in computed:
+        scan = scan.copy()
+        scan[:, 0] = np.round(scan[:, 0] * ANGLE_STEPS_PER_DEG) / \
+            ANGLE_STEPS_PER_DEG
+        quantized.append(scan)
+
+    error = 0.
+    for scan in quantized:
+        rad = np.radians(scan[:, 0])
+        expected = np.column_stack((np.cos(rad) * scan[:, 1],
+                                    np.sin(rad) * scan[:, 1]))
+        cart = convertPolarCartesian(scan, out=out, scratch=arena)
+        error = max(error, float(np.abs(cart - expected).max()))
+
+    for (name, scans) in (("quantized", quantized), ("computed", computed)):
+        t_start = time.perf_counter()
+        for _ in range(0, args.repeat):
+            for scan in scans:
+                convertPolarCartesian(scan, out=out, scratch=arena)
+        elapsed = time.perf_counter() - t_start
+        logger.info("Convert: {0:<9} {1:.2f}us/scan ({2} points)\n"
+                    .format(name, 1e6 * elapsed / (args.repeat * len(scans)),
+                            SCAN_MAX_POINTS))
+
+    logger.info("Convert: max error {0:.3g}\n".format(error))
+    if error > CONVERT_TOLERANCE:
+        logger.error("Looked up conversions differ from computed ones.\n")
+    return error <= CONVERT_TOLERANCE
+
+
+def parityRun(alg_set: LidarAlgSet, scans: list) -> Tuple[list, float, int]:
+    """
+    Cluster and classify scans in the data type of an algorithm set.
+
+    :return: A tuple of the cluster sizes, centers and labels of each scan,
+        the elapsed time, and the peak bytes allocated by a frame.
+    """
+
+    ctx = alg_set.createContext()
+    scans = [scan.astype(alg_set.dtype) for scan in scans]
+
+    def runFrame(scan: np.ndarray) -> tuple:
+        clusters = ctx.clusterLidarScanAdv(scan)
+        labels = [ctx.classifyLidarCluster(clusters[i], clusters.centers[i])
+                  for i in range(0, len(clusters))]
+        return (clusters.counts, clusters.centers.astype(float), labels)
+
+    runFrame(scans[0])
+    t_start = time.perf_counter()
+    results = [runFrame(scan) for scan in scans]
+    elapsed = time.perf_counter() - t_start
+
+    # Allocations are measured apart, as tracing slows down the frames
+    peak = 0
+    tracemalloc.start()
+    for scan in scans:
+        tracemalloc.reset_peak()
+        (current, _) = tracemalloc.get_traced_memory()
+        runFrame(scan)
+        (_, frame_peak) = tracemalloc.get_traced_memory()
+        peak = max(peak, frame_peak - current)
+    tracemalloc.stop()
+    return (results, elapsed, peak)
+
+
+def parity(args, logger: logging.Logger) -> bool:
+    """
+    Compare clustering and classification in the data type of the dtype
+    policy against double precision, measuring throughput and allocations of
+    both.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    training = syntheticTrainingSet(rng)
+    scans = [syntheticScan(rng, people=int(rng.integers(0, 4)))
+             for _ in range(0, args.scans)]
+    dtype = resolveDType(args.dtype)
+
+    runs = {}
+    for dt in (np.dtype(np.float64), dtype):
+        (results, elapsed, peak) = parityRun(
+            LidarAlgSet(training, dtype=dt), scans)
+        runs[dt] = results
+        logger.info("Parity: {0:<7} {1:.2f}ms/frame, peak {2} bytes/frame, "
+                    "{3} bytes/scan buffer\n"
+                    .format(dt.name, 1e3 * elapsed / len(scans), peak,
+                            SCAN_SAMPLES * 2 * dt.itemsize))
+
+    frames_alike = 0
+    clusters_n = 0
+    labels_alike = 0
+    center_error = 0.
+    for (ref, res) in zip(runs[np.dtype(np.float64)], runs[dtype]):
+        if not np.array_equal(ref[0], res[0]):
+            continue
+        frames_alike += 1
+        clusters_n += len(ref[2])
+        labels_alike += sum(a == b for (a, b) in zip(ref[2], res[2]))
+        if len(ref[1]) != 0:
+            diff = np.abs((ref[1] - res[1] + 180.) % 360. - 180.)
+            center_error = max(center_error, float(diff.max()))
+
+    frame_agreement = frames_alike / len(scans)
+    label_agreement = labels_alike / clusters_n if clusters_n != 0 else 1.
+    logger.info("Parity: {0}: frames clustered alike {1:.1%}, clusters "
+                "labelled alike {2:.1%}, max center error {3:.3g} deg\n"
+                .format(dtype.name, frame_agreement, label_agreement,
+                        center_error))
+
+    passed = frame_agreement >= PARITY_MIN_AGREEMENT and \
+        label_agreement >= PARITY_MIN_AGREEMENT and \
+        center_error <= PARITY_CENTER_TOLERANCE
+    if not passed:
+        logger.error("Results in {0} diverge from double precision.\n"
+                     .format(dtype.name))
+    return passed
+
+
+def recorder(args, logger: logging.Logger) -> bool:
+    """
+    Record frames at a high rate while triggering fall events, checking that
+    recording a frame allocates nothing, that recordings hold the frames of
+    their window and that the recordings kept stay within their bound.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    scans = [syntheticScan(rng).astype(DEFAULT_DTYPE)
+             for _ in range(0, args.scans)]
+    out_dir = tempfile.mkdtemp(prefix="fds-bench-")
+    config = RecorderConfig(output_dir=out_dir,
+                            window_sec=RECORDER_WINDOW_SEC,
+                            post_sec=RECORDER_POST_SEC,
+                            max_frame_rate=RECORDER_FRAME_RATE,
+                            max_recordings=args.events - 1)
+    rec = BlackBoxRecorder(config, 0, [SCAN_MAX_POINTS, SCAN_MAX_POINTS],
+                           logger)
+    rec.start()
+
+    period = 1. / RECORDER_FRAME_RATE
+    frames_per_event = int((RECORDER_WINDOW_SEC + 2 * RECORDER_POST_SEC) *
+                           RECORDER_FRAME_RATE)
+    elapsed = 0.
+    peak = 0
+    n_frames = 0
+    for event in range(0, args.events):
+        for k in range(0, frames_per_event):
+            scan = scans[n_frames % len(scans)]
+            tracemalloc.start()
+            t_start = time.perf_counter()
+            rec.record(time.monotonic(), [scan, None], scan, scan[0:0])
+            elapsed += time.perf_counter() - t_start
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            n_frames += 1
+            if k == int(RECORDER_WINDOW_SEC * RECORDER_FRAME_RATE):
+                rec.trigger(time.monotonic(), event)
+            time.sleep(period)
+    rec.stop()
+
+    stats = rec.stats()
+    kept = sorted(f for f in os.listdir(rec.directory) if f.endswith(".npy"))
+    mismatched = 0
+    for name in kept:
+        (header, frames) = loadRecording(os.path.join(rec.directory, name))
+        for frame in frames:
+            if np.isnan(frame["ts"]):
+                continue
+            n = frame["unculled_n"]
+            scan = frame["unculled"][0:n]
+            if frame["raw_n"][0] != n or frame["raw_n"][1] != 0 or \
+                    not np.array_equal(frame["raw"][0, 0:n], scan):
+                mismatched += 1
+    logger.info("Recorder: {0} frames, {1:.1f}us/frame, peak {2} bytes/frame, "
+                "ring {3} bytes\n"
+                .format(n_frames, 1e6 * elapsed / n_frames, peak,
+                        stats["ring_bytes"]))
+    logger.info("Recorder: {0}\n".format(stats))
+
+    passed = True
+    if peak > ALLOC_SLACK_BYTES:
+        logger.error("Recording a frame allocated {0} bytes.\n".format(peak))
+        passed = False
+    if stats["recordings"] != args.events or \
+            len(kept) != config.max_recordings:
+        logger.error("Wrote {0} and kept {1} recordings of {2} events.\n"
+                     .format(stats["recordings"], len(kept), args.events))
+        passed = False
+    if mismatched != 0 or stats["errors"] != 0:
+        logger.error("{0} recorded frames differ from their scans.\n"
+                     .format(mismatched))
+        passed = False
+    return passed
+
+
+def metrics(args, logger: logging.Logger) -> bool:
+    """
+    Time the updates made per stage of a frame, and check a scrape of the
+    exporter holds every update.
+    """
+
+    registry = MetricsRegistry().scope(domain=0)
+    hist = registry.histogram("fds_stage_seconds", "Stage latency.",
+                              room=0, stage="bench")
+    counter = registry.counter("fds_fall_events_total", "Fall events.",
+                               room=0)
+    registry.counter("fds_frames_total", "Frames.", room=0
+                     ).setFunction(lambda: args.updates)
+
+    t_start = time.perf_counter()
+    for _ in range(0, args.updates):
+        t = time.perf_counter()
+        hist.observe(time.perf_counter() - t)
+        counter.inc()
+    per_update = (time.perf_counter() - t_start) / args.updates
+
+    server = MetricsServer(registry, "127.0.0.1", 0, logger)
+    server.start()
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:{0}/metrics"
+                                    .format(server.port)) as response:
+            text = response.read().decode("utf-8")
+    finally:
+        server.stop()
+
+    samples = {}
+    for line in text.splitlines():
+        if not line.startswith("#"):
+            (name, value) = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    labels = "{domain=\"0\",room=\"0\"}"
+    expected = {
+        "fds_fall_events_total" + labels: args.updates,
+        "fds_frames_total" + labels: args.updates,
+        "fds_stage_seconds_count{domain=\"0\",room=\"0\",stage=\"bench\"}":
+            args.updates,
+    }
+    missing = [k for (k, v) in expected.items() if samples.get(k) != v]
+    logger.info("Metrics: {0:.2f}us per timed update, {1} samples "
+                "scraped\n".format(1e6 * per_update, len(samples)))
+
+    passed = True
+    if per_update > METRICS_MAX_UPDATE_SEC:
+        logger.error("Updates cost more than {0}us.\n"
+                     .format(1e6 * METRICS_MAX_UPDATE_SEC))
+        passed = False
+    if len(missing) != 0:
+        logger.error("Scrape is missing {0}.\n".format(missing))
+        passed = False
+    return passed
+
+
+class _SlowHandler(logging.Handler):
+    """
+    Handler of a sink which takes a while to write each record.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.written = 0
+        return
+
+    def emit(self, record: logging.LogRecord):
+        self.format(record)
+        time.sleep(LOG_SINK_DELAY_SEC)
+        self.written += 1
+        return
+
+
+def logging_(args, logger: logging.Logger) -> bool:
+    """
+    Time a frame loop logging a warning per frame to a slow sink, written
+    synchronously by the frame thread, asynchronously, and asynchronously
+    with rate limiting, against the loop without logging.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    scan = syntheticScan(rng).astype(DEFAULT_DTYPE)
+    out = np.empty_like(scan)
+
+    def runFrames(target: logging.Logger) -> float:
+        t_start = time.perf_counter()
+        for i in range(0, args.frames):
+            convertPolarCartesian(scan, out=out)
+            if target is not None:
+                target.warning("Frame {0} fell behind".format(i),
+                               extra={"fields": {"room": 0}})
+        return (time.perf_counter() - t_start) / args.frames
+
+    sinks = {}
+    loggers = {}
+    for mode in ("sync", "async", "limited"):
+        sink = _SlowHandler()
+        sinks[mode] = sink
+        if mode == "sync":
+            target = logging.getLogger("fds-bench-" + mode)
+            target.setLevel(LogLevel.INFO)
+            target.addHandler(sink)
+        else:
+            target = getFDSLogger(
+                LogLevel.INFO, name="fds-bench-" + mode, handler=sink,
+                queue_size=args.frames,
+                rate=None if mode == "async" else 1.)
+        target.propagate = False
+        loggers[mode] = target
+
+    base = runFrames(None)
+    added = {mode: runFrames(target) - base
+             for (mode, target) in loggers.items()}
+    for (mode, cost) in added.items():
+        logger.info("Logging: {0:<8} +{1:9.2f}us/frame, {2} records "
+                    "written so far\n".format(mode, 1e6 * cost,
+                                              sinks[mode].written))
+
+    passed = True
+    for mode in ("async", "limited"):
+        if added[mode] > LOG_MAX_ADDED_SEC:
+            logger.error("Logging {0} added {1:.2f}us to a frame.\n"
+                         .format(mode, 1e6 * added[mode]))
+            passed = False
+    return passed
+
+
+def benchScans(uid: int) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    Generate the scans of a sensor of a supervised domain, endlessly, or
+    until failing the worker of the domain as configured by the uid of the
+    sensor, which is that of its domain.
+    """
+
+    rng = np.random.default_rng(uid)
+    t = 0.
+    started = time.monotonic()
+    while True:
+        if time.monotonic() - started >= SUPERVISOR_FAIL_AFTER_SEC:
+            if uid == SUPERVISOR_CRASHING:
+                os._exit(1)
+            if uid == SUPERVISOR_HANGING:
+                os.kill(os.getpid(), signal.SIGSTOP)
+        yield (t, syntheticScan(rng))
+        t += REPLAY_SCAN_PERIOD_SEC
+
+
+class _StallingLidar(ReplayLidar):
+    """
+    A replayed sensor deadlocking the room filtering its scans shortly after
+    starting, while the acquisition of the sensor and the heartbeats of the
+    worker go on.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__started = time.monotonic()
+        self.__never = threading.Event()
+        return
+
+    def filterSamples(self, samples: np.ndarray,
+                      out: Optional[Tuple[np.ndarray, np.ndarray]] = None
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+        if time.monotonic() - self.__started >= SUPERVISOR_FAIL_AFTER_SEC:
+            self.__never.wait()
+        return super().filterSamples(samples, out=out)
+
+
+def benchSensors(sensors_info: List[SensorInfo], logger: logging.Logger,
+                 dtype: Optional[np.dtype] = None) -> dict:
+    """
+    Open replayed sensors in place of the devices, for `runDomainWorker`.
+    """
+
+    return {si.uid: (_StallingLidar if si.uid == SUPERVISOR_STALLING
+                     else ReplayLidar)(si, benchScans(si.uid), None, logger,
+                                       dtype=dtype)
+            for si in sensors_info}
+
+
+def supervisor(args, logger: logging.Logger) -> bool:
+    """
+    Supervise a steady, a crashing, a hanging and a stalling domain of
+    replayed sensors, checking that the failing domains are restarted with
+    backoff, the steady domain is never disturbed and every worker runs on
+    its own cores.
+    """
+
+    tmp_dir = tempfile.mkdtemp(prefix="fds-bench-")
+    training_path = os.path.join(tmp_dir, "training")
+    with open(training_path, "wb") as file:
+        pickle.dump(syntheticTrainingSet(np.random.default_rng(args.seed)),
+                    file)
+
+    sensors = [SensorInfo(uid=i, path="", classtype=SensorClassType.LIDAR,
+                          devicetype=LidarDeviceType.RPLIDAR,
+                          calibration_type=0, calibration_path="")
+               for i in range(0, 4)]
+    dom_configs = [DomainConfig(uid=i, room_configs=[
+        RoomConfig(uid=0, sensors_assigned=[i],
+                   recorder=RecorderConfig(enabled=False))])
+        for i in range(0, 4)]
+    config = GlobalConfig(
+        socket_dir=tmp_dir + os.sep, sensors=sensors,
+        dom_configs=dom_configs, diagnostics_dir=tmp_dir,
+        supervisor=SupervisorConfig(
+            enabled=True, heartbeat_sec=0.1, heartbeat_timeout_sec=0.5,
+            startup_grace_sec=15., restart_backoff_sec=0.2,
+            restart_backoff_max_sec=1., stable_after_sec=60.,
+            progress_timeout_sec=SUPERVISOR_PROGRESS_TIMEOUT_SEC))
+    sup = DomainSupervisor(
+        config, training_path, logger,
+        target=functools.partial(runDomainWorker, get_sensors=benchSensors))
+
+    thread = threading.Thread(target=sup.run)
+    thread.start()
+    time.sleep(args.seconds)
+    health = sup.health()
+    sup.stop()
+    thread.join()
+
+    for (uid, h) in sorted(health.items()):
+        logger.info("Supervisor: domain {0} pid {1} cores {2} sensors {3} "
+                    "restarts {4} ({5})\n"
+                    .format(uid, h["pid"], h["cpus"], h["sensors"],
+                            h["restarts"], h["last_failure"]))
+
+    passed = True
+    steady = health[SUPERVISOR_STEADY]
+    if steady["restarts"] != 0 or not steady["alive"]:
+        logger.error("Steady domain was disturbed.\n")
+        passed = False
+    reported = steady["reported"]
+    frames = 0 if reported is None else \
+        sum(sample["value"]
+            for sample in reported["metrics"].get("fds_frames_total", []))
+    logger.info("Supervisor: steady domain processed {0} frames\n"
+                .format(frames))
+    if frames == 0:
+        logger.error("Steady domain processed no frames.\n")
+        passed = False
+    for uid in (SUPERVISOR_CRASHING, SUPERVISOR_HANGING):
+        if health[uid]["restarts"] < 2:
+            logger.error("Domain {0} was not restarted repeatedly.\n"
+                         .format(uid))
+            passed = False
+    stalling = health[SUPERVISOR_STALLING]
+    if stalling["restarts"] < 1 or \
+            stalling["last_failure"] != "made no progress":
+        logger.error("Stalled domain was not restarted.\n")
+        passed = False
+    for (uid, h) in health.items():
+        reported = h["reported"]
+        if h["cpus"] is not None and reported is not None and \
+                reported["cpus"] != h["cpus"]:
+            logger.error("Domain {0} runs on cores {1}, not {2}.\n"
+                         .format(uid, reported["cpus"], h["cpus"]))
+            passed = False
+        if h["sensors"] != [uid]:
+            logger.error("Domain {0} owns sensors {1}.\n"
+                         .format(uid, h["sensors"]))
+            passed = False
+    return passed
+
+
+def inference(args, logger: logging.Logger) -> bool:
+    """
+    Classify the clusters of many rooms at once, inline and batched by a
+    shared inference service, checking every room gets the same labels and
+    requests are batched.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    alg_set = LidarAlgSet(syntheticTrainingSet(rng))
+    clusters = []
+    for _ in range(0, args.scans):
+        packed = alg_set.createContext().clusterLidarScanAdv(
+            syntheticScan(rng))
+        clusters.extend((np.array(packed[i]), float(packed.centers[i]))
+                        for i in range(0, len(packed)))
+
+    def runRooms(service) -> Tuple[list, float]:
+        # The cache is disabled so that every cluster is predicted
+        contexts = [alg_set.createContext(cache=ClassificationCache(0),
+                                          inference=service)
+                    for _ in range(0, args.rooms)]
+        labels = [None] * args.rooms
+        start = threading.Barrier(args.rooms + 1)
+
+        def room(idx: int):
+            ctx = contexts[idx]
+            start.wait()
+            labels[idx] = [ctx.classifyLidarCluster(pts, ctr)
+                           for _ in range(0, args.rounds)
+                           for (pts, ctr) in clusters]
+            return
+
+        threads = [threading.Thread(target=room, args=(i,))
+                   for i in range(0, args.rooms)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        t_start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return (labels, time.perf_counter() - t_start)
+
+    (expected, inline_sec) = runRooms(None)
+    registry = MetricsRegistry()
+    service = InferenceService(alg_set, InferenceConfig(), registry)
+    service.start()
+    try:
+        (labels, batched_sec) = runRooms(service)
+    finally:
+        service.stop()
+
+    stats = service.stats()
+    snapshot = registry.snapshot()
+    batch_size = snapshot["fds_inference_batch_size"][0]
+    wait = snapshot["fds_inference_wait_seconds"][0]
+    predictions = args.rooms * args.rounds * len(clusters)
+    logger.info("Inference: {0} rooms, {1} predictions, inline {2:.2f}s, "
+                "batched {3:.2f}s, {4:.1f} per batch, {5:.0f}us mean wait, "
+                "{6} timeouts, {7} rejected\n"
+                .format(args.rooms, predictions, inline_sec, batched_sec,
+                        batch_size["sum"] / max(1, batch_size["count"]),
+                        1e6 * wait["sum"] / max(1, wait["count"]),
+                        stats["timeouts"], stats["rejected"]))
+
+    passed = True
+    if labels != expected:
+        logger.error("Batched labels differ from inline labels.\n")
+        passed = False
+    if args.rooms > 1 and stats["batches"] >= stats["requests"]:
+        logger.error("Requests were not batched.\n")
+        passed = False
+    return passed
+
+
+def priorityLoad(alg_set: LidarAlgSet, scan: np.ndarray,
+                 config: PriorityConfig, args) -> Tuple[list, list, dict]:
+    """
+    Run LOW rooms polling as fast as admitted and a HIGH room at its period,
+    each clustering a scan per frame.
+
+    :return: The latencies of the frames of the HIGH room, from due to
+        processed, the frames processed by each LOW room, and the stats of
+        the scheduler.
+    """
+
+    priority = PriorityScheduler(config)
+    done = threading.Event()
+    low_frames = [0] * args.rooms
+    latencies = []
+
+    def frame(ctx: LidarAlgContext, high: bool):
+        priority.acquire(high)
+        try:
+            ctx.clusterLidarScan(scan)
+        finally:
+            priority.release()
+        return
+
+    def low(idx: int):
+        ctx = alg_set.createContext()
+        while not done.is_set():
+            frame(ctx, False)
+            low_frames[idx] += 1
+        return
+
+    def high():
+        ctx = alg_set.createContext()
+        due = time.monotonic()
+        while not done.is_set():
+            time.sleep(max(0., due - time.monotonic()))
+            frame(ctx, True)
+            latencies.append(time.monotonic() - due)
+            due += PRIORITY_HIGH_PERIOD_SEC
+        return
+
+    threads = [threading.Thread(target=low, args=(i,))
+               for i in range(0, args.rooms)]
+    threads.append(threading.Thread(target=high))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    done.set()
+    for thread in threads:
+        thread.join()
+    return (latencies, low_frames, priority.stats())
+
+
+def priority(args, logger: logging.Logger) -> bool:
+    """
+    Load a single processing slot with many LOW rooms, checking the frames
+    of a HIGH room are processed within a bounded latency when admitted by
+    priority, and no LOW room starves.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    alg_set = LidarAlgSet(syntheticTrainingSet(rng))
+    scan = syntheticScan(rng, samples=SCAN_SAMPLES * 4)
+
+    # The time to process a single frame bounds the time a HIGH frame waits
+    #  for the frame being processed to end
+    ctx = alg_set.createContext()
+    t_start = time.perf_counter()
+    for _ in range(0, 20):
+        ctx.clusterLidarScan(scan)
+    work_sec = (time.perf_counter() - t_start) / 20
+
+    # Equal deadlines admit frames in arrival order, as without priorities
+    results = {}
+    for (mode, high_deadline) in (("fifo", PRIORITY_LOW_DEADLINE_SEC),
+                                  ("priority", PRIORITY_DEADLINE_SEC)):
+        config = PriorityConfig(slots=1, high_deadline_sec=high_deadline,
+                                low_deadline_sec=PRIORITY_LOW_DEADLINE_SEC)
+        results[mode] = priorityLoad(alg_set, scan, config, args)
+
+    passed = True
+    for (mode, (latencies, low_frames, stats)) in results.items():
+        p99 = float(np.percentile(latencies, 99))
+        logger.info("Priority: {0:<8} HIGH latency p50 {1:.1f}ms p99 "
+                    "{2:.1f}ms max {3:.1f}ms, LOW frames min {4} max {5}, "
+                    "{6} deferred, {7} promoted\n"
+                    .format(mode, 1e3 * float(np.median(latencies)),
+                            1e3 * p99, 1e3 * max(latencies),
+                            min(low_frames), max(low_frames),
+                            stats["deferred"], stats["promoted"]))
+        if min(low_frames) == 0:
+            logger.error("A LOW room starved with {0}.\n".format(mode))
+            passed = False
+
+    # A HIGH frame waits for at most the frame being processed, and
+    #  processes its own
+    bound = PRIORITY_DEADLINE_SEC + 2 * work_sec
+    p99 = float(np.percentile(results["priority"][0], 99))
+    logger.info("Priority: {0:.1f}ms per frame, HIGH latency bound "
+                "{1:.1f}ms\n".format(1e3 * work_sec, 1e3 * bound))
+    if p99 > bound:
+        logger.error("HIGH latency p99 of {0:.1f}ms exceeds the bound.\n"
+                     .format(1e3 * p99))
+        passed = False
+    return passed
+
+
+def backpressure(args, logger: logging.Logger) -> bool:
+    """
+    Feed two sensor buffers faster than frames are processed, in simulated
+    time, checking each overload policy assembles frames of bounded age and
+    accounts for every scan not used.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    scan = syntheticScan(rng)
+    scan_period = BACKPRESSURE_SCAN_PERIOD_SEC
+    frame_period = BACKPRESSURE_FRAME_PERIOD_SEC
+
+    passed = True
+    for policy in OverloadPolicy:
+        buffers = [ScanBuffer(BACKPRESSURE_DEPTH, SCAN_MAX_POINTS,
+                              policy=policy,
+                              decimation=BACKPRESSURE_DECIMATION)
+                   for _ in range(0, 2)]
+        assembler = FrameAssembler(buffers, scan_period)
+        out = [np.empty((SCAN_MAX_POINTS, 2)) for _ in buffers]
+
+        ages = []
+        used = set()
+        backlog = 0
+        next_frame = frame_period
+        for i in range(0, args.scans):
+            now = i * scan_period
+            while next_frame <= now:
+                frame = assembler.assemble(out)
+                stamps = [f[0] for f in frame if f is not None]
+                ages.append(next_frame - max(stamps))
+                used.update((k, f[0]) for (k, f) in enumerate(frame)
+                            if f is not None)
+                next_frame += frame_period
+            for (k, buffer) in enumerate(buffers):
+                # Sensors are slightly out of phase
+                buffer.push(now + k * 0.01, scan)
+            backlog = max(backlog, max(b.backlog for b in buffers))
+
+        stats = assembler.stats()
+        pushed = sum(b._pushed for b in buffers)
+        # Scans still buffered were neither used nor dropped
+        buffered = sum(b.backlog for b in buffers)
+        age_max = max(ages)
+        logger.info("Backpressure: {0:<11} {1} frames, {2} of {3} scans "
+                    "used, {4} dropped ({5} decimated), max backlog {6}, "
+                    "frame age mean {7:.0f}ms max {8:.0f}ms\n"
+                    .format(policy.name, stats["frames"], len(used), pushed,
+                            stats["dropped"], stats["decimated"], backlog,
+                            1e3 * float(np.mean(ages)), 1e3 * age_max))
+
+        if len(used) + stats["dropped"] + buffered != pushed:
+            logger.error("{0} lost track of scans.\n".format(policy.name))
+            passed = False
+        # Frames are assembled from the newest kept scans, at most a
+        #  decimated run of scans old
+        bound = BACKPRESSURE_DECIMATION * scan_period + 0.01
+        if age_max > bound:
+            logger.error("{0} assembled a frame {1:.0f}ms old.\n"
+                         .format(policy.name, 1e3 * age_max))
+            passed = False
+    return passed
+
+
+def drift(args, logger: logging.Logger) -> bool:
+    """
+    Cluster a person drifting slowly away from the sensor next to a still
+    one with change restricted clustering, checking the drifting cluster
+    follows the person and both clusters are re-classified at least once
+    per carry limit.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    alg_set = LidarAlgSet(syntheticTrainingSet(rng))
+    change_map = SectorChangeMap()
+    clustering = ChangeRestrictedClustering(alg_set.createContext(),
+                                            SectorChangeMap())
+    max_carry = ChangeRestrictedClustering.DEFAULT_MAX_CARRY
+    # The drifting and the still person, by the sector of their center
+    centers = (90., 200.)
+    center_sectors = change_map.sectorsOf(
+        np.column_stack((centers, np.zeros(len(centers)))))
+
+    passed = True
+    error_max = 0.
+    carried = [0] * len(centers)
+    carried_max = [0] * len(centers)
+    for k in range(0, args.frames):
+        dists = (DRIFT_START_DIST + DRIFT_STEP * k, DRIFT_START_DIST)
+        parts = []
+        for (ctr, dist) in zip(centers, dists):
+            ang = ctr + np.linspace(-6., 6., 24)
+            parts.append(np.column_stack(
+                (ang, dist + rng.normal(0., DRIFT_NOISE, len(ang)))))
+        (clusters, activities) = clustering.update(np.concatenate(parts))
+
+        for (j, sector) in enumerate(center_sectors):
+            found = [i for i in range(0, len(clusters))
+                     if (change_map.sectorsOf(clusters[i]) == sector).any()]
+            if len(found) != 1:
+                logger.error("Frame {0} has {1} clusters of person {2}.\n"
+                             .format(k, len(found), j))
+                passed = False
+                continue
+            i = found[0]
+            error_max = max(error_max,
+                            abs(float(np.mean(clusters[i][:, 1])) -
+                                dists[j]))
+            # Clusters are classified once, and carried with their activity
+            if activities[i] is None:
+                clustering.recordActivity(i, 0)
+                carried[j] = 0
+            else:
+                carried[j] += 1
+            carried_max[j] = max(carried_max[j], carried[j])
+
+    logger.info("Drift: {0} frames of {1:.0f} per frame, max distance "
+                "error {2:.0f}, drifting cluster carried for at most {3} "
+                "frames, still cluster for {4}\n"
+                .format(args.frames, DRIFT_STEP, error_max, *carried_max))
+    if error_max > DRIFT_TOLERANCE:
+        logger.error("A cluster was {0:.0f} from its person.\n"
+                     .format(error_max))
+        passed = False
+    if max(carried_max) > max_carry:
+        logger.error("A cluster was carried for {0} frames.\n"
+                     .format(max(carried_max)))
+        passed = False
+    return passed
+
+
+def replayEpisodes(rng: np.random.Generator, duration_sec: float
+                   ) -> List[Tuple[float, float, Optional[float]]]:
+    """
+    Generate visits to a room over a duration.
+
+    :return: A list of the start and end of each visit, and the time the
+        resident fell during it, or `None`.
+    """
+
+    episodes = []
+    t = 0.
+    while True:
+        start = t + rng.uniform(60., 1800.)
+        end = start + rng.uniform(20., 300.)
+        if end > duration_sec:
+            break
+        fall = None
+        if rng.uniform() < REPLAY_FALL_CHANCE:
+            fall = end - min(20., (end - start) / 2)
+        episodes.append((start, end, fall))
+        t = end
+    return episodes
+
+
+def replayScans(seed: int, duration_sec: float,
+                episodes: List[Tuple[float, float, Optional[float]]]
+                ) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    Generate the scans of a room with the given visits, lazily.
+    """
+
+    rng = np.random.default_rng(seed)
+    ang = np.linspace(0., 360., SCAN_SAMPLES, endpoint=False)
+    i = 0
+    for k in range(0, int(duration_sec / REPLAY_SCAN_PERIOD_SEC)):
+        t = k * REPLAY_SCAN_PERIOD_SEC
+        while i < len(episodes) and episodes[i][1] <= t:
+            i += 1
+        dist = SCAN_WALL_DIST + rng.normal(0., 10., SCAN_SAMPLES)
+        if i < len(episodes) and episodes[i][0] <= t:
+            (start, _, fall) = episodes[i]
+            fallen = fall is not None and t >= fall
+            ctr = 90. + REPLAY_WALK_DEG_PER_SEC * (t - start)
+            fallen_ctr = 90. + REPLAY_WALK_DEG_PER_SEC * (fall - start) \
+                if fallen else ctr
+            for (person_ctr, base) in (
+                    (fallen_ctr, REPLAY_FALLEN_DIST if fallen
+                     else REPLAY_STAND_DIST),
+                    (ctr + REPLAY_CARER_DEG, REPLAY_STAND_DIST)):
+                near = np.abs((ang - person_ctr + 180.) % 360. - 180.) < \
+                    REPLAY_HALF_SPAN_DEG
+                dist[near] = base + rng.normal(0., 15., int(near.sum()))
+        yield (t, np.column_stack((ang, dist)))
+    return
+
+
+def replayRun(alg_set: LidarAlgSet, scans: List[Iterator], clock: Clock,
+              duration_sec: float, logger: logging.Logger,
+              range_image_bins: Optional[int] = None
+              ) -> Tuple[list, list, dict]:
+    """
+    Replay scans through a room per iterator in the time of a clock,
+    processing them as samples or as range images of the given number of
+    bins. Several rooms share a single processing slot and batch their
+    classification, as the rooms of a domain do.
+
+    :return: The times, rooms and names of the states entered by the rooms,
+        the times, rooms and track ids of their fall events, relative to the
+        start, and the stats of the scheduler and the batching if shared.
+    """
+
+    bounds = np.column_stack((np.arange(1, 73) * 5.,
+                              np.full(72, SCAN_WALL_DIST - 200.)))
+    start = clock.monotonic()
+    states = []
+    events = []
+    callbacks = RoomCallbacks(
+        event_cb=lambda room, track: events.append(
+            (round(clock.monotonic() - start, 6), room, track)),
+        pushdata_cb=lambda room, geometry, clusters: None,
+        state_cb=lambda room, state: states.append(
+            (round(clock.monotonic() - start, 6), room, state.name)))
+
+    # Rooms contend for one slot, so that frames are deferred and promoted
+    inference = None
+    priority = None
+    if len(scans) > 1:
+        inference = InferenceService(alg_set, InferenceConfig(), clock=clock)
+        inference.start()
+        priority = PriorityScheduler(PriorityConfig(slots=1), clock=clock)
+
+    threads = []
+    for (uid, room_scans) in enumerate(scans):
+        info = SensorInfo(uid=uid, path="", classtype=SensorClassType.LIDAR,
+                          devicetype=LidarDeviceType.RPLIDAR,
+                          calibration_type=0, calibration_path="")
+        sensor = ReplayLidar(info, room_scans,
+                             BoundsCalibrationData(arcsec_bounds=bounds),
+                             logger, clock=clock)
+        config = RoomConfig(uid=uid, sensors_assigned=[uid],
+                            range_image_bins=range_image_bins)
+        config.recorder.enabled = False
+        room = Room(config, alg_set, [sensor], callbacks, logger,
+                    inference=inference, priority=priority, clock=clock)
+        threads.append(clock.thread(room.run,
+                                    name="FDS Replay Room {0}".format(uid),
+                                    daemon=True))
+    for thread in threads:
+        thread.start()
+    if isinstance(clock, VirtualClock):
+        clock.run(start + duration_sec)
+    else:
+        time.sleep(duration_sec)
+    # The rooms run on, their results are copied as of the end
+    stats = {}
+    if priority is not None:
+        stats = {"priority": priority.stats(),
+                 "inference": inference.stats()}
+    return (list(states), list(events), stats)
+
+
+def replay(args, logger: logging.Logger) -> bool:
+    """
+    Replay hours of generated activity through rooms on a virtual clock
+    twice, checking both runs enter the same states, emit the same events
+    at the same times and admit the same frames, and replay a short visit
+    through a room in real time, checking it enters the same states at about
+    the same times.
+    """
+
+    rng = np.random.default_rng(args.seed)
+    alg_set = LidarAlgSet(syntheticTrainingSet(rng))
+    duration = 3600. * args.hours
+    episodes = [replayEpisodes(rng, duration)
+                for _ in range(0, args.rooms)]
+    visits = sum(len(e) for e in episodes)
+    falls = sum(1 for e in episodes for visit in e if visit[2] is not None)
+
+    runs = []
+    for _ in range(0, 2):
+        t_start = time.perf_counter()
+        runs.append(replayRun(alg_set,
+                              [replayScans(args.seed + k, duration, e)
+                               for (k, e) in enumerate(episodes)],
+                              VirtualClock(), duration, logger,
+                              args.range_image_bins))
+        elapsed = time.perf_counter() - t_start
+        (states, events, stats) = runs[-1]
+        logger.info("Replay: {0:.1f}h of {1} rooms with {2} visits, {3} "
+                    "falls in {4:.1f}s ({5:.0f}x real time), {6} "
+                    "transitions, {7} fall events\n"
+                    .format(args.hours, args.rooms, visits, falls, elapsed,
+                            duration / elapsed, len(states), len(events)))
+        if len(stats) != 0:
+            logger.info("Replay: priority {0}, inference {1}\n"
+                        .format(stats["priority"], stats["inference"]))
+
+    passed = True
+    if runs[0] != runs[1]:
+        logger.error("Virtual runs diverged.\n")
+        passed = False
+    if falls != 0 and len(runs[0][1]) == 0:
+        logger.error("No fall was detected.\n")
+        passed = False
+
+    if args.realtime > 0:
+        visit = [(args.realtime / 6, args.realtime * 5 / 6,
+                  args.realtime / 2)]
+        results = [replayRun(alg_set,
+                             [replayScans(args.seed, args.realtime, visit)],
+                             clock, args.realtime, logger,
+                             args.range_image_bins)
+                   for clock in (VirtualClock(), Clock())]
+        ((virtual_states, virtual_events, _),
+         (real_states, real_events, _)) = results
+        logger.info("Replay: {0:.0f}s visit, virtual states {1}, real-time "
+                    "states {2}\n".format(args.realtime, virtual_states,
+                                          real_states))
+        if [s[2] for s in virtual_states] != [s[2] for s in real_states] or \
+                any(abs(v[0] - r[0]) > REPLAY_TIME_TOLERANCE_SEC
+                    for (v, r) in zip(virtual_states, real_states)):
+            logger.error("Real-time run entered other states.\n")
+            passed = False
+        if (len(virtual_events) == 0) != (len(real_events) == 0) or \
+                (len(real_events) != 0 and
+                 abs(virtual_events[0][0] - real_events[0][0]) >
+                 REPLAY_TIME_TOLERANCE_SEC):
+            logger.error("Real-time run emitted other events.\n")
+            passed = False
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, nargs="?", default=DEFAULT_SEED)
+    # Modes default to scans of their own, see below
+    parser.add_argument("--scans", "-n", type=int, nargs="?", default=None)
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    parser_stress = subparsers.add_parser("stress")
+    parser_stress.add_argument("--threads", "-t", type=int, nargs="?",
+                               default=DEFAULT_THREADS)
+    parser_stress.add_argument("--iterations", "-i", type=int, nargs="?",
+                               default=DEFAULT_ITERATIONS)
+    parser_stress.add_argument("--refit", "-r", action="store_true",
+                               default=False)
+
+    parser_alloc = subparsers.add_parser("alloc")
+    parser_alloc.add_argument("--frames", "-f", type=int, nargs="?",
+                              default=DEFAULT_FRAMES)
+    parser_alloc.add_argument("--warmup", "-w", type=int, nargs="?",
+                              default=DEFAULT_WARMUP)
+
+    parser_convert = subparsers.add_parser("convert")
+    parser_convert.add_argument("--repeat", "-r", type=int, nargs="?",
+                                default=DEFAULT_REPEAT)
+
+    parser_parity = subparsers.add_parser("parity")
+    parser_parity.add_argument("--dtype", "-d", type=str, nargs="?",
+                               default=DEFAULT_DTYPE.name)
+
+    parser_recorder = subparsers.add_parser("recorder")
+    parser_recorder.add_argument("--events", "-e", type=int, nargs="?",
+                                 default=DEFAULT_EVENTS)
+
+    parser_metrics = subparsers.add_parser("metrics")
+    parser_metrics.add_argument("--updates", "-u", type=int, nargs="?",
+                                default=DEFAULT_UPDATES)
+
+    parser_logging = subparsers.add_parser("logging")
+    parser_logging.add_argument("--frames", "-f", type=int, nargs="?",
+                                default=DEFAULT_LOG_FRAMES)
+
+    parser_supervisor = subparsers.add_parser("supervisor")
+    parser_supervisor.add_argument("--seconds", "-s", type=float, nargs="?",
+                                   default=DEFAULT_SUPERVISE_SEC)
+
+    parser_inference = subparsers.add_parser("inference")
+    parser_inference.add_argument("--rooms", "-r", type=int, nargs="?",
+                                  default=DEFAULT_ROOMS)
+    parser_inference.add_argument("--rounds", "-i", type=int, nargs="?",
+                                  default=DEFAULT_ROUNDS)
+
+    parser_priority = subparsers.add_parser("priority")
+    parser_priority.add_argument("--rooms", "-r", type=int, nargs="?",
+                                 default=DEFAULT_LOW_ROOMS)
+    parser_priority.add_argument("--seconds", "-s", type=float, nargs="?",
+                                 default=DEFAULT_LOAD_SEC)
+
+    subparsers.add_parser("backpressure")
+
+    parser_drift = subparsers.add_parser("drift")
+    parser_drift.add_argument("--frames", "-f", type=int, nargs="?",
+                              default=DEFAULT_DRIFT_FRAMES)
+
+    parser_replay = subparsers.add_parser("replay")
+    parser_replay.add_argument("--hours", "-H", type=float, nargs="?",
+                               default=DEFAULT_REPLAY_HOURS)
+    parser_replay.add_argument("--realtime", "-t", type=float, nargs="?",
+                               default=DEFAULT_REALTIME_SEC)
+    parser_replay.add_argument("--rooms", "-r", type=int, nargs="?",
+                               default=DEFAULT_REPLAY_ROOMS)
+    parser_replay.add_argument("--range-image-bins", "-b", type=int,
+                               nargs="?", default=None)
+
+    args = parser.parse_args()
+    if args.scans is None:
+        args.scans = DEFAULT_BACKPRESSURE_SCANS \
+            if args.mode == "backpressure" else DEFAULT_SCANS
+
+    logger = logging.getLogger("fds-bench")
+    logger.setLevel(LogLevel.INFO)
+    logger.addHandler(LogHandler(LogLevel.INFO))
+
+    modes = {
+        "stress": stress,
+        "alloc": alloc,
+        "convert": convert,
+        "parity": parity,
+        "recorder": recorder,
+        "metrics": metrics,
+        "logging": logging_,
+        "supervisor": supervisor,
+        "inference": inference,
+        "priority": priority,
+        "backpressure": backpressure,
+        "drift": drift,
+        "replay": replay,
+    }
+    passed = modes[args.mode](args, logger)
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
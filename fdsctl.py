@@ -1,9 +1,89 @@
+import argparse
+import json
+import sys
+
 import zmq
 
+from fds.domain import Domain
+from fds.ipc import socketPath
+
+
+DEFAULT_SOCKET_DIR = "./"
+DEFAULT_DOMAIN = 0
+DEFAULT_TIMEOUT_SEC = 10.
+
+# Commands by name, and the options passed as their data
+COMMANDS = {
+    "pause": (Domain.Callback.PAUSE, ()),
+    "resume": (Domain.Callback.RESUME, ()),
+    "stats": (Domain.Callback.STATS, ()),
+    "profile-start": (Domain.Callback.PROFILE_START,
+                      ("duration_sec", "interval_sec")),
+    "profile-stop": (Domain.Callback.PROFILE_STOP, ()),
+    "stacks": (Domain.Callback.DUMP_STACKS, ()),
+    "tracemalloc-start": (Domain.Callback.TRACEMALLOC_START, ("frames",)),
+    "tracemalloc-snapshot": (Domain.Callback.TRACEMALLOC_SNAPSHOT, ()),
+    "tracemalloc-stop": (Domain.Callback.TRACEMALLOC_STOP, ()),
+}
+
+
+def sendCommand(socket_dir: str, domain: int, cmd_type: int, data: dict,
+                timeout_sec: float):
+    """
+    Send a command to the command socket of a domain and wait for its
+    result.
+
+    :return: The decoded result of the command.
+    :raises TimeoutError: If the domain did not reply in time.
+    """
+
+    ctx = zmq.Context()
+    sock = ctx.socket(zmq.REQ)
+    sock.setsockopt(zmq.LINGER, 0)
+    try:
+        sock.connect("ipc://" + socketPath(socket_dir, domain, "rep"))
+        sock.send_string(json.dumps({"type": int(cmd_type), "data": data}))
+        if sock.poll(int(timeout_sec * 1000)) == 0:
+            raise TimeoutError("Domain {0} did not reply within {1} seconds."
+                               .format(domain, timeout_sec))
+        return json.loads(sock.recv())
+    finally:
+        sock.close()
+        ctx.term()
+
 
 def main():
-    pass
+    parser = argparse.ArgumentParser(
+        description="Control a running fall detection system.")
+    parser.add_argument("--socket-dir", "-s", type=str, nargs="?",
+                        default=DEFAULT_SOCKET_DIR)
+    parser.add_argument("--domain", "-d", type=int, nargs="?",
+                        default=DEFAULT_DOMAIN)
+    parser.add_argument("--timeout", "-t", type=float, nargs="?",
+                        default=DEFAULT_TIMEOUT_SEC)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name in COMMANDS:
+        subparsers.add_parser(name)
+    parser_profile = subparsers.choices["profile-start"]
+    parser_profile.add_argument("--duration-sec", type=float)
+    parser_profile.add_argument("--interval-sec", type=float)
+    parser_tracemalloc = subparsers.choices["tracemalloc-start"]
+    parser_tracemalloc.add_argument("--frames", type=int)
+
+    args = parser.parse_args()
+
+    (cmd_type, options) = COMMANDS[args.command]
+    data = {k: getattr(args, k) for k in options
+            if getattr(args, k) is not None}
+    try:
+        result = sendCommand(args.socket_dir, args.domain, cmd_type, data,
+                             args.timeout)
+    except TimeoutError as err:
+        sys.stderr.write("{0}\n".format(err))
+        return 1
+    sys.stdout.write(json.dumps(result, indent=2) + "\n")
+    return 1 if isinstance(result, dict) and "error" in result else 0
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())